@@ -0,0 +1,162 @@
+# Benchmark for GUI thread work, runs without a screen (Qt offscreen platform)
+# Measures:
+#   - one ingest tick (Window.update_data_real with 10 new packets) and the frame that
+#     draws it, at different history lengths
+#   - DateAxisItem.tickValues and tickStrings for different time ranges, with empty
+#     cache (first draw after zoom) and with cache (all other graphs, redraws)
+#   - Window.add_marker and sending the new point to map, at different track lengths
+# JavaScript isn't run in map for the last one, only the work done in GUI thread is measured.
+#
+# Run from repository root: python benchmarks/bench_gui.py
+import os
+import sys
+import statistics
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+from PyQt5.QtWidgets import QApplication
+
+from synthetic import flight_packets, flight_values, START_TIME
+from telemetry_store import FIELD_NAMES
+
+
+HISTORY_LENGTHS = [10 ** 3, 10 ** 4, 10 ** 5]
+# Packets in one tick, 100 ms at 100 packets/s
+TICK_PACKETS = 10
+TICKS = 100
+
+AXIS_RANGES = [("10 s", 10), ("10 min", 600), ("6 h", 6 * 3600), ("7 days", 7 * 86400),
+               ("1 year", 365 * 86400), ("5 years", 5 * 365 * 86400)]
+AXIS_WIDTH = 800
+AXIS_CALLS = 200
+
+TRACK_LENGTHS = [10 ** 2, 10 ** 3, 10 ** 4, 10 ** 5]
+MARKER_TICKS = 200
+
+
+# Draws everything that has changed, like scheduler does when its timer fires
+def draw(window):
+    window.redrawScheduler._frame()
+
+
+def bench_update(main):
+    results = []
+    print(f"{'samples':>10} {'ingest, us/tick':>16} {'frame, us':>12}")
+    for length in HISTORY_LENGTHS:
+        main.store_capacity = length + TICKS * TICK_PACKETS
+        window = main.Window()
+        packets = flight_packets(length + TICKS * TICK_PACKETS, corrupted=0.01)
+        window.addPackets(window.store, packets[:length])
+        draw(window)
+
+        ingest = []
+        frames = []
+        for tick in range(TICKS):
+            start = length + tick * TICK_PACKETS
+            main.packet_queue.put_many(packets[start:start + TICK_PACKETS])
+            begin = time.perf_counter()
+            window.update_data_real()
+            middle = time.perf_counter()
+            draw(window)
+            end = time.perf_counter()
+            ingest.append(middle - begin)
+            frames.append(end - middle)
+        window.close()
+        window.deleteLater()
+        QApplication.processEvents()
+
+        result = {"samples": length, "ingest_tick_s": statistics.median(ingest),
+                  "frame_s": statistics.median(frames)}
+        results.append(result)
+        print(f"{length:>10} {result['ingest_tick_s'] * 1e6:16.1f} {result['frame_s'] * 1e6:12.1f}")
+    return results
+
+
+def bench_axis(main):
+    axis = main.DateAxisItem(orientation="bottom")
+    caches = (main.DateAxisItem._tickCache, main.DateAxisItem._stringCache)
+    results = []
+    print(f"{'range':>10} {'ticks, us':>10} {'strings, us':>12} {'cached, us':>11}")
+    for name, seconds in AXIS_RANGES:
+        ticks = strings = cached = 0.0
+        for i in range(AXIS_CALLS):
+            minVal = START_TIME + i * 0.37
+            maxVal = minVal + seconds
+            for cache in caches:
+                cache.clear()
+            begin = time.perf_counter()
+            levels = axis.tickValues(minVal, maxVal, AXIS_WIDTH)
+            middle = time.perf_counter()
+            for spacing, values in levels:
+                axis.tickStrings(values, 1.0, spacing)
+            end = time.perf_counter()
+            # The same range again, now from cache
+            for spacing, values in axis.tickValues(minVal, maxVal, AXIS_WIDTH):
+                axis.tickStrings(values, 1.0, spacing)
+            ticks += middle - begin
+            strings += end - middle
+            cached += time.perf_counter() - end
+        result = {"range": name, "tick_values_s": ticks / AXIS_CALLS,
+                  "tick_strings_s": strings / AXIS_CALLS, "cached_s": cached / AXIS_CALLS}
+        results.append(result)
+        print(f"{name:>10} {result['tick_values_s'] * 1e6:10.1f} {result['tick_strings_s'] * 1e6:12.1f} "
+              f"{result['cached_s'] * 1e6:11.1f}")
+    return results
+
+
+def bench_marker(main):
+    window = main.Window()
+    track = window.track
+    sent = []
+    # Scripts are collected instead of being run in map
+    track.runJavaScript = sent.append
+    track.pageLoaded()
+    values = flight_values(max(TRACK_LENGTHS) + MARKER_TICKS)
+    latitudes = values[:, FIELD_NAMES.index("latitude")]
+    longitudes = values[:, FIELD_NAMES.index("longitude")]
+
+    results = []
+    print(f"{'points':>10} {'mean, us':>10} {'max, us':>10}")
+    for length in TRACK_LENGTHS:
+        track.clear()
+        window.add_marker(latitudes[:length], longitudes[:length])
+        track.flush()
+        times = []
+        for i in range(length, length + MARKER_TICKS):
+            begin = time.perf_counter()
+            window.add_marker(latitudes[i:i + 1], longitudes[i:i + 1])
+            track.flush()
+            times.append(time.perf_counter() - begin)
+            sent.clear()
+        result = {"points": length, "mean_s": statistics.mean(times), "max_s": max(times)}
+        results.append(result)
+        print(f"{length:>10} {result['mean_s'] * 1e6:10.1f} {result['max_s'] * 1e6:10.1f}")
+    window.close()
+    window.deleteLater()
+    QApplication.processEvents()
+    return results
+
+
+def main():
+    app = QApplication.instance() or QApplication([])
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        # Spill files and other files of main.py go to temporary directory
+        os.chdir(directory)
+        try:
+            import main as gui
+            results = {
+                "update": bench_update(gui),
+                "axis": bench_axis(gui),
+                "marker": bench_marker(gui),
+            }
+        finally:
+            os.chdir(cwd)
+    return results
+
+
+if __name__ == "__main__":
+    main()
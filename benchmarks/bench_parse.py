@@ -0,0 +1,61 @@
+# Benchmark for checking and parsing packets
+# Measures how many packets per second can be checked one by one (isDataOK in main.py,
+# which is packet_parser.is_line_ok) and parsed in blocks with packet_parser.parse_lines,
+# for clean packets and for packets damaged like over a bad radio link.
+# Blocks of 10 packets are what GUI gets in one tick at 100 packets/s, blocks of
+# 10000 are what it gets after a freeze or when replaying as fast as possible.
+#
+# Run from repository root: python benchmarks/bench_parse.py
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import packet_parser
+from synthetic import flight_packets
+
+
+PACKETS = 20000
+CORRUPTED = [0.0, 0.01, 0.1, 0.5]
+BLOCK_SIZES = [10, 10000]
+# Every measurement is done this many times and the fastest is kept
+REPEATS = 3
+
+
+def check_one_by_one(lines):
+    for line in lines:
+        packet_parser.is_line_ok(line)
+
+
+def parse_blocks(lines, block):
+    for start in range(0, len(lines), block):
+        packet_parser.parse_lines(lines[start:start + block])
+
+
+def measure(function, *args):
+    best = None
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        function(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main(packets=PACKETS):
+    results = []
+    print(f"{'corrupted':>10} {'method':>14} {'packets/s':>12}")
+    for corrupted in CORRUPTED:
+        lines = [packet for received_time, packet in flight_packets(packets, corrupted=corrupted)]
+        cases = [("isDataOK", check_one_by_one, (lines,))]
+        cases += [(f"block {block}", parse_blocks, (lines, block)) for block in BLOCK_SIZES]
+        for method, function, args in cases:
+            rate = packets / measure(function, *args)
+            results.append({"corrupted": corrupted, "method": method, "packets_per_s": rate})
+            print(f"{corrupted:>10} {method:>14} {rate:12.0f}")
+    return results
+
+
+if __name__ == "__main__":
+    main()
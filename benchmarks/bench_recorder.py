@@ -0,0 +1,62 @@
+# Benchmark for csv recorder
+# Measures how many packets per second CsvRecorder writes to csv file, with and
+# without derived values and with different batch sizes. Packets are given to
+# recorder first and written when it is closed, so only writing is measured,
+# not waiting for recorder thread.
+#
+# Run from repository root: python benchmarks/bench_recorder.py
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from recorder import CsvRecorder
+from derived import DerivedPipeline
+from synthetic import flight_packets
+
+
+PACKETS = 20000
+# Rows written at once, 10 is one packet burst, PACKETS is everything after a long pause
+BATCH_SIZES = [10, 1000, PACKETS]
+REPEATS = 3
+
+
+def record(path, packets, batch, derived):
+    recorder = CsvRecorder(path, flush_rows=batch, derived=DerivedPipeline() if derived else None)
+    for start in range(0, len(packets), batch):
+        for received_time, packet in packets[start:start + batch]:
+            recorder.write(received_time, packet)
+        recorder.flush()
+    recorder.close()
+    os.remove(path)
+
+
+def measure(path, packets, batch, derived):
+    best = None
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        record(path, packets, batch, derived)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main(packets=PACKETS):
+    data = flight_packets(packets, corrupted=0.01)
+    results = []
+    print(f"{'batch':>8} {'derived':>8} {'packets/s':>12}")
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "bench.csv")
+        for derived in (False, True):
+            for batch in BATCH_SIZES:
+                batch = min(batch, packets)
+                rate = packets / measure(path, data, batch, derived)
+                results.append({"batch": batch, "derived": derived, "packets_per_s": rate})
+                print(f"{batch:>8} {str(derived):>8} {rate:12.0f}")
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+# Benchmark for opening recorded sessions for analysis (session_cache.py)
+# Measures how fast column cache is made from csv file and flight log, how long opening
+# with cache takes, and how long one graph line takes to get its points when whole
+# session or a short part of it is shown.
+#
+# Run from repository root: python benchmarks/bench_session.py
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from recorder import format_time, CSV_HEADER
+from flight_log import FlightLogWriter
+from session_cache import open_session, build_cache
+from synthetic import flight_packets
+
+
+ROWS = 200000
+PIXELS = 800
+DECIMATE_CALLS = 50
+
+
+# Csv file like recorder writes, without derived values, so cache has to compute them
+def write_csv(path, packets):
+    with open(path, "w", newline="", encoding="UTF8") as csv_f:
+        csv_f.write(",".join(CSV_HEADER) + "\r\n")
+        csv_f.writelines(f"{format_time(received_time)},{packet}\r\n" for received_time, packet in packets)
+
+
+def write_log(path, packets):
+    writer = FlightLogWriter(path, batch_size=65536)
+    writer.extend([packet[0] for packet in packets], [packet[1] for packet in packets])
+    writer.close()
+
+
+def measure_decimate(session, start_time, end_time):
+    start = time.perf_counter()
+    for i in range(DECIMATE_CALLS):
+        # Range moves a little every time, like when graph is dragged
+        shift = i * 0.5
+        session.decimate("altitude", start_time + shift, end_time + shift, PIXELS)
+    return (time.perf_counter() - start) / DECIMATE_CALLS
+
+
+def main(rows=ROWS):
+    packets = flight_packets(rows, corrupted=0.01)
+    results = []
+    print(f"{'file':>6} {'build, rows/s':>14} {'open, ms':>9} {'whole, us':>10} {'10 min, us':>11}")
+    with tempfile.TemporaryDirectory() as directory:
+        for kind, write in (("csv", write_csv), ("rqlog", write_log)):
+            path = os.path.join(directory, f"session.{kind}")
+            write(path, packets)
+            start = time.perf_counter()
+            build_cache(path)
+            build = time.perf_counter() - start
+
+            start = time.perf_counter()
+            session = open_session(path)
+            opened = time.perf_counter() - start
+
+            whole = measure_decimate(session, session.first_time, session.last_time)
+            part = measure_decimate(session, session.first_time + 600, session.first_time + 1200)
+            result = {"file": kind, "rows": rows, "build_rows_per_s": rows / build, "open_s": opened,
+                      "decimate_whole_s": whole, "decimate_10min_s": part}
+            results.append(result)
+            print(f"{kind:>6} {result['build_rows_per_s']:14.0f} {opened * 1e3:9.1f} {whole * 1e6:10.1f} "
+                  f"{part * 1e6:11.1f}")
+            del session
+    return results
+
+
+if __name__ == "__main__":
+    main()
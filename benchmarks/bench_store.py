@@ -0,0 +1,102 @@
+# Benchmark for telemetry store
+# Measures one graph update tick at different history lengths:
+#   - store: appending one packet and getting data for all 12 graph lines from store.
+#     This doesn't depend on history length.
+#   - plot: the same, and giving whole history to 12 PlotDataItems with setData, like
+#     graphs were updated before decimation. setData still takes longer with longer history,
+#     graphs of the app are drawn from decimated data (see bench_gui.py for a whole tick).
+# Old way (17 Python lists, converted to arrays by setData every tick) is measured next to it.
+# Runs without a screen (Qt offscreen platform).
+#
+# Run from repository root: python benchmarks/bench_store.py
+import os
+import sys
+import time
+
+import numpy
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+import pyqtgraph as pg
+from PyQt5.QtWidgets import QApplication
+
+from telemetry_store import TelemetryStore, COLUMNS
+
+
+# Columns that are drawn in graphs, same as in Window.update_data_real
+PLOTTED = ["temp", "pressure", "humidity", "altitude", "speed", "co2", "eco2",
+           "tvoc", "no2", "pm10", "pm25", "pm100"]
+
+HISTORY_LENGTHS = [10 ** 3, 10 ** 4, 10 ** 5, 10 ** 6]
+TICKS = 200
+# Ticks with setData, fewer because they are slow with long history
+PLOT_TICKS = 20
+
+
+# One tick with the store - append one sample and take views for every graph
+def store_tick(store, row):
+    store.append(row)
+    timestamps = store.column("time")
+    for name in PLOTTED:
+        # setData gets these arrays as they are
+        numpy.asarray(timestamps)
+        numpy.asarray(store.column(name))
+
+
+# The same tick with setData of every graph line
+def plot_tick(target, row):
+    store, curves = target
+    store.append(row)
+    timestamps = store.column("time")
+    for name, curve in zip(PLOTTED, curves):
+        curve.setData(timestamps, store.column(name))
+
+
+# One tick the old way - append to every list and give lists to setData
+def lists_tick(target, row):
+    lists, curves = target
+    for values, value in zip(lists, row):
+        values.append(value)
+    for i, curve in enumerate(curves):
+        curve.setData(lists[0], lists[i + 1])
+
+
+def measure(tick, target, row, ticks=TICKS):
+    start = time.perf_counter()
+    for _ in range(ticks):
+        tick(target, row)
+    return (time.perf_counter() - start) / ticks
+
+
+def main(with_lists=True):
+    app = QApplication.instance() or QApplication([])
+    plot = pg.PlotWidget()
+    curves = [plot.plot() for _ in PLOTTED]
+    rng = numpy.random.default_rng(0)
+    row = rng.random(len(COLUMNS))
+    results = []
+
+    print(f"{'samples':>10} {'store, us/tick':>16} {'plot, us/tick':>16} {'lists, us/tick':>16}")
+    for length in HISTORY_LENGTHS:
+        store = TelemetryStore(capacity=length + TICKS + PLOT_TICKS)
+        store.extend(rng.random((length, len(COLUMNS))))
+        store_time = measure(store_tick, store, row)
+        plot_time = measure(plot_tick, (store, curves), row, PLOT_TICKS)
+
+        lists_time = None
+        if with_lists:
+            history = rng.random((len(COLUMNS), length))
+            lists = [list(column) for column in history]
+            lists_time = measure(lists_tick, (lists, curves), row, PLOT_TICKS)
+
+        results.append({"samples": length, "store_tick_s": store_time, "plot_tick_s": plot_time,
+                        "lists_tick_s": lists_time})
+        lists_text = f"{lists_time * 1e6:16.1f}" if lists_time is not None else f"{'-':>16}"
+        print(f"{length:>10} {store_time * 1e6:16.1f} {plot_time * 1e6:16.1f} {lists_text}")
+    for curve in curves:
+        curve.clear()
+    return results
+
+
+if __name__ == "__main__":
+    main(with_lists="--no-lists" not in sys.argv)
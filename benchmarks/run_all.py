@@ -0,0 +1,175 @@
+# Runs all benchmarks and saves results as JSON, so commits can be compared
+# GUI benchmarks run without a screen (Qt offscreen platform).
+#
+# Run from repository root:
+#   python benchmarks/run_all.py                   all benchmarks, saved to benchmarks/results/
+#   python benchmarks/run_all.py --only parse gui  some of them
+#   python benchmarks/run_all.py --quick           smaller sizes, for a quick check
+#   python benchmarks/run_all.py --baseline benchmarks/results/<older>.json
+#                                                  also compares results with older ones
+#   python benchmarks/run_all.py --compare <older>.json <newer>.json
+#                                                  only compares two saved results
+#
+# Every result is a row of settings (samples, method, ...) and measured values.
+# Values ending with _s are seconds (less is better), values ending with _per_s are
+# rates (more is better). Rows of two results are matched by their settings.
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import numpy
+
+import bench_store
+import bench_parse
+import bench_recorder
+import bench_session
+
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+SUITES = ["store", "parse", "recorder", "session", "gui"]
+
+# Change that is reported as faster or slower, 0.1 is 10 %
+THRESHOLD = 0.1
+
+
+def git(*args):
+    try:
+        return subprocess.run(["git", *args], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# Smaller sizes, whole suite runs in about a minute
+def make_quick():
+    bench_store.HISTORY_LENGTHS = [10 ** 3, 10 ** 5]
+    bench_store.TICKS = 50
+    bench_parse.PACKETS = 5000
+    bench_recorder.PACKETS = 5000
+    bench_recorder.BATCH_SIZES = [10, 5000]
+    bench_session.ROWS = 20000
+    import bench_gui
+    bench_gui.HISTORY_LENGTHS = [10 ** 3, 10 ** 4]
+    bench_gui.TICKS = 30
+    bench_gui.AXIS_CALLS = 50
+    bench_gui.TRACK_LENGTHS = [10 ** 2, 10 ** 4]
+    bench_gui.MARKER_TICKS = 50
+
+
+def run(suites):
+    results = {}
+    for suite in suites:
+        print(f"\n== {suite} ==")
+        if suite == "store":
+            results["store"] = bench_store.main(with_lists=False)
+        elif suite == "parse":
+            results["parse"] = bench_parse.main(bench_parse.PACKETS)
+        elif suite == "recorder":
+            results["recorder"] = bench_recorder.main(bench_recorder.PACKETS)
+        elif suite == "session":
+            results["session"] = bench_session.main(bench_session.ROWS)
+        elif suite == "gui":
+            # Imported only when needed, it needs Qt
+            import bench_gui
+            for name, rows in bench_gui.main().items():
+                results[f"gui.{name}"] = rows
+    return results
+
+
+def describe():
+    commit = git("rev-parse", "HEAD")
+    return {
+        "commit": commit,
+        "subject": git("log", "-1", "--format=%s"),
+        # Results of a tree with uncommitted changes aren't results of that commit
+        "dirty": bool(git("status", "--porcelain", "--untracked-files=no")),
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "numpy": numpy.__version__,
+        "machine": f"{platform.system()} {platform.machine()} {platform.processor()}".strip(),
+    }
+
+
+def save(data, path=None):
+    if path is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        commit = (data["commit"] or "unknown")[:10] + ("-dirty" if data["dirty"] else "")
+        path = os.path.join(RESULTS_DIR, f"{time.strftime('%Y%m%d_%H%M%S')}_{commit}.json")
+    with open(path, "w", encoding="UTF8") as results_f:
+        json.dump(data, results_f, indent=1)
+    return path
+
+
+def _is_value(name):
+    return name.endswith("_s")
+
+
+def _key(row):
+    return tuple(sorted((name, value) for name, value in row.items() if not _is_value(name)))
+
+
+# Prints every value that is in both results, returns number of values that got worse
+def compare(old, new, threshold=THRESHOLD):
+    print(f"\n{(old.get('commit') or '')[:10]} -> {(new.get('commit') or '')[:10]}")
+    worse = 0
+    for suite, rows in new["results"].items():
+        old_rows = {_key(row): row for row in old["results"].get(suite, [])}
+        for row in rows:
+            old_row = old_rows.get(_key(row))
+            if old_row is None:
+                continue
+            settings = ", ".join(f"{name}={value}" for name, value in _key(row))
+            for name, value in row.items():
+                if not _is_value(name) or not old_row.get(name) or value is None:
+                    continue
+                # How many times faster new one is
+                if name.endswith("_per_s"):
+                    speedup = value / old_row[name]
+                else:
+                    speedup = old_row[name] / value if value else float("inf")
+                mark = ""
+                if speedup < 1 / (1 + threshold):
+                    mark = "  SLOWER"
+                    worse += 1
+                elif speedup > 1 + threshold:
+                    mark = "  faster"
+                print(f"{suite:>12} {settings:<40} {name:<16} {speedup:6.2f}x{mark}")
+    return worse
+
+
+def load(path):
+    with open(path, encoding="UTF8") as results_f:
+        return json.load(results_f)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Runs benchmarks and saves results as JSON")
+    parser.add_argument("--only", nargs="+", choices=SUITES, help="benchmarks to run (default all)")
+    parser.add_argument("--quick", action="store_true", help="smaller sizes, for a quick check")
+    parser.add_argument("--output", help="JSON file for results (default benchmarks/results/<date>_<commit>.json)")
+    parser.add_argument("--baseline", help="results of an older run to compare with")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="only compare two saved results")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD,
+                        help="change that is reported, 0.1 is 10 %% (default)")
+    parser.add_argument("--fail-on-slower", action="store_true",
+                        help="exit with error if something got slower, e.g. for CI")
+    args = parser.parse_args()
+
+    if args.compare:
+        worse = compare(load(args.compare[0]), load(args.compare[1]), args.threshold)
+    else:
+        if args.quick:
+            make_quick()
+        data = describe()
+        data["quick"] = args.quick
+        data["results"] = run(args.only or SUITES)
+        print(f"\nResults saved to {save(data, args.output)}")
+        worse = compare(load(args.baseline), data, args.threshold) if args.baseline else 0
+    sys.exit(1 if args.fail_on_slower and worse else 0)
@@ -0,0 +1,70 @@
+# Made up packets for benchmarks
+# Flight looks like a real one: Cansat goes up, comes down under parachute and drifts
+# with the wind, sensors have some noise. Same seed always gives the same packets,
+# so results of different commits can be compared.
+import numpy
+
+from telemetry_store import FIELD_NAMES
+
+
+# Packet rate of Cansat
+PACKET_INTERVAL = 0.1
+# Receive time of first packet, fixed so that date axis ticks are the same every run
+START_TIME = 1700000000.0
+
+
+# Values of n packets, shape (n, 16)
+def flight_values(n, seed=0):
+    rng = numpy.random.default_rng(seed)
+    t = numpy.arange(n) * PACKET_INTERVAL
+    values = numpy.empty((n, len(FIELD_NAMES)))
+    column = {name: i for i, name in enumerate(FIELD_NAMES)}
+
+    # Goes up for two minutes, then falls at about 8 m/s, again and again on long runs
+    phase = t % 400.0
+    altitude = numpy.where(phase < 120, phase * 8.0, numpy.maximum(960.0 - (phase - 120) * 8.0, 0.0))
+    values[:, column["altitude"]] = altitude + rng.normal(0, 0.5, n)
+    values[:, column["latitude"]] = 57.1 + numpy.cumsum(rng.normal(2e-6, 1e-6, n))
+    values[:, column["longitude"]] = 24.2 + numpy.cumsum(rng.normal(3e-6, 1e-6, n))
+    values[:, column["speed"]] = 8.0 + rng.normal(0, 1.0, n)
+    values[:, column["temp"]] = 20.0 - altitude * 0.0065 + rng.normal(0, 0.1, n)
+    values[:, column["humidity"]] = 50.0 + rng.normal(0, 1.0, n)
+    values[:, column["pressure"]] = 101325.0 * (1 - altitude / 44330.0) ** 5.255 + rng.normal(0, 5, n)
+    values[:, column["eco2"]] = 400 + rng.integers(0, 50, n)
+    values[:, column["co2"]] = 410 + rng.integers(0, 50, n)
+    values[:, column["tvoc"]] = rng.integers(0, 20, n)
+    values[:, column["no2"]] = rng.integers(0, 5, n)
+    values[:, column["pm10"]] = rng.integers(0, 10, n)
+    values[:, column["pm25"]] = rng.integers(0, 15, n)
+    values[:, column["pm100"]] = rng.integers(0, 20, n)
+    values[:, column["rssi"]] = -60 - altitude / 20 + rng.integers(-5, 5, n)
+    values[:, column["snr"]] = 10 - altitude / 200 + rng.integers(-2, 2, n)
+    return values
+
+
+# Packets as base station sends them, with receive times
+# corrupted is part of packets (0...1) that get damaged like over a bad radio link:
+# characters changed to wrong ones, characters or commas lost, line cut short
+def flight_packets(n, corrupted=0.0, seed=0):
+    rng = numpy.random.default_rng(seed + 1)
+    lines = []
+    for row in flight_values(n, seed):
+        lines.append(",".join([f"{row[0]:.6f}", f"{row[1]:.6f}", f"{row[2]:.1f}", f"{row[3]:.1f}",
+                               f"{row[4]:.2f}", f"{row[5]:.1f}", f"{row[6]:.0f}"] +
+                              [f"{value:.0f}" for value in row[7:]]))
+    for i in numpy.nonzero(rng.random(n) < corrupted)[0]:
+        lines[i] = corrupt(lines[i], rng)
+    times = START_TIME + numpy.arange(n) * PACKET_INTERVAL
+    return list(zip(times.tolist(), lines))
+
+
+def corrupt(line, rng):
+    kind = rng.integers(0, 4)
+    position = int(rng.integers(0, len(line)))
+    if kind == 0:
+        return line[:position] + chr(int(rng.integers(33, 127))) + line[position + 1:]
+    if kind == 1:
+        return line[:position] + line[position + 1:]
+    if kind == 2:
+        return line.replace(",", "", 1)
+    return line[:position]
@@ -0,0 +1,165 @@
+# Level of detail for graphs
+# Drawing every sample of a long flight with thick antialiased lines is slow,
+# and most of the samples end up on the same pixels anyway. For every column a
+# pyramid of min/max values is kept: level 1 has min and max of every 4 samples,
+# level 2 of every 16 samples and so on. When graph is drawn, the level is picked
+# so that there are about as many points as there are pixels in graph, so drawing
+# cost depends on graph width instead of flight length. Peaks are never lost,
+# because both min and max of every bucket are drawn.
+#
+# Pyramid is updated only where new samples were added, buckets are counted from
+# the first sample ever added to store, so they don't move when store wraps around.
+import numpy
+
+
+class _Level:
+    def __init__(self, bucket_size):
+        self.bucket_size = bucket_size
+        # Bucket number of first element in arrays
+        self.first = 0
+        self.size = 0
+        self.times = numpy.empty(64)
+        self.low = numpy.empty(64)
+        self.high = numpy.empty(64)
+
+    # Bucket number after the last one
+    @property
+    def end(self):
+        return self.first + self.size
+
+    # Writes buckets starting from bucket number start
+    def write(self, start, times, low, high):
+        offset = start - self.first
+        needed = offset + len(times)
+        if needed > len(self.times):
+            capacity = max(needed, 2 * len(self.times))
+            for name in ("times", "low", "high"):
+                grown = numpy.empty(capacity)
+                grown[:self.size] = getattr(self, name)[:self.size]
+                setattr(self, name, grown)
+        if offset > self.size:
+            # Buckets that couldn't be computed are left empty
+            self.times[self.size:offset] = numpy.nan
+            self.low[self.size:offset] = numpy.nan
+            self.high[self.size:offset] = numpy.nan
+        self.times[offset:needed] = times
+        self.low[offset:needed] = low
+        self.high[offset:needed] = high
+        self.size = max(self.size, needed)
+
+    # Forgets buckets before bucket number start
+    # Arrays are moved only when half of them is unused, so it is cheap on average
+    def trim(self, start):
+        drop = start - self.first
+        if drop <= 0:
+            return
+        drop = min(drop, self.size)
+        if drop * 2 >= len(self.times):
+            keep = self.size - drop
+            for name in ("times", "low", "high"):
+                array = getattr(self, name)
+                array[:keep] = array[drop:self.size]
+            self.first += drop
+            self.size = keep
+
+    def view(self, start, stop):
+        return (self.times[start - self.first:stop - self.first],
+                self.low[start - self.first:stop - self.first],
+                self.high[start - self.first:stop - self.first])
+
+
+class MinMaxPyramid:
+    def __init__(self, factor=4, levels=10):
+        self.factor = factor
+        self.levels = [_Level(factor ** (k + 1)) for k in range(levels)]
+        # Number of samples (counted from first sample in store) already in pyramid
+        self.done = 0
+
+    # Adds samples that have been added to store since last update
+    # times and values are views of everything that store has in memory,
+    # total is number of samples ever added to store
+    def update(self, times, values, total):
+        new = total - self.done
+        if new <= 0:
+            return
+        base = total - len(times)
+        if new > len(times):
+            # Pyramid fell behind store, starts from what is in memory
+            self.levels = [_Level(level.bucket_size) for level in self.levels]
+            for level in self.levels:
+                level.first = base // level.bucket_size
+            self.done = base
+
+        previous_times = times
+        previous_low = values
+        previous_high = values
+        previous_first = base
+        previous_done = self.done
+        previous_total = total
+        for level in self.levels:
+            # Buckets that got new samples, first one can be only partly filled before
+            start = previous_done // self.factor
+            stop = -(-previous_total // self.factor)
+            level_first = max(start, -(-previous_first // self.factor))
+            if level_first >= stop:
+                break
+            # Reduces children of buckets start..stop, they are already in memory
+            lo = level_first * self.factor - previous_first
+            hi = previous_total - previous_first
+            edges = numpy.arange(0, hi - lo, self.factor)
+            low = numpy.fmin.reduceat(previous_low[lo:hi], edges)
+            high = numpy.fmax.reduceat(previous_high[lo:hi], edges)
+            bucket_times = previous_times[lo:hi][edges]
+            if level.size == 0:
+                level.first = level_first
+            level.write(level_first, bucket_times, low, high)
+            # Buckets that cover samples no longer in store aren't needed
+            level.trim(base // level.bucket_size)
+
+            previous_times, previous_low, previous_high = level.times, level.low, level.high
+            previous_first = level.first
+            previous_done = start
+            previous_total = stop
+            previous_times = previous_times[:level.size]
+            previous_low = previous_low[:level.size]
+            previous_high = previous_high[:level.size]
+        self.done = total
+
+    # Returns x and y arrays to draw samples between x_min and x_max with about
+    # pixels points, times and values are the same views as given to update
+    def decimate(self, times, values, total, x_min, x_max, pixels):
+        base = total - len(times)
+        start = max(int(numpy.searchsorted(times, x_min, side="left")) - 1, 0)
+        stop = min(int(numpy.searchsorted(times, x_max, side="right")) + 1, len(times))
+        count = stop - start
+        pixels = max(int(pixels), 1)
+        if count <= 2 * pixels:
+            # Few enough samples, they are drawn as they are
+            return times[start:stop], values[start:stop]
+
+        for level in self.levels:
+            if count // level.bucket_size > pixels and level is not self.levels[-1]:
+                continue
+            first = max((base + start) // level.bucket_size, level.first)
+            last = min(-(-(base + stop) // level.bucket_size), level.end)
+            if last <= first:
+                break
+            return vertical_lines(*level.view(first, last))
+        return times[start:stop], values[start:stop]
+
+
+# Min and max of every size samples and time of first sample in every bucket
+def reduce_minmax(times, low, high, size):
+    if len(low) == 0:
+        return numpy.empty(0), numpy.empty(0), numpy.empty(0)
+    edges = numpy.arange(0, len(low), size)
+    return numpy.asarray(times)[edges], numpy.fmin.reduceat(low, edges), numpy.fmax.reduceat(high, edges)
+
+
+# Every bucket is drawn as a vertical line from its min to its max
+def vertical_lines(bucket_times, low, high):
+    x = numpy.repeat(bucket_times, 2)
+    y = numpy.empty(2 * len(low))
+    y[0::2] = low
+    y[1::2] = high
+    return x, y
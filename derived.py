@@ -0,0 +1,211 @@
+# Values computed from received data while it arrives
+# Every metric gets new samples in blocks (all packets of one update) and keeps only
+# what it needs from earlier blocks (last value, last few samples), so the cost of
+# every sample is the same no matter how long the flight has been going.
+# Results are extra columns next to the 16 packet values - they are kept in store,
+# drawn in graphs and written to csv files and flight logs like the others.
+#
+# New metric: subclass Metric, set names (new columns) and inputs (columns it needs,
+# packet values or columns of metrics before it), and write process().
+import numpy
+
+from telemetry_store import FIELD_NAMES
+
+
+class Metric:
+    # Names of columns this metric adds
+    names = []
+    # Columns it needs
+    inputs = []
+
+    # Gets receive times and dictionary of input columns for new samples,
+    # returns list with an array for every name
+    def process(self, times, columns):
+        raise NotImplementedError()
+
+
+# Speed of climbing (positive) or falling (negative), m/s
+# Difference between two samples with readable values, the last one is kept for the next block
+class VerticalSpeed(Metric):
+    def __init__(self, source="altitude", name="vertical_speed"):
+        self.names = [name]
+        self.inputs = [source]
+        self.source = source
+        self._last_time = numpy.nan
+        self._last_value = numpy.nan
+
+    def process(self, times, columns):
+        values = columns[self.source]
+        result = numpy.full(len(values), numpy.nan)
+        valid = numpy.nonzero(numpy.isfinite(values))[0]
+        if len(valid) == 0:
+            return [result]
+        t = numpy.concatenate(([self._last_time], times[valid]))
+        v = numpy.concatenate(([self._last_value], values[valid]))
+        dt = numpy.diff(t)
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            speed = numpy.diff(v) / dt
+        # Packets with the same receive time can't give speed
+        speed[~(dt > 0)] = numpy.nan
+        result[valid] = speed
+        self._last_time = t[-1]
+        self._last_value = v[-1]
+        return [result]
+
+
+# Exponentially weighted moving average with time constant in seconds
+# Weight of every sample depends on time since previous one, so it works with uneven packet rate
+class Ewma(Metric):
+    # Block is done in parts, so products of weights don't get too small for float64
+    PART = 32
+
+    def __init__(self, source, name, time_constant=2.0, scale=1.0):
+        self.names = [name]
+        self.inputs = [source]
+        self.source = source
+        self.time_constant = time_constant
+        self.scale = scale
+        self._last_time = numpy.nan
+        self._average = numpy.nan
+
+    def process(self, times, columns):
+        values = columns[self.source] * self.scale
+        result = numpy.full(len(values), numpy.nan)
+        valid = numpy.nonzero(numpy.isfinite(values))[0]
+        if len(valid) == 0:
+            result[:] = self._average
+            return [result]
+        x = values[valid]
+        t = times[valid]
+        dt = numpy.diff(numpy.concatenate(([self._last_time], t)))
+        # keep is how much of previous average is kept
+        keep = numpy.exp(-numpy.clip(dt, 0, None) / self.time_constant)
+        keep = numpy.clip(numpy.nan_to_num(keep, nan=0.0), 1e-6, 1.0)
+        # First sample ever starts the average
+        average = x[0] if numpy.isnan(self._average) else self._average
+
+        # y[i] = keep[i] * y[i-1] + (1 - keep[i]) * x[i], written with cumulative products:
+        # y[i] = P[i] * (y0 + sum((1 - keep[j]) * x[j] / P[j])), P = cumprod(keep)
+        averages = numpy.empty(len(x))
+        for start in range(0, len(x), self.PART):
+            part = slice(start, start + self.PART)
+            products = numpy.cumprod(keep[part])
+            sums = numpy.cumsum((1 - keep[part]) * x[part] / products)
+            averages[part] = products * (average + sums)
+            average = averages[part][-1]
+
+        # Samples without value keep the last average
+        filled = numpy.full(len(values), -1)
+        filled[valid] = numpy.arange(len(valid))
+        filled = numpy.maximum.accumulate(filled)
+        result = numpy.where(filled >= 0, averages[filled], self._average)
+        self._average = average
+        self._last_time = t[-1]
+        return [result]
+
+
+# Altitude calculated from air pressure with standard atmosphere, m
+class PressureAltitude(Metric):
+    def __init__(self, source="pressure", name="pressure_altitude", sea_level_pressure=101325.0):
+        self.names = [name]
+        self.inputs = [source]
+        self.source = source
+        # Pa, can be set to today's pressure at launch site for more accurate altitude
+        self.sea_level_pressure = sea_level_pressure
+
+    def process(self, times, columns):
+        pressure = columns[self.source]
+        with numpy.errstate(invalid="ignore", divide="ignore"):
+            altitude = 44330.0 * (1.0 - (pressure / self.sea_level_pressure) ** (1 / 5.255))
+        altitude[~(pressure > 0)] = numpy.nan
+        return [altitude]
+
+
+# Mean of the last window samples, samples without value are left out
+class RollingMean(Metric):
+    def __init__(self, source, name, window=30):
+        self.names = [name]
+        self.inputs = [source]
+        self.source = source
+        self.window = window
+        # Last window - 1 samples of previous blocks
+        self._tail = numpy.empty(0)
+
+    def process(self, times, columns):
+        values = numpy.concatenate((self._tail, columns[self.source]))
+        finite = numpy.isfinite(values)
+        sums = numpy.concatenate(([0.0], numpy.cumsum(numpy.where(finite, values, 0.0))))
+        counts = numpy.concatenate(([0], numpy.cumsum(finite)))
+        end = numpy.arange(len(self._tail) + 1, len(values) + 1)
+        start = numpy.maximum(end - self.window, 0)
+        count = counts[end] - counts[start]
+        with numpy.errstate(invalid="ignore", divide="ignore"):
+            mean = (sums[end] - sums[start]) / count
+        mean[count == 0] = numpy.nan
+        self._tail = values[-(self.window - 1):] if self.window > 1 else numpy.empty(0)
+        return [mean]
+
+
+# Packets received per second over the last window packets
+class PacketRate(Metric):
+    def __init__(self, name="packet_rate", window=20):
+        self.names = [name]
+        self.inputs = []
+        self.window = window
+        self._tail = numpy.empty(0)
+
+    def process(self, times, columns):
+        t = numpy.concatenate((self._tail, times))
+        end = numpy.arange(len(self._tail), len(t))
+        start = numpy.maximum(end - self.window + 1, 0)
+        with numpy.errstate(invalid="ignore", divide="ignore"):
+            rate = (end - start) / (t[end] - t[start])
+        rate[~numpy.isfinite(rate) | (end == start)] = numpy.nan
+        self._tail = t[-(self.window - 1):] if self.window > 1 else numpy.empty(0)
+        return [rate]
+
+
+# Metrics that are used by default
+def default_metrics():
+    return [
+        VerticalSpeed("altitude", "vertical_speed"),
+        # Descent rate is positive while falling, smoothed so parachute performance can be seen
+        Ewma("vertical_speed", "descent_rate", time_constant=2.0, scale=-1.0),
+        PressureAltitude("pressure", "pressure_altitude"),
+        RollingMean("pm10", "pm10_mean", window=30),
+        RollingMean("pm25", "pm25_mean", window=30),
+        RollingMean("pm100", "pm100_mean", window=30),
+        # Link quality
+        RollingMean("rssi", "rssi_mean", window=20),
+        RollingMean("snr", "snr_mean", window=20),
+        PacketRate("packet_rate", window=20),
+    ]
+
+
+# All metrics together, between parsing and store
+# Every stream (store, recorder, flight log) needs its own pipeline, because metrics keep state
+class DerivedPipeline:
+    def __init__(self, metrics=None):
+        self.metrics = default_metrics() if metrics is None else list(metrics)
+        self.names = [name for metric in self.metrics for name in metric.names]
+
+    # Gets receive times (n) and packet values (n, 16), returns derived values (n, len(names))
+    def process(self, times, values):
+        times = numpy.asarray(times, dtype=numpy.float64)
+        values = numpy.asarray(values, dtype=numpy.float64)
+        result = numpy.empty((len(times), len(self.names)))
+        if len(times) == 0:
+            return result
+        columns = {name: values[:, i] for i, name in enumerate(FIELD_NAMES)}
+        position = 0
+        for metric in self.metrics:
+            for name, column in zip(metric.names, metric.process(times, columns)):
+                result[:, position] = column
+                # Later metrics can use results of earlier ones
+                columns[name] = result[:, position]
+                position += 1
+        return result
+
+    # Adds derived values to rows of store (time, 16 packet values)
+    def extend_rows(self, rows):
+        return numpy.hstack((rows, self.process(rows[:, 0], rows[:, 1:1 + len(FIELD_NAMES)])))
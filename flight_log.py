@@ -0,0 +1,337 @@
+# Binary flight log
+# Every received packet is saved as one fixed-size record: receive time, all values
+# as float64, mask of values that could be read, and raw bytes of the packet.
+# File is only ever appended to. Because all records have the same size, a log
+# can be opened with numpy.memmap and every column is a view into the file,
+# so even multi-hour sessions open instantly without parsing anything.
+#
+# File layout:
+#   header - magic bytes, header size and JSON with schema (version, fields, sizes)
+#   records - data records, with an index record after every index_interval data records
+#
+# Index record has kind = KIND_INDEX. Its time and values are copied from the data
+# record before it, so columns can still be plotted as they are, and its raw bytes
+# hold (first time, last time, position of first record, record count) of the block.
+import csv
+import json
+import os
+import struct
+import sys
+import threading
+import time
+
+import numpy
+
+from telemetry_store import FIELD_NAMES
+from packet_parser import parse_lines, field_masks
+import instrumentation
+
+
+MAGIC = b"RQBSLOG\x00"
+SCHEMA_VERSION = 1
+HEADER_SIZE = 1024
+# Packets are usually about 100 bytes long, longer ones are cut
+RAW_SIZE = 120
+INDEX_INTERVAL = 4096
+
+KIND_DATA = 0
+KIND_INDEX = 1
+
+# Contents of raw bytes in index record
+INDEX_STRUCT = struct.Struct("<ddQQ")
+INDEX_DTYPE = numpy.dtype([("first_time", "<f8"), ("last_time", "<f8"),
+                           ("first_record", "<u8"), ("count", "<u8")])
+
+
+# Record layout for given fields
+def record_dtype(fields=FIELD_NAMES, raw_size=RAW_SIZE):
+    return numpy.dtype([("time", "<f8")]
+                       + [(name, "<f8") for name in fields]
+                       + [("kind", "u1"), ("pad", "u1"), ("raw_len", "<u2"),
+                          ("mask", "<u4"), ("raw", f"S{raw_size}")])
+
+
+class FlightLogWriter:
+    def __init__(self, path, fields=FIELD_NAMES, raw_size=RAW_SIZE,
+                 index_interval=INDEX_INTERVAL, batch_size=256, flush_interval=1.0, derived=None):
+        self.path = path
+        # Derived values (see derived.py) are saved as extra fields after packet values, if pipeline is given
+        self.derived = derived
+        self.fields = list(fields) + (derived.names if derived is not None else [])
+        self.raw_size = raw_size
+        self.index_interval = index_interval
+        self.flush_interval = flush_interval
+        self.dtype = record_dtype(self.fields, raw_size)
+
+        # Records are collected here and written when batch is full or flush_interval has passed
+        self._batch = numpy.zeros(batch_size, dtype=self.dtype)
+        self._batch_len = 0
+        self._last_flush = time.time()
+        self._lock = threading.Lock()
+        # Writes batch when flush_interval has passed even if no packets come, e.g. after landing,
+        # like CsvRecorder does. It runs while file is open.
+        self._closed = threading.Event()
+        self._flusher = None
+        self._file = None
+        # Number of records in file (data and index), used for positions in index
+        self._records = 0
+        # Data records since last index record
+        self._block_start = 0
+        self._block_first_time = None
+        self._block_count = 0
+        self._last_data = None
+
+    # Adds one packet, values and mask are parsed from raw bytes if not given
+    def append(self, received_time, raw, values=None, mask=None):
+        if isinstance(raw, str):
+            raw = raw.encode("ascii", errors="replace")
+        if values is None:
+            parsed, field_ok, line_ok = parse_lines([raw])
+            if self.derived is not None:
+                parsed = numpy.hstack((parsed, self.derived.process([received_time], parsed)))
+            values = parsed[0]
+            mask = int(field_masks(field_ok)[0])
+        with self._lock:
+            if self._file is None:
+                self._open()
+            record = self._batch[self._batch_len]
+            record["time"] = received_time
+            for name, value in zip(self.fields, values):
+                record[name] = value
+            record["kind"] = KIND_DATA
+            record["raw_len"] = min(len(raw), self.raw_size)
+            record["mask"] = mask
+            record["raw"] = raw[:self.raw_size]
+            # Index record repeats values of last packet
+            self._last_data = record.copy()
+            self._add_record()
+
+            if self._block_first_time is None:
+                self._block_first_time = received_time
+            self._block_count += 1
+            if self._block_count >= self.index_interval:
+                self._add_index()
+
+            if self._batch_len > 0 and time.time() - self._last_flush >= self.flush_interval:
+                self._write_batch()
+
+    # Adds many packets at once, they are parsed together
+    # received_time is one time for all of them or a list with time of every packet
+    def extend(self, received_time, raws):
+        raws = [raw.encode("ascii", errors="replace") if isinstance(raw, str) else raw for raw in raws]
+        if numpy.ndim(received_time) == 0:
+            received_time = [received_time] * len(raws)
+        values, field_ok, line_ok = parse_lines(raws)
+        if self.derived is not None:
+            values = numpy.hstack((values, self.derived.process(received_time, values)))
+        masks = field_masks(field_ok).tolist()
+        for t, raw, row, mask in zip(received_time, raws, values, masks):
+            self.append(t, raw, row, mask)
+
+    # Writes collected records to file
+    def flush(self):
+        with self._lock:
+            if self._file is not None:
+                self._write_batch()
+
+    # Writes index of last block and closes file
+    def close(self):
+        with self._lock:
+            if self._file is None:
+                return
+            if self._block_count > 0:
+                self._add_index()
+            self._write_batch()
+            self._file.close()
+            self._file = None
+            self._closed.set()
+        if self._flusher is not None:
+            self._flusher.join()
+            self._flusher = None
+
+    def _open(self):
+        new_file = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+        if not new_file:
+            # Continues existing log, but only if it has the same layout
+            header = read_header(self.path)
+            if header["fields"] != self.fields or header["raw_size"] != self.raw_size:
+                raise ValueError(f"{self.path} has different record layout")
+            self._records = (os.path.getsize(self.path) - HEADER_SIZE) // self.dtype.itemsize
+        self._file = open(self.path, "ab")
+        if new_file:
+            self._file.write(make_header(self.fields, self.raw_size, self.index_interval))
+        self._block_start = self._records
+        self._closed.clear()
+        self._flusher = threading.Thread(target=self._flush_loop, daemon=True)
+        self._flusher.start()
+
+    def _flush_loop(self):
+        while not self._closed.wait(self.flush_interval):
+            with self._lock:
+                if self._file is not None and self._batch_len > 0 \
+                        and time.time() - self._last_flush >= self.flush_interval:
+                    self._write_batch()
+
+    # Moves to next free record in batch (record has already been filled)
+    def _add_record(self):
+        self._batch_len += 1
+        self._records += 1
+        if self._batch_len == len(self._batch):
+            self._write_batch()
+
+    def _add_index(self):
+        self._batch[self._batch_len] = self._last_data
+        record = self._batch[self._batch_len]
+        last_time = float(record["time"])
+        record["kind"] = KIND_INDEX
+        record["mask"] = 0
+        record["raw_len"] = INDEX_STRUCT.size
+        record["raw"] = INDEX_STRUCT.pack(self._block_first_time, last_time,
+                                          self._block_start, self._block_count)
+        self._add_record()
+        self._block_start = self._records
+        self._block_first_time = None
+        self._block_count = 0
+
+    def _write_batch(self):
+        with instrumentation.timed("flightlog.write"):
+            if self._batch_len > 0:
+                self._batch[:self._batch_len].tofile(self._file)
+                self._batch_len = 0
+            self._file.flush()
+        self._last_flush = time.time()
+
+
+def make_header(fields=FIELD_NAMES, raw_size=RAW_SIZE, index_interval=INDEX_INTERVAL):
+    schema = {
+        "version": SCHEMA_VERSION,
+        "fields": list(fields),
+        "raw_size": raw_size,
+        "index_interval": index_interval,
+        "record_size": record_dtype(fields, raw_size).itemsize,
+        "created": time.time(),
+    }
+    text = json.dumps(schema).encode("utf8")
+    if len(MAGIC) + 4 + len(text) > HEADER_SIZE:
+        raise ValueError("Too many fields for flight log header")
+    header = MAGIC + struct.pack("<I", HEADER_SIZE) + text
+    return header + b" " * (HEADER_SIZE - len(header))
+
+
+def read_header(path):
+    with open(path, "rb") as log_f:
+        start = log_f.read(len(MAGIC) + 4)
+        if start[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a flight log")
+        header_size = struct.unpack("<I", start[len(MAGIC):])[0]
+        schema = json.loads(log_f.read(header_size - len(start)).decode("utf8"))
+    if schema["version"] > SCHEMA_VERSION:
+        raise ValueError(f"{path} has newer schema version {schema['version']}")
+    schema["header_size"] = header_size
+    return schema
+
+
+# Opens flight log for reading, all data stays in file and is read through memmap
+class FlightLog:
+    def __init__(self, path):
+        self.path = path
+        self.header = read_header(path)
+        self.fields = self.header["fields"]
+        self.dtype = record_dtype(self.fields, self.header["raw_size"])
+        # Last record can be incomplete if log is still being written
+        count = (os.path.getsize(path) - self.header["header_size"]) // self.dtype.itemsize
+        if count > 0:
+            self.records = numpy.memmap(path, dtype=self.dtype, mode="r",
+                                        offset=self.header["header_size"], shape=(count,))
+        else:
+            self.records = numpy.zeros(0, dtype=self.dtype)
+        self._data_mask = None
+        self._index = None
+
+    def __len__(self):
+        return len(self.records)
+
+    # View of one column, index records repeat previous values so it can be plotted as it is
+    def column(self, name, start=0, stop=None):
+        return self.records[name][start:stop]
+
+    # True for records that are packets, False for index records
+    def data_mask(self):
+        if self._data_mask is None:
+            self._data_mask = self.records["kind"] == KIND_DATA
+        return self._data_mask
+
+    # All index records as array with first_time, last_time, first_record and count
+    def index(self):
+        if self._index is None:
+            index_records = self.records[self.records["kind"] == KIND_INDEX]
+            if len(index_records) == 0:
+                self._index = numpy.zeros(0, dtype=INDEX_DTYPE)
+            else:
+                raw = numpy.ascontiguousarray(index_records["raw"]).view(numpy.uint8)
+                raw = raw.reshape(len(index_records), -1)[:, :INDEX_DTYPE.itemsize]
+                self._index = numpy.ascontiguousarray(raw).view(INDEX_DTYPE).reshape(-1)
+        return self._index
+
+    # Range of records received between start_time and end_time, as (start, stop)
+    def time_range(self, start_time, end_time):
+        times = self.records["time"]
+        index = self.index()
+        lo, hi = 0, len(times)
+        if len(index) > 0:
+            # Index narrows search down to blocks that overlap with time range
+            blocks = numpy.nonzero((index["last_time"] >= start_time) & (index["first_time"] <= end_time))[0]
+            if len(blocks) == 0:
+                return 0, 0
+            lo = int(index["first_record"][blocks[0]])
+            last = blocks[-1]
+            hi = int(index["first_record"][last] + index["count"][last]) + 1
+            # Records written after last index record
+            if last == len(index) - 1:
+                hi = len(times)
+        start = lo + int(numpy.searchsorted(times[lo:hi], start_time, side="left"))
+        stop = lo + int(numpy.searchsorted(times[lo:hi], end_time, side="right"))
+        return start, stop
+
+    # Raw bytes of one record
+    def raw(self, i):
+        record = self.records[i]
+        return bytes(record["raw"])[:record["raw_len"]]
+
+
+# Writes flight log to csv file with the same columns as files written by recorder
+def export_csv(log_path, csv_path, chunk_size=65536):
+    from recorder import CSV_HEADER, format_time
+
+    log = FlightLog(log_path)
+    packet_fields = log.fields[:len(FIELD_NAMES)]
+    with open(csv_path, "w", newline="", encoding="UTF8") as csv_f:
+        writer = csv.writer(csv_f)
+        writer.writerow(CSV_HEADER + log.fields[len(FIELD_NAMES):])
+        for start in range(0, len(log), chunk_size):
+            chunk = log.records[start:start + chunk_size]
+            chunk = chunk[chunk["kind"] == KIND_DATA]
+            columns = [chunk[name].tolist() for name in log.fields]
+            masks = chunk["mask"].tolist()
+            rows = []
+            for i, received_time in enumerate(chunk["time"].tolist()):
+                row = [format_time(received_time)]
+                for j, values in enumerate(columns):
+                    # Values that couldn't be read from packet are left empty
+                    if j < len(packet_fields) and not masks[i] & (1 << j):
+                        row.append("")
+                    elif values[i] != values[i]:
+                        # Derived value that couldn't be computed
+                        row.append("")
+                    else:
+                        row.append(f"{values[i]:.15g}")
+                rows.append(row)
+            writer.writerows(rows)
+
+
+if __name__ == "__main__":
+    # Converts flight log to csv: python flight_log.py data1234.rqlog data1234_export.csv
+    if len(sys.argv) != 3:
+        print("Usage: python flight_log.py <log file> <csv file>")
+        sys.exit(1)
+    export_csv(sys.argv[1], sys.argv[2])
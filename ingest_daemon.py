@@ -0,0 +1,189 @@
+# Receives and records data from base stations without GUI
+# It reads serial ports, records every packet to csv files and flight logs and
+# serves live data to viewers (main.py) over local socket. If viewer freezes or is
+# closed during mission, recording goes on, and viewer gets everything it missed
+# when it is opened again.
+# Only serial, numpy and standard libraries are imported, so it starts fast.
+#
+# Run on its own: python ingest_daemon.py --port COM4
+# main.py starts it by itself if no daemon is running yet.
+# It keeps running when viewer is closed, stop it with Ctrl+C or python main.py --stop-daemon
+import argparse
+import logging
+import os
+import random
+import signal
+import threading
+
+from recorder import CsvRecorder
+from flight_log import FlightLogWriter
+from serial_source import find_ports
+from stations import StationRegistry
+from live_feed import LiveFeed, FeedServer, parse_address
+from shared_feed import SharedTelemetry
+from derived import DerivedPipeline
+from telemetry_store import COLUMNS
+import instrumentation
+
+
+log = logging.getLogger("ingest_daemon")
+
+# Serial port being uses
+# The new school laptop uses COM4, my computer uses COM8
+# None means that base station is searched for among USB serial ports
+com_port = None
+
+# Every base station is read by its own process, so that stations don't slow each other down
+# With False they are read by threads of this process instead
+station_processes = True
+# How long packet is waited for from other base stations, before best copy of it is used (seconds)
+merge_window = 0.5
+
+# How many newest packets are kept for viewers that connect again
+feed_backlog = 100000
+
+# Parsed data is also put to shared memory with this name, so that other programs can read it
+# (see shared_feed.py), None turns it off
+shared_feed_name = "rqbs_telemetry"
+shared_feed_capacity = 100000
+
+# Values computed from received data (vertical speed, pressure altitude, rolling means, ...)
+# are recorded and shown next to packet values, see derived.py
+derived_metrics = True
+
+file_name = f"data{random.randint(1000, 10000)}.csv"
+
+# Writes received packets to csv file from its own thread
+# File is created when first packet arrives and header is written to it
+recorder = CsvRecorder(file_name, derived=DerivedPipeline() if derived_metrics else None)
+
+# Binary log with every packet, it can be opened much faster than csv file
+# It can be converted to csv with: python flight_log.py <log file> <csv file>
+flight_log_name = file_name[:-4] + ".rqlog"
+flight_log = FlightLogWriter(flight_log_name, derived=DerivedPipeline() if derived_metrics else None)
+
+
+# Columns of stores with parsed data, packet values and derived values after them
+def storeColumns():
+    if derived_metrics:
+        return COLUMNS + DerivedPipeline().names
+    return list(COLUMNS)
+
+
+# Creates a base station for every port, ports can be given as name=port
+# With one station its worker records to file_name, with more every station records
+# to its own files (with station name added) and merged data is recorded to file_name
+def createStations(ports, merged_queue, on_received=None, queue_size=10000):
+    if not ports:
+        ports = [com_port]
+    merged = len(ports) > 1
+    registry = StationRegistry(merged_queue, processes=station_processes,
+                               merge_window=merge_window if merged else 0,
+                               on_merged=recordMerged if merged else None,
+                               on_received=on_received, queue_size=queue_size)
+    for number, port in enumerate(ports, start=1):
+        name = None
+        if port and "=" in port:
+            name, port = port.split("=", 1)
+        if name is None:
+            name = os.path.basename(port) if port else f"station{number}"
+        if merged:
+            csv_name = f"{file_name[:-4]}_{name}.csv"
+            log_name = f"{flight_log_name[:-6]}_{name}.rqlog"
+        else:
+            csv_name, log_name = file_name, flight_log_name
+        registry.add(port, name=name, csv_file=csv_name, log_file=log_name, derived=derived_metrics)
+    return registry
+
+
+# Records packets merged from all base stations
+def recordMerged(packets):
+    for received_time, packet in packets:
+        recorder.write(received_time, packet)
+    flight_log.extend([packet[0] for packet in packets], [packet[1] for packet in packets])
+
+
+# Receives, records and serves data until stopped by viewer, Ctrl+C or SIGTERM
+def run(ports, address):
+    feed = LiveFeed(backlog=feed_backlog)
+    registry = createStations(ports, feed, queue_size=0)
+    # Packets of every station are served separately only when there is more than one,
+    # with one station merged packets are the same
+    if len(registry) > 1:
+        registry.on_received = lambda name, packets: feed.publish(packets, station=name)
+    feed.stations = [[station.name, station.port] for station in registry]
+    feed.recording = os.path.abspath(file_name)
+
+    telemetry = None
+    if shared_feed_name is not None:
+        try:
+            telemetry = SharedTelemetry(shared_feed_name, capacity=shared_feed_capacity, columns=storeColumns())
+        except FileExistsError as e:
+            log.warning("%s, telemetry isn't shared", e)
+    if telemetry is not None:
+        pipeline = DerivedPipeline() if derived_metrics else None
+        record = registry.on_merged
+
+        # Merged packets are parsed once more here for shared memory
+        def merged(packets):
+            telemetry.put_many(packets, derived=pipeline)
+            if record is not None:
+                record(packets)
+
+        registry.on_merged = merged
+
+    server = FeedServer(address, feed)
+
+    # shutdown waits for serve_forever, so it is called from another thread
+    def stop(*args):
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGINT, stop)
+    if hasattr(signal, "SIGTERM"):
+        signal.signal(signal.SIGTERM, stop)
+
+    recorder.start()
+    registry.start()
+    log.info("Recording to %s and %s", file_name, flight_log_name)
+    log.info("Serving live data on %s:%s", address[0], address[1])
+    if telemetry is not None:
+        log.info("Sharing telemetry in shared memory %s", shared_feed_name)
+    try:
+        server.serve_forever()
+    finally:
+        # Writes everything that hasn't been saved yet
+        registry.stop()
+        recorder.close()
+        flight_log.close()
+        feed.close()
+        server.server_close()
+        if telemetry is not None:
+            telemetry.close()
+        instrumentation.save("daemon")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Receives and records data from base stations")
+    parser.add_argument("--port", action="append",
+                        help="serial port of base station, found automatically if not given, "
+                             "can be given more than once for more base stations, also as name=port")
+    parser.add_argument("--all-ports", action="store_true", help="read every USB serial port as a base station")
+    parser.add_argument("--listen", help="address where viewers connect, host:port (default 127.0.0.1:8765)")
+    parser.add_argument("--shared-name", default=shared_feed_name, help="name of shared memory with telemetry")
+    parser.add_argument("--no-shared", action="store_true", help="don't put telemetry to shared memory")
+    parser.add_argument("--stats", action="store_true", help="count and time hot paths (see instrumentation.py)")
+    parser.add_argument("--stats-file", help="write counters and timings to this JSON file when stopped")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s: %(message)s")
+    if args.stats_file:
+        os.environ["RQBS_STATS_FILE"] = args.stats_file
+    if args.stats or args.stats_file:
+        instrumentation.enable()
+
+    shared_feed_name = None if args.no_shared else args.shared_name
+
+    ports = args.port or []
+    if args.all_ports:
+        ports += find_ports()
+    run(ports, parse_address(args.listen))
@@ -0,0 +1,168 @@
+# Counters and timings of the hot paths (reading, parsing, storing, drawing, recording)
+# Turned off by default. When it is off, every call only checks one flag, so it
+# can be left in code that runs for every packet.
+# Turn on with --stats in main.py or ingest_daemon.py, or with environment variable
+# RQBS_STATS=1 (processes started by them get it too). With RQBS_STATS_FILE=stats.json
+# every process writes its numbers to its own file when it ends (stats_<process>.json).
+#
+#   instrumentation.count("packets.received", n)
+#   instrumentation.gauge("queue.depth", len(queue))
+#   with instrumentation.timed("gui.parse"):
+#       ...
+import json
+import os
+import threading
+import time
+
+
+enabled = os.environ.get("RQBS_STATS", "") not in ("", "0")
+
+_lock = threading.Lock()
+_counters = {}
+_gauges = {}
+_timers = {}
+_started = time.time()
+
+
+# Timings are counted in buckets that double in size: bucket k has times up to 2^k microseconds
+class Histogram:
+    BUCKETS = 40
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * self.BUCKETS
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+        self.buckets[min(int(seconds * 1e6).bit_length(), self.BUCKETS - 1)] += 1
+
+    # Upper limit of bucket where given part (0...1) of timings is reached, microseconds
+    def percentile(self, part):
+        if self.count == 0:
+            return 0.0
+        needed = part * self.count
+        seen = 0
+        for k, n in enumerate(self.buckets):
+            seen += n
+            if seen >= needed:
+                return float(2 ** k)
+        return self.max * 1e6
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "total_ms": self.total * 1e3,
+            "mean_us": self.total / self.count * 1e6 if self.count else 0.0,
+            "p50_us": self.percentile(0.5),
+            "p99_us": self.percentile(0.99),
+            "max_us": self.max * 1e6,
+            "buckets": self.buckets,
+        }
+
+
+class _Timer:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        observe(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class _NoTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NO_TIMER = _NoTimer()
+
+
+def enable(on=True):
+    global enabled
+    enabled = on
+    # Processes started after this get the same setting
+    os.environ["RQBS_STATS"] = "1" if on else "0"
+
+
+# Adds n to counter
+def count(name, n=1):
+    if enabled:
+        with _lock:
+            _counters[name] = _counters.get(name, 0) + n
+
+
+# Sets current value, e.g. queue depth
+def gauge(name, value):
+    if enabled:
+        _gauges[name] = value
+
+
+# Adds one timing in seconds
+def observe(name, seconds):
+    if enabled:
+        with _lock:
+            histogram = _timers.get(name)
+            if histogram is None:
+                histogram = _timers[name] = Histogram()
+            histogram.add(seconds)
+
+
+# Times the code inside with block
+def timed(name):
+    if enabled:
+        return _Timer(name)
+    return _NO_TIMER
+
+
+# All numbers as dictionary
+def snapshot():
+    with _lock:
+        return {
+            "pid": os.getpid(),
+            "time": time.time(),
+            "uptime": time.time() - _started,
+            "counters": dict(_counters),
+            "gauges": dict(_gauges),
+            "timers": {name: histogram.to_dict() for name, histogram in _timers.items()},
+        }
+
+
+# Short text for overlay in window, one line per number
+def summary():
+    data = snapshot()
+    lines = [f"{name}: {value}" for name, value in sorted(data["counters"].items())]
+    lines += [f"{name}: {value}" for name, value in sorted(data["gauges"].items())]
+    for name, timer in sorted(data["timers"].items()):
+        lines.append(f"{name}: {timer['count']}x mean {timer['mean_us']:.0f} us, "
+                     f"p99 < {timer['p99_us']:.0f} us, max {timer['max_us']:.0f} us")
+    return "\n".join(lines)
+
+
+def dump(path):
+    with open(path, "w", encoding="UTF8") as stats_f:
+        json.dump(snapshot(), stats_f, indent=1)
+
+
+# Writes numbers to RQBS_STATS_FILE with process name added, if it is set
+def save(process_name):
+    path = os.environ.get("RQBS_STATS_FILE")
+    if not enabled or not path:
+        return None
+    root, ext = os.path.splitext(path)
+    path = f"{root}_{process_name}{ext or '.json'}"
+    dump(path)
+    return path
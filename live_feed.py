@@ -0,0 +1,270 @@
+# Live data over local TCP socket
+# Ingest daemon publishes every received packet to LiveFeed, which gives it a sequence
+# number and keeps the newest ones in memory. Any number of viewers can connect to
+# FeedServer. Viewer tells from which sequence number it wants packets, so after it
+# has been closed or has crashed, it gets everything it missed when it connects again
+# (as long as it is still in memory).
+#
+# Protocol, one line per message:
+#   server -> client: hello as JSON {"session", "first", "next", "stations", "recording"}
+#   client -> server: SINCE <sequence number>   or   STOP (closes daemon)
+#   server -> client: <sequence number>\t<receive time>\t<station, empty for merged>\t<packet>
+# Every packet line is encoded once when it is published, not once for every viewer.
+import json
+import logging
+import os
+import socket
+import socketserver
+import threading
+import time
+
+from serial_source import FrameSplitter
+from stations import Station
+
+
+log = logging.getLogger(__name__)
+
+
+# Address where daemon listens and viewers connect to
+DEFAULT_ADDRESS = ("127.0.0.1", 8765)
+
+
+# Parses "host:port" or "port"
+def parse_address(text):
+    if not text:
+        return DEFAULT_ADDRESS
+    host, _, port = text.rpartition(":")
+    return (host or DEFAULT_ADDRESS[0], int(port))
+
+
+# Newest packets with sequence numbers, shared by all viewers
+class LiveFeed:
+    def __init__(self, backlog=100000, stations=()):
+        self.capacity = int(backlog)
+        # Ring of encoded lines, sequence number n is at n % capacity
+        self._lines = [None] * self.capacity
+        self.next_seq = 0
+        # Changes every time daemon is started, so viewer knows that numbers started from 0 again
+        self.session = f"{os.getpid()}-{time.time():.0f}"
+        # (name, port) of every base station
+        self.stations = [list(station) for station in stations]
+        # Csv file that daemon records to, viewers keep their spill files next to it
+        self.recording = None
+        self.closed = False
+        self._changed = threading.Condition()
+
+    # Oldest sequence number that is still in memory
+    @property
+    def first(self):
+        return max(0, self.next_seq - self.capacity)
+
+    # Adds (receive time, packet) pairs, station is None for merged packets
+    def publish(self, packets, station=None):
+        if not packets:
+            return
+        source = station or ""
+        with self._changed:
+            seq = self.next_seq
+            for received_time, packet in packets:
+                self._lines[seq % self.capacity] = f"{seq}\t{received_time!r}\t{source}\t{packet}\n".encode(
+                    "ascii", errors="replace")
+                seq += 1
+            self.next_seq = seq
+            self._changed.notify_all()
+
+    # Same as publish, so feed can be given to station registry in place of merged packet queue
+    def put_many(self, packets):
+        self.publish(packets)
+
+    # Returns lines from sequence number since (or from the oldest one in memory) and
+    # number after the last returned one, waits for timeout if there is nothing new
+    def read(self, since, timeout=1.0, max_lines=10000):
+        with self._changed:
+            if since >= self.next_seq and not self.closed:
+                self._changed.wait(timeout)
+            since = max(since, self.first)
+            stop = min(self.next_seq, since + max_lines)
+            return [self._lines[seq % self.capacity] for seq in range(since, stop)], stop
+
+    def hello(self):
+        return json.dumps({"session": self.session, "first": self.first, "next": self.next_seq,
+                           "stations": self.stations, "recording": self.recording}).encode() + b"\n"
+
+    def close(self):
+        with self._changed:
+            self.closed = True
+            self._changed.notify_all()
+
+
+class _FeedHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        feed = self.server.feed
+        self.wfile.write(feed.hello())
+        command = self.rfile.readline().decode("ascii", errors="replace").split()
+        if command[:1] == ["STOP"]:
+            # shutdown waits for serve_forever, which runs in another thread
+            threading.Thread(target=self.server.shutdown, daemon=True).start()
+            return
+        if command[:1] != ["SINCE"] or len(command) < 2:
+            return
+        position = int(command[1])
+        while not feed.closed:
+            lines, position = feed.read(position)
+            if lines:
+                self.wfile.write(b"".join(lines))
+
+
+# Serves feed to viewers, every viewer gets its own thread
+class FeedServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, feed):
+        self.feed = feed
+        super().__init__(address, _FeedHandler)
+
+
+# Asks daemon at address to stop, returns False if there is no daemon
+def stop_daemon(address=DEFAULT_ADDRESS, timeout=2.0):
+    try:
+        with socket.create_connection(address, timeout=timeout) as connection:
+            connection.makefile("rb").readline()
+            connection.sendall(b"STOP\n")
+        return True
+    except OSError:
+        return False
+
+
+# Viewer side, puts packets from daemon to the same queues that stations use
+# If connection is lost, it connects again and asks for packets after the last one it got
+class LiveClient:
+    def __init__(self, merged_queue, address=DEFAULT_ADDRESS, min_backoff=0.25, max_backoff=4.0):
+        self.merged_queue = merged_queue
+        self.address = address
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        # Stations of daemon, name -> Station, known after first connection
+        self.stations = {}
+        self.session = None
+        # Csv file of daemon, known after first connection
+        self.recording = None
+        self.next_seq = 0
+        # Packets that weren't in daemon's memory anymore when viewer connected again
+        self.lost = 0
+        self.received = 0
+        self.connected = False
+        self._connection = None
+        self._running = False
+        self._thread = None
+
+    # Tries to connect until timeout, so that stations are known before window is created
+    def connect(self, timeout=5.0):
+        end = time.monotonic() + timeout
+        while self._connection is None:
+            self._connection = self._open()
+            if self._connection is None:
+                if time.monotonic() >= end:
+                    return False
+                time.sleep(0.1)
+        return True
+
+    # Starts receiving in its own thread
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        connection = self._connection
+        if connection is not None:
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        if self._thread is not None:
+            self._thread.join()
+
+    def _open(self):
+        try:
+            connection = socket.create_connection(self.address, timeout=2.0)
+            hello = json.loads(connection.makefile("rb").readline())
+        except (OSError, ValueError):
+            return None
+        # Packets that left daemon's memory before first connection weren't lost by this viewer
+        attached = self.session is not None
+        if hello["session"] != self.session:
+            # Daemon has been started again, sequence numbers start from 0
+            self.session = hello["session"]
+            self.next_seq = 0
+        self.recording = hello.get("recording")
+        if self.next_seq < hello["first"]:
+            if attached:
+                self.lost += hello["first"] - self.next_seq
+            self.next_seq = hello["first"]
+        for name, port in hello["stations"]:
+            if name not in self.stations:
+                self.stations[name] = Station(name, port)
+        connection.sendall(f"SINCE {self.next_seq}\n".encode())
+        connection.settimeout(None)
+        self.connected = True
+        return connection
+
+    def _run(self):
+        backoff = self.min_backoff
+        while self._running:
+            if self._connection is None:
+                self._connection = self._open()
+                if self._connection is None:
+                    # Waits before trying again, every failed try doubles waiting time
+                    time.sleep(backoff)
+                    backoff = min(backoff * 2, self.max_backoff)
+                    continue
+            backoff = self.min_backoff
+            try:
+                self._receive(self._connection)
+            except OSError:
+                pass
+            self._connection.close()
+            self._connection = None
+            if self.connected and self._running:
+                log.warning("Lost connection to recorder, connecting again")
+            self.connected = False
+
+    def _receive(self, connection):
+        splitter = FrameSplitter(max_line=65536)
+        while self._running:
+            data = connection.recv(65536)
+            if not data:
+                return
+            merged = []
+            by_station = {}
+            for line in splitter.feed(data):
+                seq, received_time, source, packet = line.decode("ascii", errors="replace").split("\t", 3)
+                item = (float(received_time), packet)
+                if source:
+                    by_station.setdefault(source, []).append(item)
+                else:
+                    merged.append(item)
+                seq = int(seq)
+                # Packets that left daemon's memory while this viewer was too slow to read them
+                if seq > self.next_seq:
+                    self.lost += seq - self.next_seq
+                self.next_seq = seq + 1
+                self.received += 1
+            if merged:
+                self._put(self.merged_queue, merged)
+            for name, items in by_station.items():
+                station = self.stations.get(name)
+                if station is not None:
+                    self._put(station.packets, items)
+
+    # Waits until queue has room, so that daemon's backlog isn't dropped when viewer connects again
+    # Socket isn't read while waiting, so TCP makes daemon wait too
+    def _put(self, queue, items):
+        needed = min(len(items), queue.maxsize)
+        while self._running and queue.free() < needed:
+            time.sleep(0.005)
+        # Only this thread adds to queue, so only what doesn't fit at all is dropped
+        self.lost += max(0, len(items) - queue.free())
+        queue.put_many(items)
@@ -0,0 +1,38 @@
+# Console that shows received packets
+# It keeps only the newest max_lines lines, so its memory use and repaint time
+# stay the same no matter how long app runs. New lines are added in one batch
+# per update. If user has scrolled up to read older lines, view isn't moved
+# to the bottom until user scrolls back down.
+from PyQt5.QtWidgets import QPlainTextEdit
+
+
+class LogView(QPlainTextEdit):
+    def __init__(self, max_lines=1000, parent=None):
+        super().__init__(parent)
+        self.max_lines = max_lines
+        self.setReadOnly(True)
+        self.setUndoRedoEnabled(False)
+        # Long lines aren't wrapped, so every packet is one line and layout is cheap
+        self.setLineWrapMode(QPlainTextEdit.NoWrap)
+        # Oldest lines are removed when there are more than max_lines
+        self.setMaximumBlockCount(max_lines)
+
+    # Adds many lines with one change of document
+    def appendLines(self, lines):
+        if not lines:
+            return
+        # Lines that would be removed straight away aren't added at all
+        lines = lines[-self.max_lines:]
+
+        bar = self.verticalScrollBar()
+        following = bar.value() >= bar.maximum()
+        position = bar.value()
+        blocks = self.blockCount() if self.document().characterCount() > 1 else 0
+        self.appendPlainText("\n".join(lines))
+
+        if following:
+            bar.setValue(bar.maximum())
+        else:
+            # Keeps the same lines in view, even when lines above them were removed
+            removed = max(0, blocks + len(lines) - self.max_lines)
+            bar.setValue(max(0, position - removed))
@@ -1,8 +1,8 @@
 # Required libaries
 # PyQt5 libaries
 from PyQt5.QtGui import *
-from PyQt5.QtWidgets import QWidget, QGridLayout
-from PyQt5.QtCore import QTimer
+from PyQt5.QtWidgets import QWidget, QGridLayout, QComboBox, QLabel, QShortcut
+from PyQt5.QtCore import QTimer, Qt, QEvent
 from pyqtgraph import AxisItem
 from pyqtgraph import QtWidgets
 import pyqtgraph as pg
@@ -12,159 +12,242 @@ from PyQt5.QtWebEngineWidgets import QWebEngineView
 import numpy
 import sys
 import os
-import threading
-import serial
-import random
+import argparse
+import logging
+import subprocess
+import socket
 from datetime import datetime, timedelta
+from collections import OrderedDict
 import time
 from time import mktime
 import folium
 import io
-import csv
-from jinja2 import Template
 
+from telemetry_store import TelemetryStore
+import packet_parser
+from decimation import MinMaxPyramid
+from map_track import MapTrack
+from log_view import LogView
+from packet_queue import PacketQueue
+from redraw import RedrawScheduler
+import instrumentation
+from replay import ReplaySource, PtyReplay
+from serial_source import find_ports
+from live_feed import LiveClient, parse_address, stop_daemon
+from ingest_daemon import file_name, recorder, flight_log, createStations, shared_feed_name
+from ingest_daemon import derived_metrics, storeColumns
+from derived import DerivedPipeline
+from shared_feed import SharedTelemetry
+from session_cache import open_session, Session
+
+
+log = logging.getLogger("main")
+
+# Queue where serial thread puts every received packet for GUI to take
+# Every item is (time when it was received, data string)
+# Raw data - all data that comes in from serial port, it can be corrupted,
+# it can still be useful to get data, even if not everything can be used
+# Displayed data - data that shouldn't be corrupted, it is added to store and used by graphs
+# Queue has fixed size, if GUI can't keep up, oldest packets are dropped and counted
+packet_queue = PacketQueue(maxsize=10000)
+
+# Serial port, file names and other recording settings are in ingest_daemon.py
+# Data is received and recorded by ingest daemon, which runs as its own process,
+# so recording goes on even if this window freezes or is closed.
+# Daemon started by this window keeps running after it, python main.py --stop-daemon stops it
+
+# How many samples are kept in memory for graphs, about a day at one packet per second
+# Older samples are moved to spill file next to csv file
+store_capacity = 100000
+
+# How many newest lines are shown in each console
+console_lines = 1000
+
+# Most GPS points drawn on map for a time range of recorded session, every n-th point is taken
+analysis_track_points = 8000
+
+# How often received packets are taken from queue and added to store (milliseconds)
+ingest_interval = 100
+# Graphs and map are drawn at most this many times per second, less if drawing is slow
+max_fps = 20
+
+# Short month names in current locale, same as strftime("%b") gives
+_MONTH_NAMES = [datetime(2000, month, 1).strftime("%b") for month in range(1, 13)]
+
+
+# Difference between local time and UTC in seconds at given time
+def _utcOffset(timestamp):
+    try:
+        return time.localtime(timestamp).tm_gmtoff
+    except (OverflowError, OSError, ValueError):
+        return 0
 
-# String for receiving serial data
-base_station_data = ""
-
-# Raw data - all data that comes in from serial port, it can be corrupted
-# It can still be useful to get data, even if not everything can be used
-raw_data = []
-
-# Displayed data - data that shouldn't be corrupted
-# Non-corrupted data received from serial port is appended to this list
-# Latest data is split and gets appended to data lists, to be used by graphs
-displayed_data = []
-
-# Serial port being uses
-# The new school laptop uses COM4, my computer uses COM8
-com_port = "COM4"
-
-file_name = f"data{random.randint(1000, 10000)}.csv"
-with open(file_name, "a", newline="", encoding="UTF8") as csv_f:
-           writer = csv.writer(csv_f)
-           writer.writerow(["Time","Latititude","Longitude","Speed","Altitude","Temp","Humidity","Pressure","eCO2","CO2","TVOC","NO2","PM10","PM25","PM100","RSSI","SNR"])
 
 # This class makes it possible for graphs to display time as x-axis
-# Don't touch this class, it works as it should.
+# Ticks are calculated with numpy in local time, and results are kept in a cache
+# that all axes share. All graphs show the same time range, so when one axis has
+# calculated its ticks, other axes get them from cache.
 class DateAxisItem(AxisItem):
     # Max width in pixels reserved for each label in axis
     _pxLabelWidth = 80
 
+    # Shared caches of tick values and tick strings, oldest entries are removed first
+    _cacheSize = 256
+    _tickCache = OrderedDict()
+    _stringCache = OrderedDict()
+
     def __init__(self, *args, **kwargs):
         AxisItem.__init__(self, *args, **kwargs)
         self._oldAxis = None
 
-    def tickValues(self, minVal, maxVal, size):
-        maxMajSteps = int(size/self._pxLabelWidth)
+    @classmethod
+    def _cached(cls, cache, key, compute):
+        try:
+            value = cache[key]
+            cache.move_to_end(key)
+            return value
+        except KeyError:
+            pass
+        value = compute()
+        cache[key] = value
+        if len(cache) > cls._cacheSize:
+            cache.popitem(last=False)
+        return value
 
-        dt1 = datetime.fromtimestamp(minVal)
-        dt2 = datetime.fromtimestamp(maxVal)
+    def tickValues(self, minVal, maxVal, size):
+        dx = maxVal - minVal
+        if dx <= 2:  # <2s , use standard implementation from parent
+            return AxisItem.tickValues(self, minVal, maxVal, size)
+        return self._cached(DateAxisItem._tickCache, (minVal, maxVal, int(size)),
+                            lambda: self._dateTickValues(minVal, maxVal, size))
 
+    def _dateTickValues(self, minVal, maxVal, size):
+        maxMajSteps = max(int(size/self._pxLabelWidth), 1)
         dx = maxVal - minVal
-        majticks = []
+
+        # Ticks are calculated in local time, as seconds since 1970 shifted by UTC offset
+        offset = _utcOffset(minVal)
+        localMin = minVal + offset
+        localMax = maxVal + _utcOffset(maxVal)
 
         if dx > 63072001:  # 3600s*24*(365+366) = 2 years (count leap year)
             d = timedelta(days=366)
-            for y in range(dt1.year + 1, dt2.year):
-                dt = datetime(year=y, month=1, day=1)
-                majticks.append(mktime(dt.timetuple()))
+            # First day of every year after first one and before last one
+            firstYear = numpy.datetime64(int(localMin), 's').astype('datetime64[Y]') + 1
+            lastYear = numpy.datetime64(int(localMax), 's').astype('datetime64[Y]')
+            majticks = numpy.arange(firstYear, lastYear).astype('datetime64[s]').astype(numpy.float64)
 
         elif dx > 5270400:  # 3600s*24*61 = 61 days
             d = timedelta(days=31)
-            dt = dt1.replace(day=1, hour=0, minute=0,
-                             second=0, microsecond=0) + d
-            while dt < dt2:
-                # make sure that we are on day 1 (even if always sum 31 days)
-                dt = dt.replace(day=1)
-                majticks.append(mktime(dt.timetuple()))
-                dt += d
+            # First day of every month after first one
+            firstMonth = numpy.datetime64(int(localMin), 's').astype('datetime64[M]') + 1
+            lastMonth = numpy.datetime64(int(localMax), 's').astype('datetime64[M]') + 1
+            months = numpy.arange(firstMonth, lastMonth)
+            majticks = months.astype('datetime64[s]').astype(numpy.float64)
+            # Month is added when first day of month before it plus 31 days is before end
+            previous = (months - 1).astype('datetime64[s]').astype(numpy.float64)
+            majticks = majticks[previous + 31 * 86400 < localMax]
 
         elif dx > 172800:  # 3600s24*2 = 2 days
             d = timedelta(days=1)
-            dt = dt1.replace(hour=0, minute=0, second=0, microsecond=0) + d
-            while dt < dt2:
-                majticks.append(mktime(dt.timetuple()))
-                dt += d
+            majticks = self._stepTicks(localMin, localMax, 86400)
 
         elif dx > 7200:  # 3600s*2 = 2hours
             d = timedelta(hours=1)
-            dt = dt1.replace(minute=0, second=0, microsecond=0) + d
-            while dt < dt2:
-                majticks.append(mktime(dt.timetuple()))
-                dt += d
+            majticks = self._stepTicks(localMin, localMax, 3600)
 
         elif dx > 1200:  # 60s*20 = 20 minutes
             d = timedelta(minutes=10)
-            dt = dt1.replace(minute=(dt1.minute // 10) * 10,
-                             second=0, microsecond=0) + d
-            while dt < dt2:
-                majticks.append(mktime(dt.timetuple()))
-                dt += d
+            majticks = self._stepTicks(localMin, localMax, 600)
 
         elif dx > 120:  # 60s*2 = 2 minutes
             d = timedelta(minutes=1)
-            dt = dt1.replace(second=0, microsecond=0) + d
-            while dt < dt2:
-                majticks.append(mktime(dt.timetuple()))
-                dt += d
+            majticks = self._stepTicks(localMin, localMax, 60)
 
         elif dx > 20:  # 20s
             d = timedelta(seconds=10)
-            dt = dt1.replace(second=(dt1.second // 10) * 10, microsecond=0) + d
-            while dt < dt2:
-                majticks.append(mktime(dt.timetuple()))
-                dt += d
+            majticks = self._stepTicks(localMin, localMax, 10)
 
-        elif dx > 2:  # 2s
+        else:  # 2s
             d = timedelta(seconds=1)
-            majticks = range(int(minVal), int(maxVal))
+            majticks = numpy.arange(int(minVal), int(maxVal), dtype=numpy.float64) + offset
 
-        else:  # <2s , use standard implementation from parent
-            return AxisItem.tickValues(self, minVal, maxVal, size)
+        # Back from local time to seconds since 1970
+        # Range shorter than 61 days can't have daylight saving time change in the middle
+        # without having different offsets at its ends
+        if dx <= 5270400 and localMax - maxVal == offset:
+            majticks = majticks - offset
+        else:
+            # Daylight saving time changes inside range, every tick gets its own offset
+            majticks = numpy.array([mktime((datetime(1970, 1, 1) + timedelta(seconds=t)).timetuple()) for t in majticks])
 
         L = len(majticks)
         if L > maxMajSteps:
             majticks = majticks[::int(numpy.ceil(float(L) / maxMajSteps))]
 
-        return [(d.total_seconds(), majticks)]
+        return [(d.total_seconds(), majticks.tolist())]
+
+    # Ticks every step seconds (in local time) strictly after the one that first value is in
+    @staticmethod
+    def _stepTicks(localMin, localMax, step):
+        first = numpy.floor(localMin / step) * step + step
+        return numpy.arange(first, localMax, step, dtype=numpy.float64)
 
     def tickStrings(self, values, scale, spacing):
-        ret = []
         if not values:
             return []
+        return self._cached(DateAxisItem._stringCache, (tuple(values), spacing),
+                            lambda: self._dateTickStrings(values, spacing))
+
+    def _dateTickStrings(self, values, spacing):
+        values = numpy.asarray(values, dtype=numpy.float64)
+        offset = _utcOffset(values[0])
+        if values[-1] - values[0] > 5270400 or _utcOffset(values[-1]) != offset:
+            # Daylight saving time changes between ticks, every tick gets its own offset
+            offsets = numpy.array([_utcOffset(x) for x in values])
+        else:
+            offsets = offset
+        # Local time split into parts with numpy
+        local = numpy.floor(values + offsets).astype(numpy.int64)
+        if spacing >= 3600:
+            # Dates are only needed for labels with days, months or years
+            dates = local.astype('datetime64[s]')
+            days = dates.astype('datetime64[D]')
+            months = dates.astype('datetime64[M]')
+            years = (dates.astype('datetime64[Y]').astype(numpy.int64) + 1970).tolist()
+            month = (months.astype(numpy.int64) % 12).tolist()
+            day = ((days - months).astype(numpy.int64) + 1).tolist()
+        secondOfDay = local % 86400
+        hour = (secondOfDay // 3600).tolist()
+        minute = (secondOfDay // 60 % 60).tolist()
+        second = (secondOfDay % 60).tolist()
 
         if spacing >= 31622400:  # 366 days
-            fmt = "%Y"
+            ret = [f"{y}" for y in years]
 
         elif spacing >= 2678400:  # 31 days
-            fmt = "%Y %b"
+            ret = [f"{y} {_MONTH_NAMES[m]}" for y, m in zip(years, month)]
 
         elif spacing >= 86400:  # = 1 day
-            fmt = "%b/%d"
+            ret = [f"{_MONTH_NAMES[m]}/{dd:02d}" for m, dd in zip(month, day)]
 
         elif spacing >= 3600:  # 1 h
-            fmt = "%b/%d-%Hh"
+            ret = [f"{_MONTH_NAMES[m]}/{dd:02d}-{h:02d}h" for m, dd, h in zip(month, day, hour)]
 
         elif spacing >= 60:  # 1 m
-            fmt = "%H:%M"
+            ret = [f"{h:02d}:{mm:02d}" for h, mm in zip(hour, minute)]
 
         elif spacing >= 1:  # 1s
-            fmt = "%H:%M:%S"
+            ret = [f"{h:02d}:{mm:02d}:{s:02d}" for h, mm, s in zip(hour, minute, second)]
 
         else:
             # less than 2s (show microseconds)
-            # fmt = '%S.%f"'
-            fmt = '[+%fms]'  # explicitly relative to last second
-
-        for x in values:
-            try:
-                t = datetime.fromtimestamp(x)
-                ret.append(t.strftime(fmt))
-            except ValueError:  # Windows can't handle dates before 1970
-                ret.append('')
+            # explicitly relative to last second
+            microseconds = numpy.round((values - numpy.floor(values)) * 1e6).astype(numpy.int64).tolist()
+            ret = [f"[+{us:06d}ms]" for us in microseconds]
 
-        return ret
+        # Windows can't handle dates before 1970, they were left empty before too
+        return [text if x >= 0 else '' for text, x in zip(ret, values.tolist())]
 
     def attachToPlotItem(self, plotItem):
         pen_line = pg.mkPen(color=(0, 0, 0), width=3)
@@ -183,33 +266,112 @@ class DateAxisItem(AxisItem):
         raise NotImplementedError()  # TODO
 
 
+# Graph line that draws only as many points as its graph is wide
+# Min/max pyramid of the column is updated when new data arrives, and the line is
+# drawn again from it when new data arrives or when graph is zoomed or moved.
+class DecimatedCurve:
+    def __init__(self, plotWidget, store, column, **kwargs):
+        self.store = store
+        self.column = column
+        self.pyramid = MinMaxPyramid()
+        self.plotWidget = plotWidget
+        self.viewBox = plotWidget.getPlotItem().getViewBox()
+        # connect="finite" leaves gaps where values were corrupted
+        self.item = plotWidget.plot(x=[], y=[], connect="finite", **kwargs)
+        self._lastDrawn = None
+        self.scheduler = None
+        self.viewBox.sigXRangeChanged.connect(lambda *args: self.requestRedraw())
+        self.viewBox.sigResized.connect(lambda *args: self.requestRedraw())
+
+    # Line is drawn by scheduler in next frame instead of straight away
+    def setScheduler(self, scheduler):
+        self.scheduler = scheduler
+        scheduler.add(self.redraw, self.plotWidget)
+
+    def requestRedraw(self):
+        if self.scheduler is None:
+            self.redraw()
+        else:
+            self.scheduler.markDirty(self.redraw)
+
+    # Draws data of another store, e.g. when another base station is selected
+    def setStore(self, store):
+        self.store = store
+        self.pyramid = MinMaxPyramid()
+        self._lastDrawn = None
+        self.update()
+
+    # Adds new samples from store to pyramid and draws line again
+    # Recorded session has its own overview on disk, so it doesn't need pyramid
+    def update(self):
+        if not isinstance(self.store, Session):
+            times = self.store.column("time")
+            self.pyramid.update(times, self.store.column(self.column), self.store.total)
+        self.requestRedraw()
+
+    def redraw(self):
+        times = self.store.column("time")
+        if len(times) == 0:
+            return
+        # While graph follows data, whole data is visible, otherwise only zoomed part
+        if self.viewBox.autoRangeEnabled()[0]:
+            xMin, xMax = times[0], times[-1]
+        else:
+            xMin, xMax = self.viewBox.viewRange()[0]
+        pixels = self.viewBox.width()
+        # Nothing has changed since last time, so line isn't drawn again
+        key = (xMin, xMax, pixels, self.store.total)
+        if key == self._lastDrawn:
+            return
+        self._lastDrawn = key
+        with instrumentation.timed("gui.set_data"):
+            if isinstance(self.store, Session):
+                x, y = self.store.decimate(self.column, xMin, xMax, pixels)
+            else:
+                x, y = self.pyramid.decimate(times, self.store.column(self.column), self.store.total, xMin, xMax, pixels)
+            self.item.setData(x, y, connect="finite")
+
+
 # Main window
 class Window(QWidget):
-    def __init__(self):
+    def __init__(self, stations=(), session=None):
         super().__init__()
-        # Lists where all data is stored
-        self.timestamps = []
-        self.data_latitude = []
-        self.data_longitude = []
-        self.data_speed = []
-        self.data_temp = []
-        self.data_humid = []
-        self.data_alt = []
-        self.data_press = []
-        self.data_eco2 = []
-        self.data_co2 = []
-        self.data_tvoc = []
-        self.data_no2 = []
-        self.data_pm10 = []
-        self.data_pm25 = []
-        self.data_pm100 = []
-        self.data_rssi = []
-        self.data_snr = []
-
-        # Starts a timer that updates lists and the graphs every second
+        # Recorded session opened for analysis (see session_cache.py), nothing is received then
+        # and graphs and map show the session instead of store
+        self.session = session
+        # Store where all received data is kept, with more base stations it has merged data of all of them
+        # Samples that don't fit into memory anymore are written to spill file
+        # Derived values (see derived.py) are kept in columns after packet values
+        if session is not None:
+            self.store = session
+        else:
+            self.store = TelemetryStore(capacity=store_capacity, columns=storeColumns(), spill_file=spillFileName())
+        # With more than one base station, every station also has its own store,
+        # graphs and map show data of the one selected above graphs
+        self.stations = list(stations) if len(stations) > 1 else []
+        self.stationStores = {station.name: TelemetryStore(capacity=store_capacity, columns=storeColumns())
+                              for station in self.stations}
+        self.shownStore = self.store
+        # Every store has its own derived pipeline, because metrics remember earlier samples
+        self.pipelines = {}
+        if derived_metrics and session is None:
+            for store in [self.store] + list(self.stationStores.values()):
+                self.pipelines[id(store)] = DerivedPipeline()
+        # Number of packets that have been taken from queue, also ones without any usable value,
+        # and when the last of them was processed
+        self.processed_packets = 0
+        self.reported_packets = 0
+        self.processed_at = None
+
+        # Graphs and map are drawn by scheduler, only when their data has changed
+        self.redrawScheduler = RedrawScheduler(max_fps=max_fps)
+
+        # Starts a timer that takes new packets and adds them to store
+        # It only marks graphs as changed, they are drawn by scheduler
         self.qTimer = QTimer()
-        self.qTimer.setInterval(1000)  # milliseconds
-        self.qTimer.start()
+        self.qTimer.setInterval(ingest_interval)  # milliseconds
+        if session is None:
+            self.qTimer.start()
         self.qTimer.timeout.connect(self.update_data_real)
 
         # Run the ui
@@ -219,85 +381,191 @@ class Window(QWidget):
     # For this function to work it needs to be set above in qTimer.timeout
     # and also base station has to be connected to PC and
     # Cansat has to be transmitting data
+    # Every call takes all packets that have been received since last call,
+    # so no packets are lost, even if more than one arrives between calls
     def update_data_real(self):
+        # Takes everything that serial thread has added since last tick
+        new_raw = packet_queue.drain()
+
         try:
-            # Splits last received data
-            split_data = displayed_data[-1].split(",")
-            # Converts every data unit to float
-            split_data = [float(x) for x in split_data]
-            # Gets time when data was received
-            self.timestamps.append(time.time())
-            # Appends split data to data lists
-            self.data_latitude.append(split_data[0])
-            self.data_longitude.append(split_data[1])
-            self.data_speed.append(split_data[2])
-            self.data_alt.append(split_data[3])
-            self.data_temp.append(split_data[4])
-            self.data_humid.append(split_data[5])
-            self.data_press.append(split_data[6])
-            self.data_eco2.append(split_data[7])
-            self.data_co2.append(split_data[8])
-            self.data_tvoc.append(split_data[9])
-            self.data_no2.append(split_data[10])
-            self.data_pm10.append(split_data[11])
-            self.data_pm25.append(split_data[12])
-            self.data_pm100.append(split_data[13])
-            self.data_rssi.append(split_data[14])
-            self.data_snr.append(split_data[15])
-
-            # Makes sure that it doesn't try to change data to lists with no values
-            if len(self.data_latitude) > 0:
+            # Every base station's own data goes to its own store
+            for station in self.stations:
+                self.addPackets(self.stationStores[station.name], station.packets.drain())
+
+            # Nothing new has arrived, so there is nothing to add or redraw
+            if not new_raw:
+                return
+
+            packets, line_ok, new = self.addPackets(self.store, new_raw)
+            self.processed_packets += len(new_raw)
+            self.processed_at = time.perf_counter()
+            instrumentation.count("packets.received", len(packets))
+            # Rejected packets had no value that could be used, re-used ones were
+            # corrupted, but some of their values could still be used
+            instrumentation.count("packets.rejected", len(packets) - new)
+            instrumentation.count("packets.reused", new - int(numpy.count_nonzero(line_ok)))
+            instrumentation.gauge("packets.dropped", packet_queue.dropped)
+            instrumentation.gauge("queue.depth", len(packet_queue))
+            instrumentation.gauge("queue.max_depth", packet_queue.max_depth)
+
+            # Prints all received data to consoles in app
+            # Displayed console only gets packets that aren't corrupted at all
+            with instrumentation.timed("gui.console"):
+                self.raw_console.appendLines(packets)
+                self.displayed_console.appendLines([packet for packet, ok in zip(packets, line_ok) if ok])
+
+            # Shows in title if some packets had to be dropped or were received by more than one station
+            title = "Base station data"
+            if packet_queue.dropped > 0:
+                title += f" - {packet_queue.dropped} packets dropped"
+            if self.stations and stationRegistry is not None:
+                title += f" - {stationRegistry.merger.duplicates} copies from other stations merged"
+            if liveClient is not None and liveClient.lost > 0:
+                title += f" - {liveClient.lost} packets lost while disconnected"
+            if title != self.windowTitle():
+                self.setWindowTitle(title)
+        except Exception:
+            # One bad update mustn't stop the app, but it is counted and written to log
+            instrumentation.count("gui.errors")
+            log.exception("Updating data failed")
+
+    # Parses (receive time, packet) pairs and adds them to store
+    # If store is shown, graphs and map are updated as well
+    # Returns packets, which of them weren't corrupted and how many were added to store
+    def addPackets(self, store, new_raw):
+        if not new_raw:
+            return [], [], 0
+        received_times = numpy.array([packet[0] for packet in new_raw])
+        packets = [packet[1] for packet in new_raw]
+        # Checks and converts all new packets at once
+        # Values that are corrupted are NaN, other values of the same packet are kept
+        with instrumentation.timed("gui.parse"):
+            values, field_ok, line_ok = packet_parser.parse_lines(packets)
+            # Packets that have at least one good value go to store
+            usable = field_ok.any(axis=1)
+            # Time when packet was received by serial thread goes before data
+            rows = numpy.column_stack((received_times[usable], values[usable]))
+        # Derived values are computed from new rows only and go after packet values
+        pipeline = self.pipelines.get(id(store))
+        if pipeline is not None:
+            with instrumentation.timed("gui.derived"):
+                rows = pipeline.extend_rows(rows)
+
+        # Makes sure that it doesn't try to change data to lists with no values
+        new = len(rows)
+        if new > 0:
+            # Appends all new packets to store at once
+            with instrumentation.timed("gui.store"):
+                store.extend(rows)
+                # Without ingest daemon, other programs get data from this window
+                if store is self.store and sharedTelemetry is not None:
+                    sharedTelemetry.extend(rows)
+            if store is self.shownStore:
                 # Updates all graphs with new data
-                self.temp_plot.setData(self.timestamps, self.data_temp)
-                self.press_plot.setData(self.timestamps, self.data_press)
-                self.humid_plot.setData(self.timestamps, self.data_humid)
-                self.alt_plot.setData(self.timestamps, self.data_alt)
-                self.spd_plot.setData(self.timestamps, self.data_speed)
-                self.co2_plot_line.setData(self.timestamps, self.data_co2)
-                self.eco2_plot_line.setData(self.timestamps, self.data_eco2)
-                self.tvoc_plot_line.setData(self.timestamps, self.data_tvoc)
-                self.no2_plot_line.setData(self.timestamps, self.data_no2)
-                self.pm10_plot_line.setData(self.timestamps, self.data_pm10)
-                self.pm25_plot_line.setData(self.timestamps, self.data_pm25)
-                self.pm100_plot_line.setData(self.timestamps, self.data_pm100)
-                # If GPS signal is acquired add a marker in the map
-                if int(self.data_latitude[-1]) != 0:
-                    #self.add_marker()
-                    pass
-
-                # Prints received data to consoles in app
-                self.raw_console.append(raw_data[-1])
-                self.displayed_console.append(displayed_data[-1])
-        except:
-            pass
+                # Every line only draws about as many points as its graph is wide
+                for curve in self.curves:
+                    curve.update()
+                # Adds new GPS positions to track on map, positions without GPS signal are skipped
+                self.add_marker(store.column("latitude", new), store.column("longitude", new))
+        return packets, line_ok, new
+
+    # Graphs that weren't drawn while window was hidden or minimized are drawn when it is shown again
+    def showEvent(self, event):
+        super().showEvent(event)
+        self.redrawScheduler.markAll()
+
+    def changeEvent(self, event):
+        super().changeEvent(event)
+        if event.type() == QEvent.WindowStateChange and not self.isMinimized():
+            self.redrawScheduler.markAll()
+
+    # Shows or hides numbers from instrumentation, it is turned on when they are shown first time
+    def toggleStats(self):
+        if self.statsOverlay.isVisible():
+            self.statsOverlay.hide()
+            self.statsTimer.stop()
+            return
+        instrumentation.enable()
+        self.updateStats()
+        self.statsOverlay.show()
+        self.statsOverlay.raise_()
+        self.statsTimer.start()
+
+    def updateStats(self):
+        text = instrumentation.summary()
+        text += f"\nframe interval: {self.redrawScheduler.interval * 1000:.0f} ms"
+        if liveClient is not None:
+            text += f"\nconnected to daemon: {'yes' if liveClient.connected else 'no'}, {liveClient.lost} lost"
+        self.statsOverlay.setText(text)
+        self.statsOverlay.adjustSize()
+
+    def dumpStats(self):
+        path = f"stats_{datetime.now():%Y%m%d_%H%M%S}.json"
+        instrumentation.dump(path)
+        log.info("Stats written to %s", path)
+
+    # Range chosen in small graph is shown in all graphs
+    def selectRange(self):
+        start_time, end_time = self.rangeRegion.getRegion()
+        self.altitude_plot.setXRange(start_time, end_time, padding=0)
+
+    # Graphs have been zoomed or moved, range in small graph follows them
+    def rangeChanged(self, viewBox, xRange):
+        self.rangeRegion.setRegion(xRange)
+        self.rangeTimer.start()
+
+    # Shows track and smallest and largest values of the time range that graphs show
+    def showRange(self):
+        start_time, end_time = self.altitude_plot.getViewBox().viewRange()[0]
+        start, stop = self.session.time_range(start_time, end_time)
+        # Long ranges are drawn with every n-th point, map simplifies track further
+        step = max(1, -(-(stop - start) // analysis_track_points))
+        self.track.clear()
+        self.add_marker(self.session.column("latitude")[start:stop:step],
+                        self.session.column("longitude")[start:stop:step])
+
+        lines = [f"{datetime.fromtimestamp(start_time):%Y-%m-%d %H:%M:%S} - "
+                 f"{datetime.fromtimestamp(end_time):%Y-%m-%d %H:%M:%S}, {stop - start} rows"]
+        for name in self.session.columns[1:]:
+            low, high = self.session.minmax(name, start, stop)
+            lines.append(f"{name}: {low:.6g} ... {high:.6g}")
+        self.displayed_console.setPlainText("\n".join(lines))
+
+    def sessionInfo(self):
+        session = self.session
+        duration = timedelta(seconds=round(session.last_time - session.first_time))
+        lines = [session.path,
+                 f"{session.rows} rows, {len(session.columns)} columns",
+                 f"{datetime.fromtimestamp(session.first_time):%Y-%m-%d %H:%M:%S} - "
+                 f"{datetime.fromtimestamp(session.last_time):%Y-%m-%d %H:%M:%S} ({duration})"]
+        if session.build_seconds is not None:
+            lines.append(f"Cache made in {session.build_seconds:.1f} s")
+        return "\n".join(lines)
+
+    # Shows data of base station selected in source list, first item is merged data of all stations
+    def selectSource(self, index):
+        if index <= 0:
+            store = self.store
+        else:
+            store = self.stationStores[self.stations[index - 1].name]
+        if store is self.shownStore:
+            return
+        self.shownStore = store
+        for curve in self.curves:
+            curve.setStore(store)
+        # Track is drawn again from positions in selected store
+        self.track.clear()
+        self.add_marker(store.column("latitude"), store.column("longitude"))
 
     # Function that can put a marker on map
-    def add_marker(self):
-        js = Template(
-            """
-        L.marker([{{latitude}}, {{longitude}}] )
-            .addTo({{map}});
-        L.circleMarker(
-            [{{latitude}}, {{longitude}}], {
-                "bubblingMouseEvents": true,
-                "color": "#3388ff",
-                "dashArray": null,
-                "dashOffset": null,
-                "fill": false,
-                "fillColor": "#3388ff",
-                "fillOpacity": 0.2,
-                "fillRule": "evenodd",
-                "lineCap": "round",
-                "lineJoin": "round",
-                "opacity": 1.0,
-                "radius": 2,
-                "stroke": true,
-                "weight": 5
-            }
-        ).addTo({{map}});
-        """
-        ).render(map=self.map.get_name(), latitude=self.data_latitude[-1], longitude=self.data_longitude[-1])
-        self.mapView.page().runJavaScript(js)
+    # Adds position to track and moves current position marker there
+    # Without coordinates, newest position from store is used
+    def add_marker(self, latitude=None, longitude=None):
+        if latitude is None:
+            latitude = self.shownStore.column("latitude", 1)
+            longitude = self.shownStore.column("longitude", 1)
+        self.track.add(latitude, longitude)
+        self.redrawScheduler.markDirty(self.track.flush)
 
     # Function that adds all gui elements
     def initUI(self):
@@ -312,8 +580,9 @@ class Window(QWidget):
         self.setPalette(p)
 
         # Creates new text blocks to be used as consoles to display received data
-        self.raw_console = QtWidgets.QTextEdit()
-        self.displayed_console = QtWidgets.QTextEdit()
+        # They keep only the newest lines, so they don't slow app down over time
+        self.raw_console = LogView(max_lines=console_lines)
+        self.displayed_console = LogView(max_lines=console_lines)
 
         # Makes consoles wider
         self.raw_console.setFixedWidth(700)
@@ -326,6 +595,10 @@ class Window(QWidget):
         self.data = io.BytesIO()
         self.map.save(self.data, close_file=False)
         self.mapView = QWebEngineView()
+        # Track is drawn as one line, points are sent to map in batches
+        self.track = MapTrack(self.map.get_name(), self.mapView.page().runJavaScript)
+        self.mapView.loadFinished.connect(self.track.pageLoaded)
+        self.redrawScheduler.add(self.track.flush, self.mapView)
         self.mapView.setHtml(self.data.getvalue().decode())
 
         # Creates graph widgets
@@ -407,26 +680,67 @@ class Window(QWidget):
         axis9.attachToPlotItem(self.tvoc_plot.getPlotItem())
 
         # Plots data to graphs
-        self.temp_plot = self.temperature_plot.plot(x=self.timestamps, y=self.data_temp, pen=pg.mkPen('b', width=5))
+        self.temp_plot = DecimatedCurve(self.temperature_plot, self.store, "temp", pen=pg.mkPen('b', width=5))
+
+        self.press_plot = DecimatedCurve(self.pressure_plot, self.store, "pressure", pen=pg.mkPen('b', width=5))
+
+        self.humid_plot = DecimatedCurve(self.humidity_plot, self.store, "humidity", pen=pg.mkPen('b', width=5))
+
+        self.alt_plot = DecimatedCurve(self.altitude_plot, self.store, "altitude", pen=pg.mkPen('b', width=5))
 
-        self.press_plot = self.pressure_plot.plot(x=self.timestamps, y=self.data_press, pen=pg.mkPen('b', width=5))
+        self.spd_plot = DecimatedCurve(self.speed_plot, self.store, "speed", pen=pg.mkPen('b', width=5))
 
-        self.humid_plot = self.humidity_plot.plot(x=self.timestamps, y=self.data_humid, pen=pg.mkPen('b', width=5))
+        self.co2_plot_line = DecimatedCurve(self.co2_plot, self.store, "co2", name="CO2", pen=pg.mkPen('b', width=5))
+        self.eco2_plot_line = DecimatedCurve(self.co2_plot, self.store, "eco2", name="eCO2", pen=pg.mkPen('g', width=5))
 
-        self.alt_plot = self.altitude_plot.plot(x=self.timestamps, y=self.data_alt, pen=pg.mkPen('b', width=5))
+        self.tvoc_plot_line = DecimatedCurve(self.tvoc_plot, self.store, "tvoc", pen=pg.mkPen('b', width=5))
 
-        self.spd_plot = self.speed_plot.plot(x=self.timestamps, y=self.data_speed, pen=pg.mkPen('b', width=5))
+        self.no2_plot_line = DecimatedCurve(self.no2_plot, self.store, "no2", pen=pg.mkPen('b', width=5))
 
-        self.co2_plot_line = self.co2_plot.plot(x=self.timestamps, y=self.data_co2, name="CO2", pen=pg.mkPen('b', width=5))
-        self.eco2_plot_line = self.co2_plot.plot(x=self.timestamps, y=self.data_eco2, name="eCO2", pen=pg.mkPen('g', width=5))
+        self.pm10_plot_line = DecimatedCurve(self.pms_plot, self.store, "pm10", name="PM10", pen=pg.mkPen('b', width=5))
+        self.pm25_plot_line = DecimatedCurve(self.pms_plot, self.store, "pm25", name="PM25", pen=pg.mkPen('g', width=5))
+        self.pm100_plot_line = DecimatedCurve(self.pms_plot, self.store, "pm100", name="PM100", pen=pg.mkPen('r', width=5))
 
-        self.tvoc_plot_line = self.tvoc_plot.plot(x=self.timestamps, y=self.data_tvoc, pen=pg.mkPen('b', width=5))
+        # All graph lines, they are updated together when new data arrives
+        self.curves = [self.temp_plot, self.press_plot, self.humid_plot, self.alt_plot, self.spd_plot,
+                       self.co2_plot_line, self.eco2_plot_line, self.tvoc_plot_line, self.no2_plot_line,
+                       self.pm10_plot_line, self.pm25_plot_line, self.pm100_plot_line]
 
-        self.no2_plot_line = self.no2_plot.plot(x=self.timestamps, y=self.data_no2, pen=pg.mkPen('b', width=5))
+        # Graphs of derived values
+        if derived_metrics:
+            self.vertical_plot = pg.PlotWidget()
+            self.link_plot = pg.PlotWidget()
+            self.vertical_plot.setLabel(axis="left", text="Vertical speed, m/s")
+            self.link_plot.setLabel(axis="left", text="RSSI, dBm / SNR, dB / packets/s")
+            for plot in (self.vertical_plot, self.link_plot):
+                plot.setBackground(None)
+                plot.addLegend()
+                plot.plotItem.getAxis('left').setPen(pen_line)
+                DateAxisItem(orientation='bottom').attachToPlotItem(plot.getPlotItem())
+            self.altitude_plot.addLegend()
 
-        self.pm10_plot_line = self.pms_plot.plot(x=self.timestamps, y=self.data_pm10, name="PM10", pen=pg.mkPen('b', width=5))
-        self.pm25_plot_line = self.pms_plot.plot(x=self.timestamps, y=self.data_pm25, name="PM25", pen=pg.mkPen('g', width=5))
-        self.pm100_plot_line = self.pms_plot.plot(x=self.timestamps, y=self.data_pm100, name="PM100", pen=pg.mkPen('r', width=5))
+            self.vspeed_plot_line = DecimatedCurve(self.vertical_plot, self.store, "vertical_speed", name="Vertical speed", pen=pg.mkPen('b', width=3))
+            self.descent_plot_line = DecimatedCurve(self.vertical_plot, self.store, "descent_rate", name="Descent rate", pen=pg.mkPen('r', width=5))
+            self.palt_plot_line = DecimatedCurve(self.altitude_plot, self.store, "pressure_altitude", name="Pressure altitude", pen=pg.mkPen('g', width=5))
+
+            # Rolling means are drawn over the values they are computed from
+            self.pm10_mean_line = DecimatedCurve(self.pms_plot, self.store, "pm10_mean", name="PM10 mean", pen=pg.mkPen('b', width=2, style=Qt.DashLine))
+            self.pm25_mean_line = DecimatedCurve(self.pms_plot, self.store, "pm25_mean", name="PM25 mean", pen=pg.mkPen('g', width=2, style=Qt.DashLine))
+            self.pm100_mean_line = DecimatedCurve(self.pms_plot, self.store, "pm100_mean", name="PM100 mean", pen=pg.mkPen('r', width=2, style=Qt.DashLine))
+
+            self.rssi_plot_line = DecimatedCurve(self.link_plot, self.store, "rssi_mean", name="RSSI", pen=pg.mkPen('b', width=3))
+            self.snr_plot_line = DecimatedCurve(self.link_plot, self.store, "snr_mean", name="SNR", pen=pg.mkPen('g', width=3))
+            self.rate_plot_line = DecimatedCurve(self.link_plot, self.store, "packet_rate", name="Packets/s", pen=pg.mkPen('r', width=3))
+
+            self.curves += [self.vspeed_plot_line, self.descent_plot_line, self.palt_plot_line,
+                            self.pm10_mean_line, self.pm25_mean_line, self.pm100_mean_line,
+                            self.rssi_plot_line, self.snr_plot_line, self.rate_plot_line]
+
+            grid.addWidget(self.vertical_plot, 3, 0)
+            grid.addWidget(self.link_plot, 4, 0)
+
+        for curve in self.curves:
+            curve.setScheduler(self.redrawScheduler)
 
         # Adds all widgets to grid
         grid.addWidget(self.temperature_plot, 0, 0)
@@ -445,70 +759,283 @@ class Window(QWidget):
         grid.addWidget(self.displayed_console, 4, 2)
         grid.addWidget(self.mapView, 3, 1)
 
+        # List to choose which base station's data is shown, only when there is more than one
+        if self.stations:
+            self.sourceList = QComboBox()
+            self.sourceList.addItem("All stations")
+            for station in self.stations:
+                self.sourceList.addItem(f"{station.name} ({station.port})")
+            self.sourceList.currentIndexChanged.connect(self.selectSource)
+            grid.addWidget(self.sourceList, 4, 1)
+
+        # Recorded session: graphs are moved and zoomed together, and time range can be
+        # chosen in small graph of whole session under map
+        if self.session is not None:
+            self.setWindowTitle(f"Analysis - {os.path.basename(self.session.path)}")
+            for plot in (self.temperature_plot, self.pressure_plot, self.humidity_plot, self.speed_plot,
+                         self.co2_plot, self.tvoc_plot, self.no2_plot, self.pms_plot):
+                plot.setXLink(self.altitude_plot)
+            if derived_metrics:
+                self.vertical_plot.setXLink(self.altitude_plot)
+                self.link_plot.setXLink(self.altitude_plot)
+
+            self.rangePlot = pg.PlotWidget()
+            self.rangePlot.setBackground(None)
+            self.rangePlot.setLabel(axis="left", text="Altitude, meters")
+            self.rangePlot.plotItem.getAxis('left').setPen(pen_line)
+            self.rangePlot.setMouseEnabled(x=False, y=False)
+            DateAxisItem(orientation='bottom').attachToPlotItem(self.rangePlot.getPlotItem())
+            self.range_line = DecimatedCurve(self.rangePlot, self.store, "altitude", pen=pg.mkPen('b', width=2))
+            self.range_line.setScheduler(self.redrawScheduler)
+            self.curves.append(self.range_line)
+            self.rangeRegion = pg.LinearRegionItem([self.session.first_time, self.session.last_time])
+            self.rangeRegion.sigRegionChangeFinished.connect(self.selectRange)
+            self.rangePlot.addItem(self.rangeRegion)
+            grid.addWidget(self.rangePlot, 4, 1)
+
+            # Map and values of range are updated when range hasn't changed for a moment
+            self.rangeTimer = QTimer()
+            self.rangeTimer.setSingleShot(True)
+            self.rangeTimer.setInterval(300)
+            self.rangeTimer.timeout.connect(self.showRange)
+            self.altitude_plot.getViewBox().sigXRangeChanged.connect(self.rangeChanged)
+
+            self.raw_console.setPlainText(self.sessionInfo())
+            self.altitude_plot.setXRange(self.session.first_time, self.session.last_time, padding=0)
+            for curve in self.curves:
+                curve.update()
+            self.showRange()
+
+        # Counters and timings (see instrumentation.py) over graphs, F12 shows and hides them
+        # F11 writes them to a JSON file
+        self.statsOverlay = QLabel(self)
+        self.statsOverlay.setStyleSheet("background-color: rgba(255, 255, 255, 220); font-family: monospace; padding: 4px;")
+        self.statsOverlay.setAttribute(Qt.WA_TransparentForMouseEvents)
+        self.statsOverlay.hide()
+        self.statsTimer = QTimer()
+        self.statsTimer.setInterval(1000)
+        self.statsTimer.timeout.connect(self.updateStats)
+        QShortcut(QKeySequence("F12"), self).activated.connect(self.toggleStats)
+        QShortcut(QKeySequence("F11"), self).activated.connect(self.dumpStats)
+
         # Shows the ui
         self.show()
 
 
 # Checks if received data doesn't have symbols that it shouldn't have
+# and that it has all 16 values
 # Doesn't account if one number has changed to another one
 # If this check is required, then that has to be set in Cansats and Base station arduino code
 # But then we won't receive data if even one charecter has been corrupted
 # This way we still can receive data, even if not all of it can be used
-def isDataOK():
-    allowed_chars = [",", "."]
-    for char in base_station_data:
-        if not (char.isdigit() or char in allowed_chars):
-            return False
-    return True
+# GUI checks received packets in blocks with packet_parser.parse_lines,
+# which also keeps good values of corrupted packets
+def isDataOK(data):
+    return packet_parser.is_line_ok(data)
+
+
+
+# Base stations that are read in this process, only with --no-daemon
+stationRegistry = None
+# Connection to ingest daemon, None when data isn't received through it
+liveClient = None
+# Shared memory for other programs, when there is no ingest daemon to do it
+sharedTelemetry = None
+# Its name, not the same as daemon's, so that replay next to a running daemon doesn't take over daemon's feed
+window_feed_name = "rqbs_telemetry_window"
+
+
+# Spill file of window's store, next to csv file that daemon (or this process) records to
+# File left from an earlier window with the same process id is removed
+def spillFileName():
+    if liveClient is None:
+        root = file_name[:-4]
+    elif liveClient.recording:
+        root = liveClient.recording[:-4]
+    else:
+        # Daemon hasn't answered yet, so its file isn't known
+        root = "viewer"
+    # Every viewer of the same daemon has its own file, process id keeps them apart
+    name = f"{root}_spill_{os.getpid()}.bin"
+    if os.path.exists(name):
+        os.remove(name)
+    return name
+
+
+# Starts ingest daemon in its own process with the same ports
+# It gets its own process group, so that Ctrl+C in window's console doesn't stop recording
+def startDaemon(ports, address, all_ports=False, shared=True):
+    command = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "ingest_daemon.py"),
+               "--listen", f"{address[0]}:{address[1]}"]
+    for port in ports:
+        command += ["--port", port]
+    if all_ports:
+        command.append("--all-ports")
+    if not shared:
+        command.append("--no-shared")
+    if os.name == "nt":
+        return subprocess.Popen(command, creationflags=subprocess.CREATE_NEW_PROCESS_GROUP)
+    return subprocess.Popen(command, start_new_session=True)
+
+
+# Free TCP port on this computer, for a daemon that only this window uses
+def freePort():
+    with socket.socket() as free_socket:
+        free_socket.bind(("127.0.0.1", 0))
+        return free_socket.getsockname()[1]
+
+
+# Prints how many packets per second get through parsing, store and graphs while replaying
+# When replay has finished and everything has been drawn, prints total and closes app
+def report_replay(window, replay, app, exit_when_done):
+    processed = window.processed_packets
+    rate = processed - window.reported_packets
+    window.reported_packets = processed
+    print(f"Replay: {processed} packets processed, {rate} packets/s, sent {replay.rate():.0f} packets/s")
+    if replay.finished and len(packet_queue) == 0 and processed >= replay.sent:
+        # Time until the last packet was processed, not until this report
+        elapsed = (window.processed_at or time.perf_counter()) - replay.started_at
+        print(f"Replay finished: {processed} packets in {elapsed:.2f} s, "
+              f"{processed / max(elapsed, 1e-9):.0f} packets/s sustained")
+        if exit_when_done:
+            app.quit()
 
 
-
-# Connects to serial port and reads data from it
-def serialDataFunction():
-    base_station = None
-    # Opens serial data port
-    base_station = serial.Serial("COM4", 9600)
-    while True:
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Displays data received from base station")
+    parser.add_argument("--port", action="append",
+                        help="serial port of base station, found automatically if not given, "
+                             "can be given more than once for more base stations, also as name=port")
+    parser.add_argument("--all-ports", action="store_true", help="read every USB serial port as a base station")
+    parser.add_argument("--daemon", help="address of ingest daemon, host:port (default 127.0.0.1:8765)")
+    parser.add_argument("--connect", action="store_true",
+                        help="only connect to ingest daemon that is already running, don't start one")
+    parser.add_argument("--no-daemon", action="store_true",
+                        help="receive and record data in this process, without ingest daemon")
+    parser.add_argument("--stop-daemon", action="store_true", help="stop ingest daemon (and its recording) and exit")
+    parser.add_argument("--replay", help="replay recorded csv file or .rqlog flight log instead of serial port")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="replay speed, 1 is real time, 10 is ten times faster, 0 is as fast as possible")
+    parser.add_argument("--pty", action="store_true",
+                        help="replay through a pseudo-terminal and serial reading code (Linux only)")
+    parser.add_argument("--loop", action="store_true", help="start replay again when it ends")
+    parser.add_argument("--exit-when-done", action="store_true", help="close app when replay has finished")
+    parser.add_argument("--open", help="open recorded csv file or .rqlog flight log for analysis, "
+                                       "nothing is received or recorded then")
+    parser.add_argument("--stats", action="store_true", help="count and time hot paths and show them over graphs")
+    parser.add_argument("--stats-file",
+                        help="write counters and timings of every process to this JSON file (process name is added)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s: %(message)s")
+    # Ingest daemon and station processes get these settings through environment
+    if args.stats_file:
+        os.environ["RQBS_STATS_FILE"] = args.stats_file
+    if args.stats or args.stats_file:
+        instrumentation.enable()
+
+    if args.stop_daemon:
+        address = parse_address(args.daemon)
+        if stop_daemon(address):
+            log.info("Stopped ingest daemon at %s:%s", address[0], address[1])
+        else:
+            log.warning("No ingest daemon at %s:%s", address[0], address[1])
+        sys.exit()
+
+    if args.open:
+        # Recorded session is only looked at, serial ports and daemon aren't used
+        app = QtWidgets.QApplication([])
+        started = time.perf_counter()
+        session = open_session(args.open, derived=derived_metrics)
+        window = Window(session=session)
+        log.info("Opened %s (%d rows) in %.2f s", args.open, session.rows, time.perf_counter() - started)
+        sys.exit(app.exec_())
+
+    replay = None
+    ports = args.port or []
+    if args.all_ports and args.no_daemon:
+        ports += find_ports()
+    if args.replay and args.pty:
+        # Recorded data goes through pseudo-terminal, so it is read and recorded like real serial data
         try:
-            # If serial connection has been lost, tries to reconnect back
-            if(base_station == None):
-                base_station = serial.Serial("COM4", 9600)
-                print("Reconnecting")
-            # Reads data from serial port
-            # It blocks function from progressing untill some data has been received
-            base_station_data = str(base_station.readline())
-            # Removes useless data from string
-            base_station_data = base_station_data[2:-6]
-            # If data is not corrupted add data to both data lists
-            if isDataOK():
-                raw_data.append(base_station_data)
-                displayed_data.append(base_station_data)
-            # If some data has been corrupted, doesn't add it to list that
-            # is used to update data to graphs
-            else:
-                raw_data.append(base_station_data)
-
-            with open(file_name, "a", newline="", encoding="UTF8") as csv_f:
-                writer = csv.writer(csv_f)
-                writer.writerow([datetime.now().strftime("%H:%M:%S"), base_station_data])
-        except:
-            # If something goes wrong closes port and tries again
-            if(not(base_station == None)):
-                base_station.close()
-                base_station = None
-                print("Disconnecting")
-
-            print("No Connection")
-            time.sleep(0.25)
-
+            replay = PtyReplay(args.replay, speed=args.speed, loop=args.loop)
+        except OSError as e:
+            parser.error(str(e))
+        ports = [replay.port]
+    elif args.replay:
+        # Recorded data goes straight to packet queue, serial port isn't used
+        replay = ReplaySource(args.replay, packet_queue, speed=args.speed, loop=args.loop)
+
+    daemonProcess = None
+    stations = ()
+    if (replay is not None and not args.pty or args.no_daemon) and shared_feed_name is not None:
+        try:
+            sharedTelemetry = SharedTelemetry(window_feed_name, capacity=store_capacity, columns=storeColumns())
+        except FileExistsError as e:
+            log.warning("%s, telemetry isn't shared", e)
+    if (replay is None or args.pty) and args.no_daemon:
+        # Station workers are started before Qt, so that worker processes don't get a copy of it
+        recorder.start()
+        stationRegistry = createStations(ports, packet_queue)
+        stationRegistry.start()
+        stations = stationRegistry.stations.values()
+    elif args.pty and replay is not None:
+        # Replay gets a daemon of its own on a free port, so that it never attaches to a running
+        # daemon that doesn't read the pseudo-terminal (and doesn't take over its shared memory)
+        address = ("127.0.0.1", freePort())
+        liveClient = LiveClient(packet_queue, address)
+        daemonProcess = startDaemon(ports, address, shared=False)
+    elif replay is None:
+        address = parse_address(args.daemon)
+        liveClient = LiveClient(packet_queue, address)
+        # Daemon that is already running is used, otherwise a new one is started
+        if not args.connect and not liveClient.connect(timeout=0):
+            daemonProcess = startDaemon(ports, address, args.all_ports)
+    if liveClient is not None:
+        # Waits for daemon, so that its base stations are known when window is created
+        if not liveClient.connect(timeout=10.0):
+            log.warning("No ingest daemon at %s:%s, waiting for it", address[0], address[1])
+        liveClient.start()
+        stations = liveClient.stations.values()
 
-if __name__ == '__main__':
     # Creates a new application process
     app = QtWidgets.QApplication([])
     # Creates the main window
-    window = Window()
-    serialThread = threading.Thread(target=serialDataFunction, daemon=True)
-    serialThread.start()
+    window = Window(stations)
+    if args.stats:
+        window.toggleStats()
+
+    if replay is not None:
+        # When replaying as fast as possible, packets are taken from queue as often as possible,
+        # graphs are still drawn by scheduler
+        if args.speed <= 0:
+            window.qTimer.setInterval(0)
+        replay.start()
+        reportTimer = QTimer()
+        reportTimer.setInterval(1000)
+        reportTimer.timeout.connect(lambda: report_replay(window, replay, app, args.exit_when_done))
+        reportTimer.start()
+
     # If app is closed, stop running code
     ret = app.exec_()
+    # Writes everything that hasn't been saved yet
+    if stationRegistry is not None:
+        stationRegistry.stop()
+    recorder.close()
+    flight_log.close()
+    if sharedTelemetry is not None:
+        sharedTelemetry.close()
+    instrumentation.save("main")
+    if liveClient is not None:
+        liveClient.stop()
+    # Daemon keeps recording after window is closed, so window can be opened again without
+    # losing anything. Only daemon that was started for replay through pseudo-terminal is stopped.
+    if daemonProcess is not None and replay is None:
+        log.info("Ingest daemon keeps recording, stop it with: python main.py --stop-daemon")
+    elif daemonProcess is not None:
+        stop_daemon(liveClient.address)
+        try:
+            daemonProcess.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            daemonProcess.terminate()
     sys.exit()
@@ -0,0 +1,194 @@
+# Track of Cansat on map
+# Whole flight is one Leaflet polyline drawn on canvas, and there is only one
+# marker for current position which is moved. New GPS points are collected and
+# sent to the map in one JavaScript call. When track gets longer than max_points,
+# it is simplified with Douglas-Peucker algorithm, so map stays fast during long flights.
+import json
+
+import numpy
+from jinja2 import Template
+
+import instrumentation
+
+
+# Creates track and marker and functions to change them, runs once after map has loaded
+_SETUP_JS = Template(
+    """
+    (function() {
+        var map = {{map}};
+        var renderer = L.canvas();
+        window.rqTrack = L.polyline([], {
+            "color": "#3388ff",
+            "weight": 3,
+            "opacity": 1.0,
+            "renderer": renderer
+        }).addTo(map);
+        window.rqMarker = null;
+        window.rqMoveMarker = function(point) {
+            if (window.rqMarker === null) {
+                window.rqMarker = L.circleMarker(point, {
+                    "color": "#ff3333",
+                    "fill": true,
+                    "fillOpacity": 1.0,
+                    "radius": 6,
+                    "renderer": renderer
+                }).addTo(map);
+            } else {
+                window.rqMarker.setLatLng(point);
+            }
+        };
+        // Adds points to the end of track, track is redrawn only once
+        window.rqExtend = function(points) {
+            var latLngs = window.rqTrack.getLatLngs();
+            for (var i = 0; i < points.length; i++) {
+                latLngs.push(L.latLng(points[i][0], points[i][1]));
+            }
+            window.rqTrack.setLatLngs(latLngs);
+            window.rqMoveMarker(points[points.length - 1]);
+        };
+        // Replaces whole track, used after track has been simplified
+        window.rqReplace = function(points) {
+            window.rqTrack.setLatLngs(points);
+            if (points.length > 0) {
+                window.rqMoveMarker(points[points.length - 1]);
+            }
+        };
+    })();
+    """
+)
+
+_EXTEND_JS = "rqExtend({points});"
+_REPLACE_JS = "rqReplace({points});"
+
+
+# Douglas-Peucker simplification, returns indexes of points that are kept
+# Distances are in degrees, longitude is scaled so that it is comparable to latitude
+def simplify(latitudes, longitudes, tolerance):
+    n = len(latitudes)
+    if n <= 2:
+        return numpy.arange(n)
+    scale = numpy.cos(numpy.radians(numpy.nanmean(latitudes)))
+    x = numpy.asarray(longitudes) * scale
+    y = numpy.asarray(latitudes)
+
+    keep = numpy.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        # Distance of every point between first and last from line through them
+        dx = x[last] - x[first]
+        dy = y[last] - y[first]
+        px = x[first + 1:last] - x[first]
+        py = y[first + 1:last] - y[first]
+        length = numpy.hypot(dx, dy)
+        if length == 0:
+            distances = numpy.hypot(px, py)
+        else:
+            distances = numpy.abs(dx * py - dy * px) / length
+        farthest = int(numpy.argmax(distances))
+        if distances[farthest] > tolerance:
+            middle = first + 1 + farthest
+            keep[middle] = True
+            stack.append((first, middle))
+            stack.append((middle, last))
+    return numpy.nonzero(keep)[0]
+
+
+class MapTrack:
+    def __init__(self, mapName, runJavaScript, max_points=2000, tolerance=0.00001):
+        self.mapName = mapName
+        self.runJavaScript = runJavaScript
+        # When drawn track has more points than this, it is simplified
+        self.max_points = max_points
+        # Smallest simplification tolerance in degrees (about 1 m)
+        self.tolerance = tolerance
+
+        # Every GPS point received, kept for simplification
+        self.latitudes = numpy.empty(1024)
+        self.longitudes = numpy.empty(1024)
+        self.size = 0
+        # Number of points drawn on map and number of received points already sent to it
+        self.drawn = 0
+        self.sent = 0
+        self.ready = False
+        self._lastTolerance = tolerance
+        # Whole track has to be drawn again, e.g. after another source was selected
+        self._replace = False
+
+    # Called when map page has loaded, before that JavaScript can't be run
+    def pageLoaded(self, ok=True):
+        if not ok or self.ready:
+            return
+        self.runJavaScript(_SETUP_JS.render(map=self.mapName))
+        self.ready = True
+        self.flush()
+
+    # Adds GPS points, points without GPS signal (0, 0) are skipped
+    # They are sent to map with flush
+    def add(self, latitudes, longitudes):
+        latitudes = numpy.asarray(latitudes, dtype=numpy.float64).ravel()
+        longitudes = numpy.asarray(longitudes, dtype=numpy.float64).ravel()
+        # Same check as before: no GPS signal means latitude is 0
+        fix = numpy.isfinite(latitudes) & numpy.isfinite(longitudes) & (numpy.trunc(latitudes) != 0)
+        latitudes = latitudes[fix]
+        longitudes = longitudes[fix]
+        n = len(latitudes)
+        if n == 0:
+            return
+        if self.size + n > len(self.latitudes):
+            capacity = max(self.size + n, 2 * len(self.latitudes))
+            for name in ("latitudes", "longitudes"):
+                grown = numpy.empty(capacity)
+                grown[:self.size] = getattr(self, name)[:self.size]
+                setattr(self, name, grown)
+        self.latitudes[self.size:self.size + n] = latitudes
+        self.longitudes[self.size:self.size + n] = longitudes
+        self.size += n
+
+    # Forgets all points, track is drawn again from points added after this
+    def clear(self):
+        self.size = 0
+        self.sent = 0
+        self.drawn = 0
+        self._lastTolerance = self.tolerance
+        self._replace = True
+
+    # Sends new points to map in one call
+    def flush(self):
+        if not self.ready or (self.sent == self.size and not self._replace):
+            return
+        with instrumentation.timed("gui.map_js"):
+            self._send()
+
+    def _send(self):
+        new = self.size - self.sent
+        if self._replace and self.size <= self.max_points:
+            points = numpy.column_stack((self.latitudes[:self.size], self.longitudes[:self.size]))
+            self.runJavaScript(_REPLACE_JS.format(points=json.dumps(points.tolist())))
+            self.drawn = self.size
+        elif self.drawn + new <= self.max_points:
+            points = numpy.column_stack((self.latitudes[self.sent:self.size],
+                                         self.longitudes[self.sent:self.size]))
+            self.runJavaScript(_EXTEND_JS.format(points=json.dumps(points.tolist())))
+            self.drawn += new
+        else:
+            # Track is too long, whole track is simplified and drawn again
+            # Tolerance is doubled until track has at most half of max_points,
+            # so this doesn't have to be done again for a while
+            # Starts from tolerance used last time, track only gets longer
+            tolerance = self._lastTolerance
+            latitudes = self.latitudes[:self.size]
+            longitudes = self.longitudes[:self.size]
+            kept = simplify(latitudes, longitudes, tolerance)
+            while len(kept) > self.max_points // 2:
+                tolerance *= 2
+                kept = simplify(latitudes, longitudes, tolerance)
+            points = numpy.column_stack((latitudes[kept], longitudes[kept]))
+            self.runJavaScript(_REPLACE_JS.format(points=json.dumps(points.tolist())))
+            self.drawn = len(kept)
+            self._lastTolerance = tolerance
+        self.sent = self.size
+        self._replace = False
@@ -0,0 +1,189 @@
+# Parses and checks many packets at once
+# Packet is a line of 16 numbers separated by commas. Lines are checked and
+# converted with numpy over the whole block instead of character by character.
+# For every line it returns which values could be read, so a partially corrupted
+# packet still gives its good values, and which lines are completely fine.
+import warnings
+
+import numpy
+
+from telemetry_store import FIELD_NAMES
+
+
+# Characters that can be in a number
+NUMBER_CHARS = b"0123456789.-"
+
+# Lookup table that says if a byte can be in a number
+_number_char = numpy.zeros(256, dtype=bool)
+_number_char[numpy.frombuffer(NUMBER_CHARS, dtype=numpy.uint8)] = True
+
+_COMMA = ord(",")
+_NEWLINE = ord("\n")
+
+
+# Parses block of lines (bytes or str, without line endings)
+# Returns:
+#   values - array (lines, fields), values that couldn't be read are NaN
+#   field_ok - array (lines, fields), True where value was read
+#   line_ok - array (lines,), True for lines with right number of values and no wrong characters
+def parse_lines(lines, field_count=len(FIELD_NAMES)):
+    n = len(lines)
+    values = numpy.full((n, field_count), numpy.nan)
+    field_ok = numpy.zeros((n, field_count), dtype=bool)
+    if n == 0:
+        return values, field_ok, numpy.zeros(0, dtype=bool)
+
+    lines = [line.encode("ascii", errors="replace") if isinstance(line, str) else line for line in lines]
+
+    # All lines in one buffer, every line ends with newline
+    buffer = numpy.frombuffer(b"\n".join(lines) + b"\n", dtype=numpy.uint8)
+    lengths = numpy.fromiter((len(line) for line in lines), dtype=numpy.int64, count=n)
+    starts = numpy.zeros(n, dtype=numpy.int64)
+    numpy.cumsum(lengths[:-1] + 1, out=starts[1:])
+
+    # Counts wrong characters and commas in every line at once
+    is_comma = buffer == _COMMA
+    is_wrong = ~(_number_char[buffer] | is_comma | (buffer == _NEWLINE))
+    wrong_chars = numpy.add.reduceat(is_wrong, starts)
+    commas = numpy.add.reduceat(is_comma, starts)
+    line_ok = (wrong_chars == 0) & (commas == field_count - 1) & (lengths > 0)
+
+    # Good lines are converted all together
+    good = numpy.nonzero(line_ok)[0]
+    if len(good) > 0:
+        converted = _block_to_float(b",".join(lines[i] for i in good), len(good) * field_count)
+        converted = converted.reshape(len(good), field_count)
+        values[good] = converted
+        field_ok[good] = ~numpy.isnan(converted)
+        # Lines with something like "1.2.3" or "" in them pass character check but aren't fine
+        line_ok[good] = field_ok[good].all(axis=1)
+
+    # Corrupted lines keep values that can still be trusted
+    bad = numpy.nonzero(~line_ok)[0]
+    bad = bad[~numpy.isin(bad, good)] if len(good) > 0 else bad
+    if len(bad) > 0:
+        _parse_corrupted(lines, bad, commas[bad] == field_count - 1, values, field_ok, field_count)
+
+    return values, field_ok, line_ok
+
+
+# Checks one line, True if it has right number of values and all of them can be read
+def is_line_ok(line, field_count=len(FIELD_NAMES)):
+    return bool(parse_lines([line], field_count)[2][0])
+
+
+# Packs field_ok rows into integers, bit i is set if value i was read
+def field_masks(field_ok):
+    bits = numpy.left_shift(numpy.uint32(1), numpy.arange(field_ok.shape[1], dtype=numpy.uint32))
+    return (field_ok * bits).sum(axis=1, dtype=numpy.uint32)
+
+
+# Converts comma separated numbers to floats in one call
+# If some number can't be read, falls back to converting them separately
+def _block_to_float(text, count):
+    with warnings.catch_warnings():
+        # numpy only warns when it can't read the whole string, here it is an error
+        warnings.simplefilter("error", DeprecationWarning)
+        try:
+            result = numpy.fromstring(text.decode("ascii"), dtype=numpy.float64, sep=",")
+            if result.size == count:
+                return result
+        except (DeprecationWarning, ValueError):
+            pass
+    return _to_float(text.split(b","))
+
+
+# Converts list of byte strings to floats, the ones that can't be converted are NaN
+def _to_float(fields):
+    fields = numpy.array(fields, dtype=bytes)
+    try:
+        return fields.astype(numpy.float64)
+    except ValueError:
+        pass
+    # Some field is not a number, few fields are faster to check one by one
+    result = numpy.full(len(fields), numpy.nan)
+    if len(fields) <= 64:
+        for i, field in enumerate(fields.tolist()):
+            try:
+                result[i] = float(field)
+            except ValueError:
+                pass
+        return result
+    # Empty values (missing values in recorded files) are the most common ones
+    empty = fields == b""
+    if empty.any():
+        fields = fields.astype(f"S{max(fields.itemsize, 3)}")
+        fields[empty] = b"nan"
+        try:
+            return fields.astype(numpy.float64)
+        except ValueError:
+            fields[empty] = b""
+    # Fields are checked all at once as a table of bytes, so one bad field doesn't
+    # make every field of a big block to be checked one by one
+    chars = fields.view(numpy.uint8).reshape(len(fields), fields.itemsize)
+    digits = numpy.count_nonzero((chars >= ord("0")) & (chars <= ord("9")), axis=1)
+    dots = numpy.count_nonzero(chars == ord("."), axis=1)
+    minus = chars == ord("-")
+    # Only number characters, shorter fields are padded with zero bytes
+    plain = digits + dots + numpy.count_nonzero(minus, axis=1) == numpy.count_nonzero(chars, axis=1)
+    # Like "-12.5", "", "-", "1.2.3" and "1-2" are plain, but not numbers
+    number = plain & (digits > 0) & (dots <= 1) & ~minus[:, 1:].any(axis=1)
+    result[number] = fields[number].astype(numpy.float64)
+    # Anything else (spaces, exponents, ...) is checked one by one
+    for i in numpy.nonzero(~plain)[0].tolist():
+        try:
+            result[i] = float(fields[i])
+        except ValueError:
+            pass
+    return result
+
+
+# Reads values from corrupted lines
+# If line has right number of commas, every value is at its place and all values with
+# right characters are kept. If commas are missing or extra, values are shifted after
+# broken part of line. Then values before first unreadable value are kept, and values
+# after last unreadable value are kept at their places counted from end of line
+# (RSSI and SNR are always last). If every value can be read even though commas are
+# wrong, it isn't known where values got shifted, so none of them are kept.
+def _parse_corrupted(lines, rows, commas_right, values, field_ok, field_count):
+    split_lines = [lines[row].split(b",") for row in rows.tolist()]
+    fields = [field for line_fields in split_lines for field in line_fields]
+    if not fields:
+        return
+
+    # Checks characters of all fields at once, as a matrix of bytes
+    array = numpy.array(fields, dtype=bytes)
+    width = max(array.dtype.itemsize, 1)
+    chars = numpy.frombuffer(array.tobytes(), dtype=numpy.uint8).reshape(len(array), width)
+    chars_ok = (_number_char[chars] | (chars == 0)).all(axis=1) & (chars[:, 0] != 0)
+
+    converted = numpy.full(len(array), numpy.nan)
+    if chars_ok.any():
+        converted[chars_ok] = _to_float(array[chars_ok])
+    readable = ~numpy.isnan(converted)
+
+    start = 0
+    for row, aligned, line_fields in zip(rows.tolist(), commas_right.tolist(), split_lines):
+        count = len(line_fields)
+        line_readable = readable[start:start + count]
+        line_values = converted[start:start + count]
+        start += count
+
+        if aligned:
+            columns = numpy.nonzero(line_readable)[0]
+            values[row, columns] = line_values[columns]
+            field_ok[row, columns] = True
+            continue
+
+        unreadable = numpy.nonzero(~line_readable)[0]
+        if len(unreadable) == 0:
+            continue
+        # Values before first broken one
+        head = min(unreadable[0], field_count)
+        values[row, :head] = line_values[:head]
+        field_ok[row, :head] = True
+        # Values after last broken one, counted from end of line
+        tail = min(count - 1 - unreadable[-1], field_count - head)
+        if tail > 0:
+            values[row, field_count - tail:] = line_values[count - tail:]
+            field_ok[row, field_count - tail:] = True
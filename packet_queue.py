@@ -0,0 +1,65 @@
+# Queue that passes received packets from serial thread to the GUI
+# One thread puts packets in, other thread takes them out.
+# It has a fixed size, so memory can't grow without limit. If GUI is too slow and
+# queue fills up, oldest packets are dropped, so serial thread never has to wait.
+import collections
+
+
+class PacketQueue:
+    def __init__(self, maxsize=10000):
+        self.maxsize = int(maxsize)
+        # deque with maxlen drops oldest item by itself when it is full
+        # Appending and popping from deque is atomic, so no lock is needed
+        self._items = collections.deque(maxlen=self.maxsize)
+        # Only serial thread changes pushed and only GUI thread changes popped
+        self.pushed = 0
+        self.popped = 0
+        # Highest number of packets that have been waiting in queue
+        self.max_depth = 0
+
+    def __len__(self):
+        return len(self._items)
+
+    # Adds packet to queue, never blocks
+    def put(self, item):
+        self._items.append(item)
+        self.pushed += 1
+        depth = len(self._items)
+        if depth > self.max_depth:
+            self.max_depth = depth
+
+    # Adds many packets to queue at once
+    def put_many(self, items):
+        for item in items:
+            self.put(item)
+
+    # Takes all packets (or at most max_items) that are waiting in queue
+    def drain(self, max_items=None):
+        items = []
+        pop = self._items.popleft
+        while max_items is None or len(items) < max_items:
+            try:
+                items.append(pop())
+            except IndexError:
+                break
+        self.popped += len(items)
+        return items
+
+    # Free space left in queue, sources that can wait (like replay) use it to slow down
+    def free(self):
+        return self.maxsize - len(self._items)
+
+    # Number of packets that were dropped because queue was full
+    @property
+    def dropped(self):
+        return max(0, self.pushed - self.popped - len(self._items))
+
+    # Counters as a dictionary, to be displayed or saved
+    def stats(self):
+        return {
+            "pushed": self.pushed,
+            "popped": self.popped,
+            "dropped": self.dropped,
+            "depth": len(self._items),
+            "max_depth": self.max_depth,
+        }
@@ -0,0 +1,178 @@
+# Writes every received packet to csv file
+# Serial thread only hands packets over to recorder, which writes them from its own thread.
+# File is kept open and rows are written in batches - when enough rows have
+# been collected, when some time has passed and when recorder is closed.
+# When file gets too big or too old, recording continues in a new file.
+import collections
+import csv
+import os
+import threading
+import time
+from datetime import datetime
+
+import numpy
+
+from telemetry_store import FIELD_NAMES
+import packet_parser
+import instrumentation
+
+
+# First row of every csv file
+CSV_HEADER = ["Time", "Latititude", "Longitude", "Speed", "Altitude", "Temp", "Humidity", "Pressure",
+              "eCO2", "CO2", "TVOC", "NO2", "PM10", "PM25", "PM100", "RSSI", "SNR"]
+
+
+# Turns received packets into csv rows with a column for every value, also returns parsed values
+# Packets are checked like for graphs (see packet_parser.py): values moved to a wrong
+# place by a lost or extra comma and values that can't be read are left empty,
+# so that columns always match header
+def packets_to_rows(items):
+    values, field_ok, line_ok = packet_parser.parse_lines([item[1] for item in items])
+    rows = [[format_time(received_time)] + packet.split(",") for received_time, packet in items]
+    for i in numpy.nonzero(~line_ok)[0].tolist():
+        row_ok = field_ok[i].tolist()
+        if len(rows[i]) != len(FIELD_NAMES) + 1:
+            # Values that were kept from both ends of packet are written as numbers
+            fields = [f"{value:.15g}" if ok else "" for value, ok in zip(values[i].tolist(), row_ok)]
+        else:
+            fields = [field if ok else "" for field, ok in zip(rows[i][1:], row_ok)]
+        rows[i][1:] = fields
+    return rows, values
+
+
+# Derived value as written to csv file, values that couldn't be computed are left empty
+def format_value(value):
+    return f"{value:.6g}" if value == value else ""
+
+
+# Time as written to csv file, with milliseconds
+def format_time(received_time):
+    return datetime.fromtimestamp(received_time).strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
+
+
+class CsvRecorder:
+    def __init__(self, file_name, flush_rows=100, flush_interval=1.0,
+                 max_bytes=50 * 1024 * 1024, max_seconds=None, header=CSV_HEADER, derived=None):
+        self.file_name = file_name
+        # Rows are written when this many are waiting ...
+        self.flush_rows = flush_rows
+        # ... or when this many seconds have passed
+        self.flush_interval = flush_interval
+        # New file is started when current one is bigger or older than this (None turns it off)
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+        # Derived values (see derived.py) are written after packet values, if pipeline is given
+        self.derived = derived
+        self.header = list(header) + (derived.names if derived is not None else [])
+
+        # Files that have been written, first one has the given name,
+        # next ones get _1, _2 ... added to it
+        self.files = []
+        self.rows_written = 0
+
+        self._pending = collections.deque()
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._running = False
+        self._thread = None
+        self._file = None
+        self._writer = None
+        self._opened_at = 0.0
+
+    # Starts recorder thread
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    # Adds packet to be written, called from serial thread
+    # This doesn't touch the file, so serial thread can go back to reading straight away
+    def write(self, received_time, packet):
+        self._pending.append((received_time, packet))
+        if len(self._pending) >= self.flush_rows:
+            self._wake.set()
+
+    # Adds many packets received at the same time
+    def write_many(self, received_time, packets):
+        self._pending.extend((received_time, packet) for packet in packets)
+        if len(self._pending) >= self.flush_rows:
+            self._wake.set()
+
+    # Writes all waiting rows to file right now
+    def flush(self):
+        with self._lock:
+            self._write_pending()
+
+    # Writes everything that is left and closes file, called when app is closed
+    def close(self):
+        self._running = False
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        with self._lock:
+            self._write_pending()
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+                self._writer = None
+
+    def _run(self):
+        while self._running:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+
+    def _write_pending(self):
+        if not self._pending:
+            return
+        if self._file is None:
+            self._open_file()
+
+        start = time.perf_counter()
+        items = []
+        pop = self._pending.popleft
+        while True:
+            try:
+                items.append(pop())
+            except IndexError:
+                break
+        # Packets of the whole batch are parsed together
+        rows, values = packets_to_rows(items)
+        if self.derived is not None:
+            derived = self.derived.process(numpy.array([item[0] for item in items]), values)
+            for row, derived_row in zip(rows, derived.tolist()):
+                row += [format_value(value) for value in derived_row]
+        self._writer.writerows(rows)
+        # Hands data over to operating system, so it is saved even if app crashes
+        self._file.flush()
+        self.rows_written += len(rows)
+        instrumentation.observe("csv.write", time.perf_counter() - start)
+        instrumentation.count("csv.rows", len(rows))
+
+        if self._should_rotate():
+            self._file.close()
+            self._open_file()
+
+    def _should_rotate(self):
+        if self.max_bytes is not None and self._file.tell() >= self.max_bytes:
+            return True
+        if self.max_seconds is not None and time.time() - self._opened_at >= self.max_seconds:
+            return True
+        return False
+
+    def _open_file(self):
+        if not self.files:
+            name = self.file_name
+        else:
+            root, ext = os.path.splitext(self.file_name)
+            name = f"{root}_{len(self.files)}{ext}"
+        self.files.append(name)
+        self._file = open(name, "a", newline="", encoding="UTF8")
+        self._writer = csv.writer(self._file)
+        # Header is written only to new files
+        if self._file.tell() == 0:
+            self._writer.writerow(self.header)
+        self._opened_at = time.time()
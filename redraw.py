@@ -0,0 +1,103 @@
+# Decides when graphs and map are drawn again
+# Receiving data and drawing it are separate: ingest timer only adds new data to
+# store and marks the graphs whose data changed. Scheduler draws marked graphs in one
+# frame, at most max_fps times per second, so many small updates are drawn together.
+# Graphs that can't be seen (window minimized, widget hidden) stay marked and are drawn
+# when they can be seen again.
+# Every frame is timed. If drawing takes longer than frame budget, frames are spaced
+# further apart, so drawing never takes all of GUI thread's time. When frames are fast
+# again, spacing goes back to normal.
+import time
+
+from PyQt5.QtCore import QObject, QTimer
+
+import instrumentation
+
+
+class RedrawScheduler(QObject):
+    def __init__(self, max_fps=20, budget=0.5, max_interval=2.0, hidden_interval=0.5, parent=None):
+        super().__init__(parent)
+        # Shortest time between frames
+        self.min_interval = 1.0 / max_fps
+        # Part of time between frames that drawing may take, e.g. 0.5 leaves half for everything else
+        self.budget = budget
+        # Longest time between frames when frames are slow
+        self.max_interval = max_interval
+        # How often hidden graphs are checked again
+        self.hidden_interval = hidden_interval
+        self.interval = self.min_interval
+
+        # Things that can be drawn: draw function -> widget that has to be visible for it
+        self._items = {}
+        self._dirty = set()
+        self._lastFrame = 0.0
+        # Time the last frame took, frames drawn and frames that were over budget
+        self.frame_time = 0.0
+        self.frames = 0
+        self.slow_frames = 0
+
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.timeout.connect(self._frame)
+
+    # Adds draw function, widget is used to check if it can be seen
+    def add(self, draw, widget=None):
+        self._items[draw] = widget
+
+    # Marks draw function to be called in next frame
+    def markDirty(self, draw):
+        self._dirty.add(draw)
+        self._schedule(self.interval)
+
+    # Marks everything, e.g. when window is shown again
+    # Timer may be waiting longer for hidden graphs, so frame is scheduled again
+    def markAll(self):
+        self._dirty.update(self._items)
+        self._timer.stop()
+        self._schedule(self.interval)
+
+    def _schedule(self, interval):
+        if self._timer.isActive():
+            return
+        # Frame isn't drawn sooner than interval after the last one
+        wait = max(0.0, self._lastFrame + interval - time.perf_counter())
+        self._timer.start(int(wait * 1000))
+
+    def _visible(self, widget):
+        if widget is None:
+            return True
+        window = widget.window()
+        return widget.isVisible() and not window.isMinimized()
+
+    def _frame(self):
+        start = time.perf_counter()
+        hidden = set()
+        dirty, self._dirty = self._dirty, set()
+        for draw in dirty:
+            if self._visible(self._items.get(draw)):
+                draw()
+            else:
+                hidden.add(draw)
+        end = time.perf_counter()
+        self._lastFrame = end
+
+        drawn = len(dirty) - len(hidden)
+        if drawn:
+            self.frame_time = end - start
+            self.frames += 1
+            instrumentation.observe("gui.frame", self.frame_time)
+            if self.frame_time > self.budget * self.interval:
+                # Drawing took too long, next frames are further apart
+                self.slow_frames += 1
+                instrumentation.count("gui.slow_frames")
+                self.interval = min(self.max_interval, max(self.interval * 2, self.frame_time / self.budget))
+            elif self.frame_time < self.budget * self.interval / 2:
+                # Fast again, goes back towards max_fps step by step
+                self.interval = max(self.min_interval, self.interval * 0.75)
+
+        # Hidden graphs are tried again later, newly marked ones are drawn in next frame
+        self._dirty |= hidden
+        if self._dirty - hidden:
+            self._schedule(self.interval)
+        elif hidden:
+            self._schedule(max(self.interval, self.hidden_interval))
@@ -0,0 +1,171 @@
+# Replays recorded packets, so app can be run and tested without base station
+# Packets can be read from csv files written by recorder (also old [time, packet] files)
+# or from binary flight logs. They can be put straight into packet queue, or written
+# to a pseudo-terminal, so that serial reading code reads them like from a real port.
+#
+# speed = 1 replays in real time, speed = N replays N times faster,
+# speed = 0 replays as fast as app can take packets in.
+import csv
+import os
+import threading
+import time
+from datetime import datetime
+
+from telemetry_store import FIELD_NAMES
+
+
+# Reads (receive time, packet) pairs from csv file
+def read_csv_packets(path):
+    with open(path, newline="", encoding="UTF8") as csv_f:
+        reader = csv.reader(csv_f)
+        next(reader, None)  # header
+        for row in reader:
+            if not row:
+                continue
+            received_time = parse_time(row[0])
+            if received_time is None:
+                continue
+            # Old files have whole packet in second column
+            if len(row) == 2:
+                packet = row[1]
+            else:
+                packet = ",".join(row[1:1 + len(FIELD_NAMES)])
+            yield received_time, packet
+
+
+# Reads time written by recorder, old files only have hours, minutes and seconds
+def parse_time(text):
+    for fmt in ("%Y-%m-%d %H:%M:%S.%f", "%Y-%m-%d %H:%M:%S"):
+        try:
+            return datetime.strptime(text, fmt).timestamp()
+        except ValueError:
+            pass
+    try:
+        clock = datetime.strptime(text, "%H:%M:%S")
+    except ValueError:
+        return None
+    return datetime.combine(datetime.now().date(), clock.time()).timestamp()
+
+
+# Reads (receive time, packet) pairs from binary flight log
+def read_log_packets(path):
+    from flight_log import FlightLog, KIND_DATA
+
+    log = FlightLog(path)
+    kinds = log.records["kind"]
+    times = log.records["time"]
+    for i in range(len(log)):
+        if kinds[i] == KIND_DATA:
+            yield float(times[i]), log.raw(i).decode("ascii", errors="replace")
+
+
+# Picks reader by file extension
+def read_packets(path):
+    if path.endswith(".rqlog"):
+        return read_log_packets(path)
+    return read_csv_packets(path)
+
+
+# Base for replay sources, handles timing in its own thread
+class _Replay:
+    def __init__(self, packets, speed=1.0, loop=False):
+        self.packets = packets
+        self.speed = speed
+        self.loop = loop
+        self.sent = 0
+        self.started_at = None
+        self.finished_at = None
+        self._running = False
+        self._thread = None
+
+    @property
+    def finished(self):
+        return self.finished_at is not None
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+
+    # Packets per second that have been sent so far
+    def rate(self):
+        if self.started_at is None:
+            return 0.0
+        end = self.finished_at if self.finished_at is not None else time.perf_counter()
+        return self.sent / max(end - self.started_at, 1e-9)
+
+    def _run(self):
+        self.started_at = time.perf_counter()
+        # When looping, every next round is moved forward in time, so time never goes back
+        shift = 0.0
+        while self._running:
+            first_time = None
+            last_time = None
+            for received_time, packet in self.packets():
+                if not self._running:
+                    break
+                if first_time is None:
+                    first_time = received_time
+                    replay_start = time.perf_counter()
+                # Waits until packet is due, in real time divided by speed
+                if self.speed > 0:
+                    delay = (received_time - first_time) / self.speed - (time.perf_counter() - replay_start)
+                    if delay > 0:
+                        time.sleep(delay)
+                self._send(received_time + shift, packet)
+                self.sent += 1
+                last_time = received_time
+            if not self.loop or first_time is None:
+                break
+            shift += last_time - first_time + 1.0
+        self.finished_at = time.perf_counter()
+
+    def _send(self, received_time, packet):
+        raise NotImplementedError()
+
+
+# Puts packets straight into packet queue that GUI reads from
+class ReplaySource(_Replay):
+    def __init__(self, path, packet_queue, speed=1.0, loop=False):
+        super().__init__(lambda: read_packets(path), speed, loop)
+        self.path = path
+        self.packet_queue = packet_queue
+
+    def _send(self, received_time, packet):
+        # When replaying as fast as possible, waits for GUI instead of dropping packets
+        if self.speed <= 0:
+            while self.packet_queue.free() == 0 and self._running:
+                time.sleep(0.001)
+        self.packet_queue.put((received_time, packet))
+
+
+# Writes packets to pseudo-terminal, other end can be opened as serial port
+# Works only on Linux and macOS
+class PtyReplay(_Replay):
+    def __init__(self, path, speed=1.0, loop=False):
+        if os.name == "nt":
+            raise OSError("Replay through pseudo-terminal works only on Linux and macOS, replay without --pty")
+        # Imported here, tty module doesn't exist on Windows and replay module is used there too
+        import tty
+
+        super().__init__(lambda: read_packets(path), speed, loop)
+        self.path = path
+        self._master, self._slave = os.openpty()
+        # Raw mode, so terminal doesn't change line endings
+        tty.setraw(self._slave)
+        # Name of port that serial reading code should open
+        self.port = os.ttyname(self._slave)
+
+    def _send(self, received_time, packet):
+        # Base station ends every line with \r\n
+        os.write(self._master, packet.encode("ascii", errors="replace") + b"\r\n")
+
+    def close(self):
+        self.stop()
+        os.close(self._master)
+        os.close(self._slave)
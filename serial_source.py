@@ -0,0 +1,201 @@
+# Reads data from base station through serial port
+# Port is read with asyncio: the loop waits until port has data and then reads
+# everything that has arrived in one go, lines are split from these chunks here.
+# So there is no blocking readline call for every packet.
+# If no port is given, base station is searched for among USB serial ports.
+# If connection is lost, port is opened again, waiting longer after every failed try.
+import asyncio
+import glob
+import logging
+import os
+import sys
+import threading
+import time
+
+import serial
+
+import instrumentation
+
+try:
+    from serial.tools import list_ports
+except ImportError:
+    list_ports = None
+
+
+log = logging.getLogger(__name__)
+
+# Ports where base station shows up on Linux
+PORT_PATTERNS = ["/dev/ttyUSB*", "/dev/ttyACM*"]
+
+
+# Returns ports that base station could be connected to, USB ports first
+def find_ports():
+    ports = []
+    for pattern in PORT_PATTERNS:
+        ports += sorted(glob.glob(pattern))
+    if list_ports is not None:
+        for info in list_ports.comports():
+            # Built-in serial ports of Linux PCs are never base station
+            if not info.device.startswith("/dev/ttyS"):
+                ports.append(info.device)
+    # Removes duplicates, keeps order
+    return list(dict.fromkeys(ports))
+
+
+# Splits incoming bytes into lines, keeps unfinished line until rest of it arrives
+class FrameSplitter:
+    def __init__(self, max_line=4096):
+        self.max_line = max_line
+        self._buffer = b""
+
+    # Returns complete lines in data, without line endings
+    def feed(self, data):
+        self._buffer += data
+        if b"\n" not in data:
+            # Line without end would grow forever if something is wrong with data
+            if len(self._buffer) > self.max_line:
+                self._buffer = b""
+            return []
+        lines = self._buffer.split(b"\n")
+        self._buffer = lines.pop()
+        return [line.rstrip(b"\r") for line in lines if line.strip()]
+
+
+class SerialSource:
+    def __init__(self, on_lines, port=None, baudrate=9600, min_backoff=0.25, max_backoff=8.0,
+                 chunk_size=4096):
+        # Called from reading thread with (time when chunk was received, list of lines)
+        self.on_lines = on_lines
+        # None means that port is searched for
+        self.port = port
+        self.baudrate = baudrate
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.chunk_size = chunk_size
+
+        # Counters for checking how reading goes
+        self.connected_port = None
+        self.bytes_read = 0
+        self.lines_read = 0
+        self.reads = 0
+        self.reconnects = 0
+        self.last_error = None
+
+        self._loop = None
+        self._stopped = None
+        self._stopping = False
+        self._thread = None
+
+    # Starts reading in its own thread
+    def start(self):
+        self._thread = threading.Thread(target=self.run, daemon=True)
+        self._thread.start()
+
+    # Stops reading and closes port, can be called from any thread
+    def stop(self):
+        self._stopping = True
+        if self._loop is not None and self._stopped is not None:
+            self._loop.call_soon_threadsafe(lambda: self._stopped.done() or self._stopped.set_result(None))
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+
+    # Reads until stopped, blocks the thread it is called from
+    def run(self):
+        self._loop = asyncio.new_event_loop()
+        try:
+            self._loop.run_until_complete(self._main())
+        finally:
+            self._loop.close()
+
+    async def _main(self):
+        self._stopped = self._loop.create_future()
+        # stop was called before loop had started
+        if self._stopping:
+            self._stopped.set_result(None)
+        backoff = self.min_backoff
+        while not self._stopped.done():
+            port = self.port
+            if port is None:
+                ports = find_ports()
+                port = ports[0] if ports else None
+            try:
+                if port is None:
+                    raise serial.SerialException("No serial port found")
+                base_station = serial.Serial(port, self.baudrate, timeout=0)
+            except (serial.SerialException, OSError, ValueError) as error:
+                self.last_error = str(error)
+                instrumentation.count("serial.connect_errors")
+                log.warning("No Connection: %s", error)
+            else:
+                self.connected_port = port
+                log.info("Connected to %s", port)
+                backoff = self.min_backoff
+                try:
+                    await self._read(base_station)
+                except (serial.SerialException, OSError) as error:
+                    self.last_error = str(error)
+                    instrumentation.count("serial.read_errors")
+                    log.warning("Reading %s failed: %s", port, error)
+                finally:
+                    base_station.close()
+                    self.connected_port = None
+                if self._stopped.done():
+                    break
+                log.warning("Disconnecting from %s", port)
+                self.reconnects += 1
+                instrumentation.count("serial.reconnects")
+
+            # Waits before trying again, every failed try doubles waiting time
+            await asyncio.wait([self._stopped], timeout=backoff)
+            backoff = min(backoff * 2, self.max_backoff)
+
+    async def _read(self, base_station):
+        splitter = FrameSplitter()
+        if sys.platform == "win32" or not hasattr(self._loop, "add_reader"):
+            # Windows has no file descriptors for serial ports, checks for data every 20 ms
+            while not self._stopped.done():
+                waiting = base_station.in_waiting
+                if waiting:
+                    with instrumentation.timed("serial.read"):
+                        data = base_station.read(waiting)
+                    self._received(splitter, data)
+                else:
+                    await asyncio.wait([self._stopped], timeout=0.02)
+            return
+
+        fd = base_station.fileno()
+        lost = self._loop.create_future()
+
+        # Called by loop when port has data
+        def readable():
+            try:
+                with instrumentation.timed("serial.read"):
+                    data = os.read(fd, self.chunk_size)
+            except OSError as error:
+                data = b""
+                self.last_error = str(error)
+                instrumentation.count("serial.read_errors")
+            if not data:
+                # Port has been closed or unplugged
+                if not lost.done():
+                    lost.set_result(None)
+                return
+            self._received(splitter, data)
+
+        self._loop.add_reader(fd, readable)
+        try:
+            await asyncio.wait([lost, self._stopped], return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            self._loop.remove_reader(fd)
+
+    def _received(self, splitter, data):
+        received_time = time.time()
+        self.reads += 1
+        self.bytes_read += len(data)
+        lines = splitter.feed(data)
+        instrumentation.count("serial.bytes", len(data))
+        if lines:
+            self.lines_read += len(lines)
+            instrumentation.count("serial.lines", len(lines))
+            with instrumentation.timed("serial.handle"):
+                self.on_lines(received_time, lines)
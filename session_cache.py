@@ -0,0 +1,387 @@
+# Recorded sessions opened for analysis after flight
+# Csv files (and flight logs) are converted once to a column cache next to them: one
+# .npy file for every column, plus a min/max overview of every overview_bucket samples.
+# Next time the cache is opened with numpy memmap, so nothing is parsed and only the
+# parts of columns that are drawn are read from disk. Multi-hour sessions with millions
+# of rows open in about a second and zooming only reads what is shown.
+#
+# Cache of data1234.csv is in data1234.csv.cache/ and is made again when the file changes.
+# It can be made before opening: python session_cache.py data1234.csv
+import json
+import os
+import shutil
+import sys
+import time
+from datetime import datetime
+
+import numpy
+
+from telemetry_store import FIELD_NAMES, COLUMNS
+from decimation import reduce_minmax, vertical_lines
+from derived import DerivedPipeline
+from replay import parse_time
+import packet_parser
+
+
+CACHE_VERSION = 1
+# Samples in one bucket of overview
+OVERVIEW_BUCKET = 256
+# Lines parsed at once when cache is made
+CHUNK_LINES = 65536
+
+
+def cache_directory(path):
+    return path + ".cache"
+
+
+# Opens recorded csv file or flight log, cache is made first if it isn't there or is too old
+# With derived=True columns of derived values (see derived.py) are computed if file doesn't have them
+def open_session(path, derived=True):
+    directory = cache_directory(path)
+    meta = _read_meta(directory)
+    needed = DerivedPipeline().names if derived else []
+    stat = os.stat(path)
+    if (meta is None or meta["version"] != CACHE_VERSION or meta["source_size"] != stat.st_size
+            or meta["source_mtime"] != stat.st_mtime or not set(needed) <= set(meta["columns"])):
+        meta = build_cache(path, derived)
+    return Session(path, directory, meta)
+
+
+def _read_meta(directory):
+    try:
+        with open(os.path.join(directory, "meta.json"), encoding="UTF8") as meta_f:
+            return json.load(meta_f)
+    except (OSError, ValueError):
+        return None
+
+
+# Converts file to column cache, returns its description
+def build_cache(path, derived=True):
+    directory = cache_directory(path)
+    temporary = directory + ".tmp"
+    shutil.rmtree(temporary, ignore_errors=True)
+    os.makedirs(temporary)
+    stat = os.stat(path)
+    started = time.perf_counter()
+
+    if path.endswith(".rqlog"):
+        columns, rows = _convert_log(path, temporary)
+    else:
+        columns, rows = _convert_csv(path, temporary)
+
+    # Rows have to be in time order for searching, merged data can be slightly out of order
+    data = {name: _open_column(temporary, name, "r+") for name in columns}
+    times = data["time"][:rows]
+    if rows > 1 and (numpy.diff(times) < 0).any():
+        order = numpy.argsort(times, kind="stable")
+        for name in columns:
+            data[name][:rows] = data[name][:rows][order]
+
+    if derived:
+        missing = [name for name in DerivedPipeline().names if name not in columns]
+        if missing:
+            _add_derived(temporary, data, rows, missing)
+            columns += missing
+            data = {name: _open_column(temporary, name, "r+") for name in columns}
+
+    _write_overview(temporary, data, columns, rows)
+    meta = {
+        "version": CACHE_VERSION,
+        "source_size": stat.st_size,
+        "source_mtime": stat.st_mtime,
+        "rows": rows,
+        "columns": columns,
+        "overview_bucket": OVERVIEW_BUCKET,
+        "build_seconds": time.perf_counter() - started,
+    }
+    with open(os.path.join(temporary, "meta.json"), "w", encoding="UTF8") as meta_f:
+        json.dump(meta, meta_f, indent=1)
+    # numpy memmaps have to be closed before directory is moved
+    del data, times
+    shutil.rmtree(directory, ignore_errors=True)
+    os.rename(temporary, directory)
+    return meta
+
+
+def _column_path(directory, name):
+    return os.path.join(directory, f"{name}.npy")
+
+
+def _new_column(directory, name, size):
+    # Empty memmap can't be made, so there is always room for at least one row
+    return numpy.lib.format.open_memmap(_column_path(directory, name), mode="w+",
+                                        dtype=numpy.float64, shape=(max(size, 1),))
+
+
+def _open_column(directory, name, mode="r"):
+    return numpy.load(_column_path(directory, name), mmap_mode=mode)
+
+
+# Csv file written by recorder: time and 16 values, maybe derived values after them
+# Old files have time and whole packet in two columns
+def _convert_csv(path, directory):
+    # Lines are counted first, so columns can be made with their final size
+    with open(path, "rb") as csv_f:
+        lines = sum(block.count(b"\n") for block in iter(lambda: csv_f.read(1 << 24), b""))
+
+    with open(path, "rb") as csv_f:
+        header = csv_f.readline().decode("UTF8", errors="replace").strip().split(",")
+        columns = COLUMNS + [name.strip() for name in header[len(COLUMNS):]]
+        field_count = len(columns) - 1
+        data = {name: _new_column(directory, name, lines) for name in columns}
+
+        rows = 0
+        while True:
+            chunk = csv_f.readlines(CHUNK_LINES * 128)
+            if not chunk:
+                break
+            times, values = _parse_csv_lines(chunk, field_count)
+            n = len(times)
+            data["time"][rows:rows + n] = times
+            for i, name in enumerate(columns[1:]):
+                data[name][rows:rows + n] = values[:, i]
+            rows += n
+    for column in data.values():
+        column.flush()
+    return columns, rows
+
+
+# Layout is found from every row like replay does, old files can have the full header
+# but whole packet quoted in one column
+def _parse_csv_lines(lines, field_count):
+    heads = []
+    rests = []
+    for line in lines:
+        parts = line.rstrip(b"\r\n").split(b",", 1)
+        if len(parts) == 2:
+            heads.append(parts[0])
+            rests.append(parts[1].strip(b'"') if parts[1][:1] == b'"' else parts[1])
+    times = _parse_times(heads)
+    values, field_ok, line_ok = packet_parser.parse_lines(rests, field_count=field_count)
+    # Same rows as live graphs get: known time and at least one value from packet
+    usable = numpy.isfinite(times) & field_ok[:, :len(FIELD_NAMES)].any(axis=1)
+    return times[usable], values[usable]
+
+
+# Layouts of times that are read as numbers without strptime, 0 is a digit
+# Strings are checked against layout first, NumPy's own string to datetime cast crashes
+# with many strings that aren't dates.
+TIME_LAYOUTS = [b"0000-00-00 00:00:00.000", b"0000-00-00 00:00:00", b"00:00:00"]
+
+
+# Local times written by recorder to seconds since 1970, NaN if time can't be read
+def _parse_times(texts):
+    result = numpy.full(len(texts), numpy.nan)
+    if not texts:
+        return result
+    lengths = numpy.fromiter(map(len, texts), dtype=numpy.int64, count=len(texts))
+    width = max(int(lengths.max()), len(TIME_LAYOUTS[0]))
+    chars = numpy.array(texts, dtype=f"S{width}").view(numpy.uint8).reshape(len(texts), width)
+
+    local = numpy.zeros(len(texts), dtype=bool)
+    for layout in TIME_LAYOUTS:
+        rows = numpy.flatnonzero(lengths == len(layout))
+        if len(rows) == 0:
+            continue
+        seconds, ok = _read_layout(chars[rows, :len(layout)], layout)
+        result[rows[ok]] = seconds[ok]
+        local[rows[ok]] = True
+
+    # Anything else (other format, broken time) is read one by one, like in replay
+    for i in numpy.flatnonzero(~local).tolist():
+        value = parse_time(texts[i].decode("ascii", errors="replace"))
+        if value is not None:
+            result[i] = value
+
+    if local.any():
+        # Local time has the same UTC offset during whole hour, so offset is found once for every hour
+        seconds = result[local]
+        hours, inverse = numpy.unique(numpy.floor(seconds / 3600), return_inverse=True)
+        starts = numpy.array([time.mktime(time.gmtime(hour * 3600)[:8] + (-1,)) for hour in hours.tolist()])
+        result[local] = starts[inverse.ravel()] + (seconds - hours[inverse.ravel()] * 3600)
+    return result
+
+
+# Times of rows that match layout as local seconds since 1970, and which rows matched
+# Time without date is from today, like parse_time reads it
+def _read_layout(chars, layout):
+    pattern = numpy.frombuffer(layout, dtype=numpy.uint8)
+    is_digit = pattern == ord("0")
+    digits = chars.astype(numpy.int64) - ord("0")
+    ok = numpy.where(is_digit, (digits >= 0) & (digits <= 9), chars == pattern).all(axis=1)
+
+    def number(start, end):
+        value = numpy.zeros(len(chars), dtype=numpy.int64)
+        for i in range(start, end):
+            value = value * 10 + digits[:, i]
+        return value
+
+    if len(layout) > 8:
+        year, month, day = number(0, 4), number(5, 7), number(8, 10)
+        months = (year - 1970) * 12 + month - 1
+        first = months.astype("datetime64[M]").astype("datetime64[D]").astype(numpy.int64)
+        following = (months + 1).astype("datetime64[M]").astype("datetime64[D]").astype(numpy.int64)
+        ok &= (month >= 1) & (month <= 12) & (day >= 1) & (day <= following - first)
+        days = first + day - 1
+        clock = 11
+    else:
+        days = (numpy.datetime64(datetime.now().date(), "D") - numpy.datetime64(0, "D")).astype(numpy.int64)
+        clock = 0
+    hour, minute, second = number(clock, clock + 2), number(clock + 3, clock + 5), number(clock + 6, clock + 8)
+    ok &= (hour < 24) & (minute < 60) & (second < 60)
+    seconds = (days * 86400 + hour * 3600 + minute * 60 + second).astype(numpy.float64)
+    if len(layout) > 20:
+        seconds += number(20, 23) / 1000.0
+    return seconds, ok
+
+
+# Binary flight log, columns are copied from records without parsing anything
+def _convert_log(path, directory, chunk_size=1 << 20):
+    from flight_log import FlightLog, KIND_DATA
+
+    log = FlightLog(path)
+    columns = ["time"] + list(log.fields)
+    data = {name: _new_column(directory, name, len(log)) for name in columns}
+    rows = 0
+    for start in range(0, len(log), chunk_size):
+        chunk = log.records[start:start + chunk_size]
+        chunk = chunk[(chunk["kind"] == KIND_DATA) & (chunk["mask"] != 0)]
+        n = len(chunk)
+        for name in columns:
+            data[name][rows:rows + n] = chunk[name]
+        rows += n
+    for column in data.values():
+        column.flush()
+    return columns, rows
+
+
+def _add_derived(directory, data, rows, names):
+    pipeline = DerivedPipeline()
+    columns = {name: _new_column(directory, name, rows) for name in names}
+    position = [pipeline.names.index(name) for name in names]
+    for start in range(0, rows, CHUNK_LINES):
+        stop = min(start + CHUNK_LINES, rows)
+        values = numpy.column_stack([data[name][start:stop] for name in FIELD_NAMES])
+        result = pipeline.process(data["time"][start:stop], values)
+        for name, i in zip(names, position):
+            columns[name][start:stop] = result[:, i]
+    for column in columns.values():
+        column.flush()
+
+
+# Min and max of every bucket for every column, time of first sample of every bucket
+def _write_overview(directory, data, columns, rows):
+    times = data["time"][:rows]
+    edges = numpy.arange(0, rows, OVERVIEW_BUCKET)
+    numpy.save(os.path.join(directory, "time.overview.npy"), numpy.array(times[edges]))
+    for name in columns:
+        if name == "time":
+            continue
+        if rows == 0:
+            overview = numpy.empty((2, 0))
+        else:
+            values = data[name][:rows]
+            overview = numpy.vstack(reduce_minmax(times, values, values, OVERVIEW_BUCKET)[1:])
+        numpy.save(os.path.join(directory, f"{name}.overview.npy"), overview)
+
+
+# Opened session, it can be used instead of store by graphs and map
+class Session:
+    def __init__(self, path, directory, meta):
+        self.path = path
+        self.columns = meta["columns"]
+        self.rows = meta["rows"]
+        self.overview_bucket = meta["overview_bucket"]
+        self.build_seconds = meta.get("build_seconds")
+        self._data = {name: _open_column(directory, name)[:self.rows] for name in self.columns}
+        self._overviewTimes = numpy.load(os.path.join(directory, "time.overview.npy"))
+        self._overview = {name: numpy.load(os.path.join(directory, f"{name}.overview.npy"))
+                          for name in self.columns if name != "time"}
+        self._lastRange = None
+
+    # Same as in store, data doesn't change after it has been opened
+    def __len__(self):
+        return self.rows
+
+    @property
+    def total(self):
+        return self.rows
+
+    # View of newest n values of column (all by default), values are read from disk when used
+    def column(self, name, n=None):
+        values = self._data[name]
+        if n is None:
+            return values
+        return values[len(values) - n:]
+
+    @property
+    def first_time(self):
+        return float(self._data["time"][0]) if self.rows else 0.0
+
+    @property
+    def last_time(self):
+        return float(self._data["time"][-1]) if self.rows else 0.0
+
+    # Rows received between start_time and end_time, as (start, stop)
+    def time_range(self, start_time, end_time):
+        if self._lastRange is not None and self._lastRange[0] == (start_time, end_time):
+            return self._lastRange[1]
+        times = self._data["time"]
+        rows = (int(numpy.searchsorted(times, start_time, side="left")),
+                int(numpy.searchsorted(times, end_time, side="right")))
+        # Every graph line asks for the same range, so it is searched only once
+        self._lastRange = ((start_time, end_time), rows)
+        return rows
+
+    # Returns x and y arrays to draw column between x_min and x_max with about pixels points
+    # Like MinMaxPyramid.decimate, but zoomed out views are made from overview
+    def decimate(self, name, x_min, x_max, pixels):
+        times = self._data["time"]
+        values = self._data[name]
+        start, stop = self.time_range(x_min, x_max)
+        # One sample on both sides, so line goes to the edge of graph
+        start = max(start - 1, 0)
+        stop = min(stop + 1, self.rows)
+        count = stop - start
+        pixels = max(int(pixels), 1)
+        if count <= 2 * pixels:
+            return numpy.array(times[start:stop]), numpy.array(values[start:stop])
+        size = -(-count // pixels)
+        if size < self.overview_bucket:
+            # Only the shown part is read from disk and reduced
+            part = values[start:stop]
+            return vertical_lines(*reduce_minmax(times[start:stop], part, part, size))
+        first = start // self.overview_bucket
+        last = -(-stop // self.overview_bucket)
+        overview = self._overview[name]
+        group = -(-(last - first) // pixels)
+        return vertical_lines(*reduce_minmax(self._overviewTimes[first:last], overview[0, first:last],
+                                             overview[1, first:last], group))
+
+    # Min and max of column in rows start...stop, whole buckets are taken from overview
+    def minmax(self, name, start, stop):
+        if stop <= start:
+            return numpy.nan, numpy.nan
+        bucket = self.overview_bucket
+        first = -(-start // bucket)
+        last = stop // bucket
+        parts = []
+        if last - first > 0:
+            overview = self._overview[name]
+            parts += [overview[0, first:last], overview[1, first:last]]
+            parts += [self._data[name][start:first * bucket], self._data[name][last * bucket:stop]]
+        else:
+            parts.append(self._data[name][start:stop])
+        values = numpy.concatenate(parts)
+        if not numpy.isfinite(values).any():
+            return numpy.nan, numpy.nan
+        return float(numpy.nanmin(values)), float(numpy.nanmax(values))
+
+
+if __name__ == "__main__":
+    # Makes cache of recorded session: python session_cache.py data1234.csv
+    if len(sys.argv) != 2:
+        print("Usage: python session_cache.py <csv file or flight log>")
+        sys.exit(1)
+    meta = build_cache(sys.argv[1])
+    print(f"{meta['rows']} rows, {len(meta['columns'])} columns, made in {meta['build_seconds']:.1f} s")
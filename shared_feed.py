@@ -0,0 +1,293 @@
+# Live telemetry in shared memory, for other programs on the same computer
+# Ingest daemon parses every packet and writes it to a TelemetryStore whose buffer is in
+# shared memory. Other programs (trajectory prediction, second operator screen, ...)
+# attach to it with SharedTelemetryReader and read the newest samples straight from
+# memory, without asking daemon for anything, so any number of them can read at once.
+#
+# Writer and readers are kept in step with a sequence counter (seqlock): writer makes it
+# odd before changing data and even after. Reader remembers the counter, reads, and
+# checks that counter is still the same, otherwise it reads again.
+#
+# Layout of shared memory block:
+#   128 bytes   header, 16 uint64 values (see below)
+#   4096 bytes  column names as JSON
+#   rest        mirrored ring buffer of TelemetryStore, float64, shape (columns, 2 * capacity)
+import json
+import os
+import sys
+import time
+
+import numpy
+from multiprocessing import shared_memory
+
+from telemetry_store import TelemetryStore, COLUMNS
+import packet_parser
+
+
+# Name of shared memory block that daemon creates
+DEFAULT_NAME = "rqbs_telemetry"
+
+MAGIC = 0x52514253544C4D31  # "RQBSTLM1"
+VERSION = 2
+HEADER_SIZE = 128
+NAMES_SIZE = 4096
+DATA_OFFSET = HEADER_SIZE + NAMES_SIZE
+
+# Positions of values in header
+H_MAGIC = 0
+H_VERSION = 1
+H_COLUMNS = 2
+H_CAPACITY = 3
+H_SEQUENCE = 4
+H_COUNT = 5
+H_STATE = 6
+H_NAMES = 7
+# Process that writes block, so that a block of a running writer isn't taken over
+H_PID = 8
+
+STATE_OPEN = 1
+STATE_CLOSED = 2
+
+
+def _header(shm):
+    return numpy.ndarray((HEADER_SIZE // 8,), dtype=numpy.uint64, buffer=shm.buf)
+
+
+# Opens existing block without letting this process remove it when it ends
+def _attach(name):
+    shm = shared_memory.SharedMemory(name=name)
+    # Before Python 3.13 every process that attaches registers block with resource tracker,
+    # which removes block when that process ends, even though daemon still uses it
+    if os.name == "posix":
+        try:
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(shm._name, "shared_memory")
+        except Exception:
+            pass
+    return shm
+
+
+# True if process with this id is running
+def _process_alive(pid):
+    if pid <= 0:
+        return False
+    if os.name == "nt":
+        import ctypes
+        kernel32 = ctypes.windll.kernel32
+        # PROCESS_QUERY_LIMITED_INFORMATION
+        handle = kernel32.OpenProcess(0x1000, False, pid)
+        if not handle:
+            return False
+        code = ctypes.c_ulong()
+        ok = kernel32.GetExitCodeProcess(handle, ctypes.byref(code))
+        kernel32.CloseHandle(handle)
+        # STILL_ACTIVE
+        return bool(ok) and code.value == 259
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+# Creates new block, block with the same name is replaced only if its writer has ended
+def _create(name, size):
+    try:
+        return shared_memory.SharedMemory(name=name, create=True, size=size)
+    except FileExistsError:
+        pass
+    old = _attach(name)
+    pid = 0
+    if old.size >= HEADER_SIZE:
+        header = _header(old)
+        # Blocks of older versions don't have writer's id, they are treated as left over
+        if int(header[H_MAGIC]) == MAGIC and int(header[H_VERSION]) == VERSION \
+                and int(header[H_STATE]) == STATE_OPEN:
+            pid = int(header[H_PID])
+        if _process_alive(pid):
+            del header
+            old.close()
+            raise FileExistsError(f"Shared memory {name} is used by process {pid}")
+        # Left from writer that didn't close properly, its readers are told to attach again
+        header[H_STATE] = STATE_CLOSED
+        del header
+    old.close()
+    # Opened again normally, so that removing it also clears resource tracker
+    stale = shared_memory.SharedMemory(name=name)
+    stale.close()
+    stale.unlink()
+    return shared_memory.SharedMemory(name=name, create=True, size=size)
+
+
+# Writer, used by ingest daemon
+class SharedTelemetry:
+    def __init__(self, name=DEFAULT_NAME, capacity=100000, columns=COLUMNS):
+        columns = list(columns)
+        names = json.dumps(columns).encode()
+        if len(names) > NAMES_SIZE:
+            raise ValueError("Too many columns for shared telemetry")
+        self.name = name
+        self.shm = _create(name, DATA_OFFSET + len(columns) * 2 * int(capacity) * 8)
+
+        self._header = _header(self.shm)
+        self.shm.buf[HEADER_SIZE:HEADER_SIZE + len(names)] = names
+        buffer = numpy.ndarray((len(columns), 2 * int(capacity)), dtype=numpy.float64,
+                               buffer=self.shm.buf, offset=DATA_OFFSET)
+        buffer[:] = numpy.nan
+        # Same store as GUI uses, only its buffer is in shared memory
+        self.store = TelemetryStore(capacity=capacity, columns=columns, buffer=buffer)
+
+        header = self._header
+        header[H_VERSION] = VERSION
+        header[H_COLUMNS] = len(columns)
+        header[H_CAPACITY] = int(capacity)
+        header[H_SEQUENCE] = 0
+        header[H_COUNT] = 0
+        header[H_NAMES] = len(names)
+        header[H_PID] = os.getpid()
+        header[H_STATE] = STATE_OPEN
+        # Magic is written last, readers don't use block before it is there
+        header[H_MAGIC] = MAGIC
+
+    # Adds parsed rows, shape (samples, columns)
+    def extend(self, rows):
+        if len(rows) == 0:
+            return
+        header = self._header
+        header[H_SEQUENCE] += 1
+        try:
+            self.store.extend(rows)
+            header[H_COUNT] = self.store.total
+        finally:
+            header[H_SEQUENCE] += 1
+
+    # Parses (receive time, packet) pairs and adds packets that have at least one good value
+    # Derived values are added with derived pipeline, if store has columns for them
+    def put_many(self, packets, derived=None):
+        if not packets:
+            return
+        received_times = numpy.array([packet[0] for packet in packets])
+        values, field_ok, line_ok = packet_parser.parse_lines([packet[1] for packet in packets])
+        usable = field_ok.any(axis=1)
+        rows = numpy.column_stack((received_times[usable], values[usable]))
+        if derived is not None:
+            rows = derived.extend_rows(rows)
+        self.extend(rows)
+
+    # Tells readers that data won't change anymore and removes block
+    def close(self):
+        if self.shm is None:
+            return
+        self._header[H_STATE] = STATE_CLOSED
+        # numpy arrays have to be gone before memory can be closed
+        self._header = None
+        self.store = None
+        self.shm.close()
+        try:
+            self.shm.unlink()
+        except FileNotFoundError:
+            pass
+        self.shm = None
+
+
+# Reader, can be used by any program on the same computer
+#   reader = SharedTelemetryReader()
+#   data, total = reader.read(100)     # copy of newest 100 samples, shape (columns, samples)
+#   altitude = reader.column("altitude", 100)
+class SharedTelemetryReader:
+    def __init__(self, name=DEFAULT_NAME):
+        self.name = name
+        self.shm = _attach(name)
+        self._header = _header(self.shm)
+        if int(self._header[H_MAGIC]) != MAGIC or int(self._header[H_VERSION]) != VERSION:
+            self.close()
+            raise ValueError(f"{name} isn't a telemetry block of this version")
+        names = int(self._header[H_NAMES])
+        self.columns = json.loads(bytes(self.shm.buf[HEADER_SIZE:HEADER_SIZE + names]))
+        self.index = {column: i for i, column in enumerate(self.columns)}
+        self.capacity = int(self._header[H_CAPACITY])
+        self._buffer = numpy.ndarray((len(self.columns), 2 * self.capacity), dtype=numpy.float64,
+                                     buffer=self.shm.buf, offset=DATA_OFFSET)
+
+    # Number of samples ever written
+    @property
+    def total(self):
+        return int(self._header[H_COUNT])
+
+    # True when writer has closed block, reader should attach again to get new data
+    @property
+    def closed(self):
+        return int(self._header[H_STATE]) != STATE_OPEN
+
+    # Returns view of newest n samples without copying and counter to check it with
+    # View is only valid if valid(counter) is still True after it has been used
+    def view(self, n=None):
+        while True:
+            sequence = int(self._header[H_SEQUENCE])
+            if sequence % 2 == 0:
+                break
+            # Writer is changing data right now
+            time.sleep(0)
+        count = int(self._header[H_COUNT])
+        size = min(count, self.capacity)
+        if n is None or n > size:
+            n = size
+        if n <= 0:
+            return self._buffer[:, :0], sequence
+        end = (count - 1) % self.capacity + self.capacity + 1
+        return self._buffer[:, end - n:end], sequence
+
+    # True if data hasn't changed since view returned counter
+    def valid(self, sequence):
+        return int(self._header[H_SEQUENCE]) == sequence
+
+    # Returns copy of newest n samples (all by default) and total number of samples then
+    def read(self, n=None):
+        while True:
+            data, sequence = self.view(n)
+            total = self.total
+            data = data.copy()
+            if self.valid(sequence):
+                return data, total
+
+    # Returns copy of newest n values of one column
+    def column(self, name, n=None):
+        return self.read(n)[0][self.index[name]]
+
+    # Waits until there are more samples than total, returns new total
+    def wait(self, total, timeout=1.0, interval=0.0002):
+        end = time.monotonic() + timeout
+        while True:
+            current = self.total
+            if current != total or self.closed or time.monotonic() >= end:
+                return current
+            time.sleep(interval)
+
+    def close(self):
+        if self.shm is None:
+            return
+        self._header = None
+        self._buffer = None
+        self.shm.close()
+        self.shm = None
+
+
+# Prints every new sample, useful to check that feed works:
+# python shared_feed.py [name]
+if __name__ == '__main__':
+    reader = SharedTelemetryReader(sys.argv[1] if len(sys.argv) > 1 else DEFAULT_NAME)
+    total = reader.total
+    try:
+        while not reader.closed:
+            if reader.wait(total) == total:
+                continue
+            data, new_total = reader.read()
+            new = min(new_total - total, data.shape[1])
+            for sample in data[:, data.shape[1] - new:].T:
+                print(", ".join(f"{name}={value:g}" for name, value in zip(reader.columns, sample)))
+            total = new_total
+    except KeyboardInterrupt:
+        pass
+    reader.close()
@@ -0,0 +1,256 @@
+# Several base stations at once
+# Every base station gets its own worker, which reads its serial port and records
+# its own csv file and flight log. By default workers are separate processes, so
+# reading, parsing and recording of every station runs on its own CPU core instead of
+# all of them sharing one Python thread. Workers send received lines to this process,
+# where they are given to the GUI twice: as they are for graphs of that station, and
+# merged with packets of other stations.
+#
+# When the same packet is received by more than one station, only the copy with the
+# best signal (highest RSSI, then highest SNR) is kept in merged data. Copies are
+# recognised by having the same values before RSSI and SNR, which are added by base station.
+import multiprocessing
+import os
+import queue
+import threading
+import time
+
+from packet_queue import PacketQueue
+from recorder import CsvRecorder
+from flight_log import FlightLogWriter
+import instrumentation
+from serial_source import SerialSource
+from derived import DerivedPipeline
+
+
+# Signal quality of packet, packets whose RSSI or SNR can't be read are the worst
+def signal_quality(packet):
+    quality = []
+    for text in packet.rsplit(",", 2)[-2:]:
+        try:
+            quality.append(float(text))
+        except ValueError:
+            quality.append(float("-inf"))
+    quality += [float("-inf")] * (2 - len(quality))
+    return tuple(quality)
+
+
+# Part of packet that is the same in every station that received it
+def packet_key(packet):
+    return packet.rsplit(",", 2)[0]
+
+
+# Merges packets from all stations, copies of one packet are turned into the best one
+# Packet is held back for window seconds, so that copies from other stations can
+# arrive, then released with the time when the first copy was received.
+# With window = 0 packets are only merged when copies arrive in the same batch.
+class PacketMerger:
+    def __init__(self, window=0.5):
+        self.window = window
+        # key -> [first receive time, best packet, its quality, names of stations that had it]
+        # Ordered by first receive time, because packets are added in the order they arrive
+        self._pending = {}
+        # Number of copies that were removed
+        self.duplicates = 0
+        # Number of times a copy with better signal replaced the one that arrived first
+        self.replaced = 0
+
+    # Adds packets received by one station, returns packets that are ready
+    def add(self, station, received_time, packets):
+        released = []
+        for packet in packets:
+            key = packet_key(packet)
+            entry = self._pending.get(key)
+            if entry is not None and station not in entry[3]:
+                # Same packet from another station
+                self.duplicates += 1
+                entry[3].add(station)
+                quality = signal_quality(packet)
+                if quality > entry[2]:
+                    entry[1] = packet
+                    entry[2] = quality
+                    self.replaced += 1
+                continue
+            if entry is not None:
+                # Same station sent identical values again, that is a new packet
+                # Older one is released first, so that order stays the same
+                released += self._release_until(key)
+            self._pending[key] = [received_time, packet, signal_quality(packet), {station}]
+        released += self.flush(received_time)
+        return released
+
+    # Returns packets that have waited long enough, all of them if now is None
+    def flush(self, now=None):
+        released = []
+        for key, entry in list(self._pending.items()):
+            if now is not None and now - entry[0] < self.window:
+                break
+            del self._pending[key]
+            released.append((entry[0], entry[1]))
+        return released
+
+    def _release_until(self, key):
+        released = []
+        for pending_key in list(self._pending):
+            entry = self._pending.pop(pending_key)
+            released.append((entry[0], entry[1]))
+            if pending_key == key:
+                break
+        return released
+
+    def __len__(self):
+        return len(self._pending)
+
+
+# One base station
+class Station:
+    def __init__(self, name, port, baudrate=9600, csv_file=None, log_file=None, queue_size=10000,
+                 derived=False):
+        self.name = name
+        # None means that port is searched for
+        self.port = port
+        self.baudrate = baudrate
+        # Files where worker records everything that this station receives (None doesn't record)
+        self.csv_file = csv_file
+        self.log_file = log_file
+        # True if derived values (see derived.py) are recorded too
+        self.derived = derived
+        # Packets of only this station, for its own graphs
+        self.packets = PacketQueue(maxsize=queue_size)
+        self.received = 0
+        self.worker = None
+
+
+# Runs in worker process (or thread), reads one station until stop is set
+def _station_worker(name, port, baudrate, batches, stop, csv_file, log_file, derived):
+    # Recorder and log both need their own pipeline, as metrics remember earlier samples
+    recorder = CsvRecorder(csv_file, derived=DerivedPipeline() if derived else None) if csv_file else None
+    flight_log = FlightLogWriter(log_file, derived=DerivedPipeline() if derived else None) if log_file else None
+    if recorder is not None:
+        recorder.start()
+
+    def received(received_time, lines):
+        batches.put((name, received_time, lines))
+        # Recording is done here, so it also runs on worker's own core
+        if recorder is not None:
+            recorder.write_many(received_time, [line.decode("ascii", errors="replace") for line in lines])
+        if flight_log is not None:
+            flight_log.extend(received_time, lines)
+
+    source = SerialSource(received, port=port, baudrate=baudrate)
+    source.start()
+    try:
+        stop.wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        source.stop()
+        if recorder is not None:
+            recorder.close()
+        if flight_log is not None:
+            flight_log.close()
+        instrumentation.save(f"station-{name}")
+
+
+# Keeps all stations, starts their workers and passes their packets on
+class StationRegistry:
+    def __init__(self, merged_queue, processes=True, merge_window=0.5, on_merged=None,
+                 on_received=None, queue_size=10000):
+        # Merged packets of all stations go here, it is the same queue as with one station
+        self.merged_queue = merged_queue
+        # Workers are processes if True, threads if False
+        self.processes = processes
+        self.merger = PacketMerger(merge_window)
+        # Called with merged packets from a background thread, e.g. to record them
+        self.on_merged = on_merged
+        # Called with (station name, packets) for packets of every station
+        self.on_received = on_received
+        # Size of every station's own packet queue, 0 if nobody takes packets from them
+        self.queue_size = queue_size
+        self.stations = {}
+
+        if processes:
+            self._batches = multiprocessing.Queue()
+            self._stop = multiprocessing.Event()
+        else:
+            self._batches = queue.Queue()
+            self._stop = threading.Event()
+        self._running = False
+        self._thread = None
+
+    def __len__(self):
+        return len(self.stations)
+
+    def __iter__(self):
+        return iter(self.stations.values())
+
+    # Adds station, has to be called before start
+    def add(self, port, name=None, csv_file=None, log_file=None, baudrate=9600, derived=False):
+        if name is None:
+            name = os.path.basename(port) if port else f"station{len(self.stations) + 1}"
+        if name in self.stations:
+            raise ValueError(f"Station {name} has already been added")
+        station = Station(name, port, baudrate, csv_file, log_file, self.queue_size, derived)
+        self.stations[name] = station
+        return station
+
+    # Starts all workers and thread that passes their packets on
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        for station in self.stations.values():
+            args = (station.name, station.port, station.baudrate, self._batches, self._stop,
+                    station.csv_file, station.log_file, station.derived)
+            if self.processes:
+                station.worker = multiprocessing.Process(target=_station_worker, args=args,
+                                                         name=f"station-{station.name}", daemon=True)
+            else:
+                station.worker = threading.Thread(target=_station_worker, args=args, daemon=True)
+            station.worker.start()
+        self._thread = threading.Thread(target=self._pump, daemon=True)
+        self._thread.start()
+
+    # Stops workers, they write everything they have to their files before they end
+    def stop(self, timeout=5.0):
+        if not self._running:
+            return
+        self._stop.set()
+        for station in self.stations.values():
+            if station.worker is not None:
+                station.worker.join(timeout)
+        self._running = False
+        self._thread.join(timeout)
+
+    # Takes batches from workers, gives them to station queues and merges them
+    def _pump(self):
+        # Packets are held back at most merge window, so queue is checked at least that often
+        wait = max(self.merger.window / 2, 0.05)
+        while True:
+            try:
+                name, received_time, lines = self._batches.get(timeout=wait)
+            except queue.Empty:
+                self._pass_on(self.merger.flush(time.time()))
+                # Workers have ended and everything they sent has been taken
+                if not self._running:
+                    break
+                continue
+            packets = [line.decode("ascii", errors="replace") for line in lines]
+            station = self.stations[name]
+            station.received += len(packets)
+            instrumentation.count(f"station.{name}.packets", len(packets))
+            items = [(received_time, packet) for packet in packets]
+            station.packets.put_many(items)
+            if self.on_received is not None:
+                self.on_received(name, items)
+            self._pass_on(self.merger.add(name, received_time, packets))
+        self._pass_on(self.merger.flush())
+
+    def _pass_on(self, packets):
+        instrumentation.gauge("merge.pending", len(self.merger))
+        instrumentation.gauge("merge.duplicates", self.merger.duplicates)
+        if not packets:
+            return
+        self.merged_queue.put_many(packets)
+        if self.on_merged is not None:
+            self.on_merged(packets)
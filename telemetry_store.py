@@ -0,0 +1,144 @@
+# Columnar store for received telemetry
+# Keeps all values in one preallocated numpy array instead of a Python list per value,
+# so adding a sample costs the same no matter how long the flight has been going
+import numpy
+
+
+# Names of the values in every packet sent by Cansat, in the order they are sent
+FIELD_NAMES = ["latitude", "longitude", "speed", "altitude", "temp", "humidity", "pressure",
+               "eco2", "co2", "tvoc", "no2", "pm10", "pm25", "pm100", "rssi", "snr"]
+
+# Columns of the store - time when packet was received and then all packet values
+COLUMNS = ["time"] + FIELD_NAMES
+
+
+# Ring buffer with fixed capacity
+# Every sample is written twice - to position i and to position i + capacity.
+# Because of that the newest samples are always next to each other in memory,
+# so graphs can get a view of them without copying anything.
+# When the buffer is full, oldest samples are written to spill file (if it is given)
+# before they are overwritten, so nothing is lost during long flights or ground tests.
+class TelemetryStore:
+    def __init__(self, capacity=100000, columns=COLUMNS, spill_file=None, spill_chunk=4096, buffer=None):
+        self.columns = list(columns)
+        self.index = {name: i for i, name in enumerate(self.columns)}
+        self.capacity = int(capacity)
+        self.spill_file = spill_file
+        self.spill_chunk = int(spill_chunk)
+
+        # One row per column, so that every column is contiguous in memory
+        # Buffer can be given, e.g. when it is in shared memory, its shape has to be (columns, 2 * capacity)
+        if buffer is None:
+            buffer = numpy.full((len(self.columns), 2 * self.capacity), numpy.nan)
+        elif buffer.shape != (len(self.columns), 2 * self.capacity):
+            raise ValueError(f"Expected buffer with shape {(len(self.columns), 2 * self.capacity)}, got {buffer.shape}")
+        self._buffer = buffer
+        # How many samples have been added in total
+        self._count = 0
+        # How many of the oldest samples have left the buffer
+        # (they are in spill file, or dropped if there is no spill file)
+        self._spilled = 0
+
+    def __len__(self):
+        return min(self._count, self.capacity)
+
+    # Number of samples ever added, including spilled and dropped ones
+    @property
+    def total(self):
+        return self._count
+
+    # Number of samples that are no longer in memory
+    @property
+    def spilled(self):
+        return self._spilled
+
+    # Adds one sample, values have to be in the same order as columns
+    def append(self, row):
+        self._make_room(1)
+        pos = self._count % self.capacity
+        self._buffer[:, pos] = row
+        self._buffer[:, pos + self.capacity] = row
+        self._count += 1
+
+    # Adds many samples at once, rows has shape (samples, columns)
+    def extend(self, rows):
+        rows = numpy.asarray(rows, dtype=numpy.float64)
+        if rows.ndim != 2 or rows.shape[1] != len(self.columns):
+            raise ValueError(f"Expected rows with {len(self.columns)} columns, got shape {rows.shape}")
+
+        # Samples that don't fit into buffer would be overwritten in this same call,
+        # so they are written straight to spill file
+        if len(rows) > self.capacity:
+            # Everything that is in memory now will be overwritten as well
+            self._make_room(self.capacity)
+            extra = len(rows) - self.capacity
+            if self.spill_file is not None:
+                with open(self.spill_file, "ab") as spill_f:
+                    numpy.ascontiguousarray(rows[:extra]).tofile(spill_f)
+            self._spilled += extra
+            self._count += extra
+            rows = rows[extra:]
+
+        n = len(rows)
+        if n == 0:
+            return
+        self._make_room(n)
+
+        # Writes block in at most two parts, as it can wrap around end of ring
+        start = self._count % self.capacity
+        first = min(n, self.capacity - start)
+        block = rows.T
+        self._buffer[:, start:start + first] = block[:, :first]
+        self._buffer[:, start + self.capacity:start + self.capacity + first] = block[:, :first]
+        if first < n:
+            rest = n - first
+            self._buffer[:, :rest] = block[:, first:]
+            self._buffer[:, self.capacity:self.capacity + rest] = block[:, first:]
+        self._count += n
+
+    # Returns view of the newest n samples (all samples in memory by default),
+    # shape of view is (columns, samples)
+    def view(self, n=None):
+        size = len(self)
+        if n is None or n > size:
+            n = size
+        if n <= 0:
+            return self._buffer[:, :0]
+        end = (self._count - 1) % self.capacity + self.capacity + 1
+        return self._buffer[:, end - n:end]
+
+    # Returns view of one column, graphs can use it directly
+    def column(self, name, n=None):
+        return self.view(n)[self.index[name]]
+
+    # Returns copy of the newest sample, or None if nothing has been received yet
+    def latest(self):
+        if self._count == 0:
+            return None
+        return self.view(1)[:, 0].copy()
+
+    # Returns all samples that have been written to spill file, shape is (samples, columns)
+    def read_spilled(self):
+        if self.spill_file is None or self._spilled == 0:
+            return numpy.empty((0, len(self.columns)))
+        return numpy.memmap(self.spill_file, dtype=numpy.float64, mode="r",
+                            shape=(self._spilled, len(self.columns)))
+
+    # Makes sure that samples which will be overwritten by next n samples are saved to spill file
+    def _make_room(self, n):
+        needed = self._count + n - self.capacity
+        if needed <= self._spilled:
+            return
+        if self.spill_file is None:
+            self._spilled = needed
+            return
+
+        # Spills whole chunks at once, so the file isn't touched on every sample
+        target = -(-needed // self.spill_chunk) * self.spill_chunk
+        target = min(max(target, needed), self._count)
+        start = self._spilled % self.capacity
+        # Mirrored buffer makes the spilled range contiguous
+        chunk = self._buffer[:, start:start + (target - self._spilled)]
+        with open(self.spill_file, "ab") as spill_f:
+            numpy.ascontiguousarray(chunk.T).tofile(spill_f)
+        self._spilled = target